@@ -11,17 +11,50 @@ from tornado.httpserver import HTTPServer
 from tornado.ioloop import IOLoop
 
 from .constants import DEFAULT_API_SERVER_PORT, WELCOME_TEXT, \
-    ORIGAMI_CONFIG_DIR, ORIGAMI_DB_NAME, ORIGAMI_DEPLOY_LOGS_DIR
+    ORIGAMI_CONFIG_DIR, ORIGAMI_DB_NAME, ORIGAMI_DEPLOY_LOGS_DIR, \
+    DEMO_MAX_REPLICAS, DEFAULT_PLACEMENT_POLICY, DEFAULT_CELERY_QUEUE, \
+    ORIGAMI_ENV_RESOURCE_KEYS, ORIGAMI_BUILD_CONCURRENCY, BULK_MAX_DEMOS, \
+    DOCKER_BREAKER_RESET_TIMEOUT, TASK_BACKEND_LOCAL
+from .utils.manifest import get_manifest_digest, load_manifest
 from .utils.validation import validate_demo_bundle_zip, \
-    preprocess_demo_bundle_zip
+    preprocess_demo_bundle_zip, preprocess_delta_bundle_zip, get_demo_dir
 from .utils.file import validate_directory_access, get_origami_static_dir
+from .utils.resources import get_demo_resources
 from .exceptions import InvalidDemoBundleException, OrigamiConfigException, \
-    OrigamiDockerConnectionError
+    OrigamiDockerConnectionError, OrigamiCapacityException, \
+    OrigamiDockerUnavailableError
 from .api_response import resp_demo_does_not_exist, resp_invalid_deploy_params,\
     resp_invalid_demo_bundle, resp_demo_deployment_trig, resp_docker_api_error,\
-    resp_no_demo_instance_exist
+    resp_no_demo_instance_exist, resp_invalid_replica_count, \
+    resp_no_running_demo_instance, resp_invalid_balancing_strategy, \
+    resp_missing_request_param, resp_insufficient_capacity, \
+    resp_invalid_bulk_request, resp_bulk_job_triggered, \
+    resp_bulk_job_does_not_exist, resp_demo_removal_trig, \
+    resp_operation_does_not_exist, resp_docker_unavailable, \
+    resp_trace_does_not_exist, resp_rate_limited, \
+    resp_demo_instance_does_not_exist, resp_invalid_stats_window
 from . import tasks
-from .database import Demos
+from .balancer import ROUND_ROBIN, get_balancer
+from .bulk import BULK_DEPLOY, BULK_REMOVE, create_bulk_job, \
+    dispatch_bulk_job, get_bulk_job_status
+from .cache import demo_cache
+from .database import Demos, BulkJobs, Operations
+from .nodes import get_node
+from .operations import OPERATION_DEPLOY, OPERATION_REMOVE, \
+    create_operation, get_operation_stats, operation_to_dict
+from .placement import place_demo
+from .ratelimit import rate_limiter, get_retry_after
+from .reconcile import rebuild_state
+from .prepull import image_puller, get_dockerfile_images, get_prepull_stats
+from .readiness import get_readiness_probe
+from .resilience import BREAKER_CLOSED, call_counts, retry_counts, \
+    get_breaker_states
+from .retention import log_sweeper
+from .celery import get_task_backend
+from .executor import local_executor
+from .streaming import broker, make_tornado_app
+from .tracing import span, get_trace, get_slowest_traces
+from .uploads import get_uploaded_bundle
 
 STATIC_DIR = get_origami_static_dir()
 if not STATIC_DIR:
@@ -30,7 +63,23 @@ if not STATIC_DIR:
 
 app = Flask(__name__, static_folder=STATIC_DIR)
 CORS(app, resources={r"/*": {"origins": "*"}})
-server = HTTPServer(WSGIContainer(app))
+server = HTTPServer(make_tornado_app(WSGIContainer(app)))
+
+
+@app.before_request
+def limit_request_rate():
+    """
+    Refuses the requests of a client which used the budget of the route,
+    see `ratelimit.RateLimiter`. Limited requests get a 429 response with
+    a Retry-After header before the route does any work.
+    """
+    if request.url_rule is None or request.method == 'OPTIONS':
+        return None
+    retry_after = rate_limiter.acquire(request.remote_addr,
+                                       request.url_rule.rule)
+    if retry_after:
+        return resp_rate_limited(get_retry_after(retry_after))
+    return None
 
 
 @app.route('/deploy_trigger/<demo_id>', methods=['POST'])
@@ -38,11 +87,39 @@ def trigger_deploy(demo_id):
     """
     This triggers a deploy of a demo on the server, the request should
     be a POST request with `bundle_path` in request body as parameter,
-    this path should be local to the server.
+    this path should be local to the server. An optional `replicas`
+    parameter sets the number of container instances to run for the demo.
+
+    The demo is deployed on the node provided with the optional `node`
+    parameter, otherwise it stays on the node it was deployed on before or a
+    node is chosen with the `placement` policy (bin_pack, least_loaded or
+    free_memory). The deploy task is routed to the celery queue of the node.
+
+    Resource requests and limits declared in the origami env file of the
+    bundle can be overridden with the `cpu_request`, `memory_request`,
+    `cpu_limit`, `memory_limit` and `cpuset` parameters. The deploy is
+    refused if no node has enough free capacity for the requests of all
+    the replicas.
+
+    .. code-block:: bash
+
+        $ curl --include -X POST 127.0.0.1:9002/deploy_trigger/ff90c8 --data \
+            "bundle_path=/valid/test.zip&replicas=4&memory_request=16g"
+
+        HTTP/1.1 503 SERVICE UNAVAILABLE
+        Content-Type: application/json
+        Content-Length: 164
+        Server: TornadoServer/5.0.2
+
+        {
+          'response': 'InsufficientCapacity',
+          'message': 'No node has enough free resources for the demo',
+          'reason': 'No node has 2.00 CPUs and 65536 MiB of memory free'
+        }
 
-    * For now we are considering only local deployments so we are assuming \
-    that both the origami_daemon and origami_server are running on the same \
-    server so origami server can give the local path to execute the build.
+    * The bundle path is local to the daemon, an origami server which does \
+    not share a filesystem with the daemon uploads the bundle to `/uploads` \
+    first and sends the `upload_id` parameter instead.
 
     .. code-block:: bash
 
@@ -94,24 +171,148 @@ def trigger_deploy(demo_id):
     Args:
         demo_id: Id of the demo to be deployed
     """
+
+    def preprocess(bundle_path):
+        with span('validate'):
+            validate_demo_bundle_zip(bundle_path)
+        # The base images are pulled while the bundle is preprocessed when
+        # the node of the demo is already known.
+        demo = Demos.get_or_none(Demos.demo_id == demo_id)
+        node_name = request.form.get('node') or (demo and demo.node)
+        node = get_node(node_name) if node_name else None
+        if node:
+            image_puller.prefetch(node, get_dockerfile_images(bundle_path))
+        with span('extract'):
+            return preprocess_demo_bundle_zip(bundle_path, demo_id)
+
+    with span('deploy_trigger', demo_id=demo_id):
+        return _trigger_deploy(demo_id, preprocess)
+
+
+@app.route('/deploy_trigger/<demo_id>/delta', methods=['POST'])
+def trigger_delta_deploy(demo_id):
+    """
+    Redeploys a demo from a delta bundle, `bundle_path` is the path of a zip
+    of only the files which changed since the previous deploy of the demo,
+    the `deleted` parameter can be repeated with the paths of the files
+    which were removed. The bundle of the previous deploy is patched and
+    rebuilt, the other parameters are the same as for `/deploy_trigger`.
+
+    The changed files are found by diffing the bundle against the manifest
+    of `/demo/manifest/<demo_id>`, its `digest` can be sent as the
+    `base_digest` parameter to refuse the delta if the demo was redeployed
+    in between.
+
+    .. code-block:: bash
+
+        $ curl --include -X POST 127.0.0.1:9002/deploy_trigger/ff90c8/delta \
+            --data "bundle_path=/valid/delta.zip&deleted=old.py"
+
+        HTTP/1.1 200 OK
+        Content-Type: application/json
+        Content-Length: 103
+        Server: TornadoServer/5.0.2
+
+        {
+          'response': 'BundleValidated',
+          'message': 'Deploy has been triggred for bundle : /ff90c8, checks \
+            stats'
+        }
+
+    .. code-block:: bash
+
+        $ curl --include -X POST 127.0.0.1:9002/deploy_trigger/ff90c9/delta \
+            --data "bundle_path=/valid/delta.zip"
+
+        HTTP/1.1 400 BAD REQUEST
+        Content-Type: application/json
+        Content-Length: 146
+        Server: TornadoServer/5.0.2
+
+        {
+          'response': 'InvalidDemoBundle',
+          'message': 'The demo bundle provided is not valid',
+          'reason': 'No bundle to patch, deploy the full bundle first'
+        }
+
+    Args:
+        demo_id: Id of the demo to be redeployed
+    """
+
+    def preprocess(bundle_path):
+        with span('patch'):
+            return preprocess_delta_bundle_zip(
+                bundle_path, demo_id, request.form.getlist('deleted'),
+                request.form.get('base_digest', type=six.string_types[0]))
+
+    with span('deploy_trigger', demo_id=demo_id):
+        return _trigger_deploy(demo_id, preprocess)
+
+
+def _trigger_deploy(demo_id, preprocess):
+    """
+    Validates the parameters of a deploy request and hands the deploy over
+    to the worker of the node of the demo.
+
+    Args:
+        demo_id: Id of the demo to be deployed
+        preprocess (callable): Called with the bundle path, returns the
+            directory of the demo.
+    """
     try:
         # six.string_types returns a tuple which is fine for isinstance but here
         # the type must be a concrete type.
         bundle_path = request.form.get('bundle_path', type=six.string_types[0])
+        upload_id = request.form.get('upload_id', type=six.string_types[0])
+        replicas = request.form.get('replicas', type=int)
+        node_name = request.form.get('node', type=six.string_types[0])
+        policy = request.form.get(
+            'placement', DEFAULT_PLACEMENT_POLICY, type=six.string_types[0])
         logging.info(
             "Triggering deploy for demo_id : {} with bundle_path : {}".format(
                 demo_id, bundle_path))
 
+        if replicas is not None and not 0 < replicas <= DEMO_MAX_REPLICAS:
+            logging.warn('Invalid replica count : {}'.format(replicas))
+            return resp_invalid_replica_count(replicas)
+
+        if upload_id and not bundle_path:
+            bundle_path = get_uploaded_bundle(upload_id)
+
         if bundle_path:
-            validate_demo_bundle_zip(bundle_path)
-            demo_dir = preprocess_demo_bundle_zip(bundle_path, demo_id)
+            with span('preprocess'):
+                demo_dir = preprocess(bundle_path)
+            resources = get_demo_resources(demo_dir, {
+                key: request.form.get(key)
+                for key in ORIGAMI_ENV_RESOURCE_KEYS
+            })
+            # Refuse a bundle with an invalid readiness probe before it is
+            # built.
+            get_readiness_probe(demo_dir)
 
             # Demo bundle has been verified and preprocessed
             # Start a worker process to deploy the demo, this must be
             # asynchronous.
-            logging.info('Handing over the task to celery worker')
-            tasks.deploy_demo.delay(demo_id, demo_dir)
-            return resp_demo_deployment_trig(demo_dir)
+            with span('place'):
+                node = place_demo(demo_id, node_name, policy, resources,
+                                  replicas)
+            logging.info(
+                'Handing over the task to celery worker of node {}'.format(
+                    node.name))
+            with span('enqueue', node=node.name) as enqueue:
+                # The operation reserves the resources of the demo on the
+                # node, it is recorded right after the placement.
+                operation = create_operation(OPERATION_DEPLOY, demo_id,
+                                             node.name, node.queue,
+                                             resources=resources,
+                                             replicas=replicas)
+                tasks.deploy_demo.apply_async(
+                    args=(demo_id, demo_dir, replicas, node.name, resources,
+                          operation.operation_id),
+                    queue=node.queue)
+            image_puller.prefetch(node, get_dockerfile_images(demo_dir))
+            return resp_demo_deployment_trig(
+                demo_dir, operation.operation_id, enqueue.trace_id)
 
         else:
             logging.warn('Bundle Path is not provided in POST parameters')
@@ -121,6 +322,18 @@ def trigger_deploy(demo_id):
         logging.warn("Demo bundle is invalid : {}".format(e))
         return resp_invalid_demo_bundle(e)
 
+    except OrigamiCapacityException as e:
+        logging.warn("Not enough capacity for the demo : {}".format(e))
+        return resp_insufficient_capacity(e)
+
+    except OrigamiDockerUnavailableError as e:
+        logging.error("Docker engine unavailable : {}".format(e))
+        return resp_docker_unavailable(e, DOCKER_BREAKER_RESET_TIMEOUT)
+
+    except OrigamiDockerConnectionError as e:
+        logging.error("No node available for the demo : {}".format(e))
+        return resp_docker_api_error(e)
+
     except OrigamiConfigException:
         # If thie exception occurs, exit the server since it is not
         # configured properly.
@@ -128,6 +341,47 @@ def trigger_deploy(demo_id):
         sys.exit(1)
 
 
+@app.route('/demo/manifest/<demo_id>', methods=['GET'])
+def demo_manifest(demo_id):
+    """
+    Returns the manifest of the bundle the demo was last deployed from, the
+    path, size and sha256 of each of its files. Clients diff their bundle
+    against it to send only the changed files to
+    `/deploy_trigger/<demo_id>/delta`.
+
+    .. code-block:: bash
+
+        $ curl --include -X GET 127.0.0.1:9002/demo/manifest/ffc806
+
+        HTTP/1.1 200 OK
+        Content-Type: application/json
+        Content-Length: 312
+        Server: TornadoServer/5.0.2
+
+        {
+            "demo_id": "ffc806",
+            "digest": "5d1e0c...",
+            "files": {
+                "main.py": {
+                    "sha256": "9f86d0...",
+                    "size": 1204
+                }
+            }
+        }
+    """
+    try:
+        files = load_manifest(get_demo_dir(demo_id))
+    except InvalidDemoBundleException as e:
+        return resp_invalid_demo_bundle(e)
+    if files is None:
+        return resp_demo_does_not_exist(demo_id)
+    return jsonify({
+        'demo_id': demo_id,
+        'digest': get_manifest_digest(files),
+        'files': files
+    })
+
+
 @app.route('/demo/port/<demo_id>', methods=['GET'])
 def demo_port(demo_id):
     """
@@ -149,9 +403,14 @@ def demo_port(demo_id):
             "port": 20000
         }
     """
-    demo = Demos.get_or_none(Demos.demo_id == demo_id)
+    demo = demo_cache.get(demo_id)
     if demo:
-        tasks.update_demo_status(demo)
+        try:
+            tasks.update_demo_status(demo)
+        except OrigamiDockerUnavailableError as e:
+            return resp_docker_unavailable(e, DOCKER_BREAKER_RESET_TIMEOUT)
+        except OrigamiDockerConnectionError as e:
+            return resp_docker_api_error(e)
         # Returns the demo status
         return jsonify({'port': demo.port})
     else:
@@ -177,9 +436,22 @@ def demo_status(demo_id):
         {
             "demo_id": 1,
             "port": 20000,
-            "status": "running"
+            "status": "ready",
+            "replicas": 2,
+            "started_at": "2018-07-12T10:21:03.118092",
+            "ready_at": "2018-07-12T10:21:05.342517",
+            "time_to_ready": 2.224425,
+            "instances": [
+                {"replica": 0, "port": 20000, "status": "ready"},
+                {"replica": 1, "port": 20001, "status": "ready"}
+            ]
         }
 
+    The status is starting while the readiness probe of the demo is
+    running, ready once the demo is serving and failed if the probe did not
+    succeed before its timeout. time_to_ready is the number of seconds
+    between the start of the containers and the success of the probe.
+
 
     .. code-block:: bash
 
@@ -196,25 +468,129 @@ def demo_status(demo_id):
         }
 
     """
-    demo = Demos.get_or_none(Demos.demo_id == demo_id)
+    demo = demo_cache.get(demo_id)
     if demo:
         # Returns the demo status
         return jsonify({
             'demo_id': demo.id,
             'port': demo.port,
-            'status': demo.status
+            'status': demo.status,
+            'replicas': demo.replicas,
+            'started_at': demo.started_at and demo.started_at.isoformat(),
+            'ready_at': demo.ready_at and demo.ready_at.isoformat(),
+            'time_to_ready': demo.time_to_ready,
+            'instances': [{
+                'replica': instance.replica,
+                'port': instance.port,
+                'status': instance.status
+            } for instance in demo_cache.get_instances(demo_id)]
         })
     else:
         # No demo with the provided demo ID found, return bad request.
         return resp_demo_does_not_exist(demo_id)
 
 
+@app.route('/demo/instance/<demo_id>', methods=['GET'])
+def demo_instance(demo_id):
+    """
+    Returns one of the running instances of the demo to connect to. The
+    instance is chosen using the load balancing strategy provided with the
+    `strategy` query parameter, it can be one of
+
+    * round_robin: Instances are handed out one after the other (default).
+    * least_connections: The instance with the least active connections is
+        handed out. The client must release the instance using
+        `/demo/instance/<demo_id>/release` once it is done with it.
+
+    .. code-block:: bash
+
+        $ curl --include -X GET \
+            127.0.0.1:9002/demo/instance/ffc806?strategy=least_connections
+
+        HTTP/1.1 200 OK
+        Content-Type: application/json
+        Content-Length: 96
+        Server: TornadoServer/5.0.2
+
+        {
+            "instance_id": "4e2f9d5c1b7a",
+            "port": 20001,
+            "replica": 1,
+            "strategy": "least_connections"
+        }
+    """
+    strategy = request.args.get('strategy', ROUND_ROBIN)
+    balancer = get_balancer(strategy)
+    if not balancer:
+        return resp_invalid_balancing_strategy(strategy)
+
+    if not demo_cache.get(demo_id):
+        return resp_demo_does_not_exist(demo_id)
+
+    instances = [
+        i for i in demo_cache.get_instances(demo_id)
+        if i.status in ('ready', 'running')
+    ]
+    instance = balancer.acquire(demo_id, instances)
+    if not instance:
+        return resp_no_running_demo_instance(demo_id)
+
+    return jsonify({
+        'instance_id': instance.container_id,
+        'port': instance.port,
+        'replica': instance.replica,
+        'strategy': strategy
+    })
+
+
+@app.route('/demo/instance/<demo_id>/release', methods=['POST'])
+def release_demo_instance(demo_id):
+    """
+    Release an instance acquired using the `least_connections` strategy,
+    the request should have `instance_id` in the request body. Instances
+    which are not released count as connected for BALANCER_LEASE_TIMEOUT
+    seconds. A 404 is returned if the instance is not an instance of the
+    demo.
+
+    .. code-block:: bash
+
+        $ curl --include -X POST 127.0.0.1:9002/demo/instance/ffc806/release \
+            --data "instance_id=4e2f9d5c1b7a"
+
+        HTTP/1.1 200 OK
+        Content-Type: application/json
+        Content-Length: 34
+        Server: TornadoServer/5.0.2
+
+        {
+            "response": "InstanceReleased"
+        }
+    """
+    instance_id = request.form.get('instance_id', type=six.string_types[0])
+    if not instance_id:
+        return resp_missing_request_param('instance_id')
+
+    strategy = request.form.get('strategy', 'least_connections')
+    balancer = get_balancer(strategy)
+    if not balancer:
+        return resp_invalid_balancing_strategy(strategy)
+
+    # An instance replaced by a redeploy can still be released by the
+    # clients which acquired it.
+    if not balancer.release(demo_id, instance_id) and instance_id not in [
+            i.container_id for i in demo_cache.get_instances(demo_id)]:
+        return resp_demo_instance_does_not_exist(demo_id, instance_id)
+    return jsonify({'response': 'InstanceReleased'})
+
+
 @app.route('/demo/remove/<demo_id>', methods=['DELETE'])
 def remove_demo_instance(demo_id):
     """
     Remove demo docker container instance if it exist. This first checks
-    if the provided demo id has a container running, by first looking into
-    demo table and then checking containers.
+    if the provided demo id has containers in the demo table, the removal
+    is then handed over to the celery worker of the node of the demo. The
+    returned operation_id is used with /operations/<operation_id> to follow
+    the removal.
 
     .. code-block:: bash
 
@@ -222,12 +598,13 @@ def remove_demo_instance(demo_id):
 
         HTTP/1.1 200 OK
         Content-Type: application/json
-        Content-Length: 85
+        Content-Length: 164
         Server: TornadoServer/5.0.2
 
         {
-            "message": "Instance for demo(ffc806) removed",
-            "response": "RemovedDeployedInstance"
+            "message": "Removal of demo instance with id: ffc806 initiated",
+            "operation_id": "8f14e45fceea467a9c4b0e5d7a2b1c3d",
+            "response": "TriggeredRemoveDeployedInstance"
         }
 
 
@@ -245,23 +622,452 @@ def remove_demo_instance(demo_id):
             "response": "NoDemoInstance"
         }
     """
+    demo = Demos.get_or_none(Demos.demo_id == demo_id)
+    if not demo or not (demo.container_id or demo.instances.count()):
+        # No docker instance for the demo found.
+        return resp_no_demo_instance_exist(demo_id)
+
+    node = get_node(demo.node)
+    queue = node.queue if node else DEFAULT_CELERY_QUEUE
+    operation = create_operation(OPERATION_REMOVE, demo_id, demo.node, queue)
+    tasks.remove_demo_instance_if_exist.apply_async(
+        args=(demo_id, ), kwargs={'operation_id': operation.operation_id},
+        queue=queue)
+    return resp_demo_removal_trig(demo_id, operation.operation_id)
+
+
+def _get_bulk_items(payload, key):
+    """
+    Returns the list of demos of a bulk request body, entries of the list
+    can be demo IDs or dicts with a demo_id key.
+
+    Raises:
+        ValueError: The list is missing, empty, too long or has an invalid
+            entry.
+    """
+    entries = payload.get(key) if isinstance(payload, dict) else None
+    if not isinstance(entries, list) or not entries:
+        raise ValueError('A non empty list of demos is required in '
+                         '{}'.format(key))
+    if len(entries) > BULK_MAX_DEMOS:
+        raise ValueError('At most {} demos are allowed'.format(BULK_MAX_DEMOS))
+
+    items, demo_ids = [], set()
+    for entry in entries:
+        item = {'demo_id': entry} if not isinstance(entry, dict) else entry
+        demo_id = item.get('demo_id')
+        if not isinstance(demo_id, six.string_types) or not demo_id:
+            raise ValueError('Invalid demo entry {}'.format(entry))
+        if demo_id in demo_ids:
+            raise ValueError('Demo {} is listed twice'.format(demo_id))
+        demo_ids.add(demo_id)
+        items.append(item)
+    return items
+
+
+@app.route('/bulk/deploy', methods=['POST'])
+def bulk_deploy():
+    """
+    Triggers the deploy of many demos at once, for example to redeploy all
+    the demos after a base image change. The request body is a JSON object
+    with a `demos` list, each entry takes the same parameters as
+    /deploy_trigger. A default `placement` policy can be set for all the
+    demos.
+
+    Only the request is validated here, the bundles are validated and the
+    demos are deployed by the celery workers with at most
+    ORIGAMI_BUILD_CONCURRENCY demos building at the same time. The
+    returned job_id is used with /bulk/jobs/<job_id> to follow the job.
+
+    .. code-block:: bash
+
+        $ curl --include -X POST 127.0.0.1:9002/bulk/deploy \
+            -H 'Content-Type: application/json' --data '{"demos": [
+                {"demo_id": "ff90c8", "bundle_path": "/valid/a.zip"},
+                {"demo_id": "ff90c9", "bundle_path": "/valid/b.zip",
+                 "replicas": 2}
+            ]}'
+
+        HTTP/1.1 202 ACCEPTED
+        Content-Type: application/json
+        Content-Length: 131
+        Server: TornadoServer/5.0.2
+
+        {
+          "job_id": "c0b9f2a8d6e34e5c9f3f4c7e0a1b2d3e",
+          "message": "Bulk job c0b9f2a8d6e34e5c9f3f4c7e0a1b2d3e triggered \
+            for 2 demos",
+          "response": "BulkJobTriggered"
+        }
+    """
+    payload = request.get_json(silent=True)
     try:
-        demo = tasks.remove_demo_instance_if_exist.delay(demo_id)
-        if demo:
-            # A demo instance was found and was removed.
-            return jsonify({
-                'response':
-                'TriggeredRemoveDeployedInstance',
-                'message':
-                'Removal of demo instance with id: {} initiated'.format(demo_id)
-            }), 200
-        else:
-            # No docker instance for the demo found.
-            return resp_no_demo_instance_exist(demo_id)
+        items = _get_bulk_items(payload, 'demos')
+        for item in items:
+            if not isinstance(item.get('bundle_path'), six.string_types):
+                raise ValueError('bundle_path is required for demo {}'.format(
+                    item['demo_id']))
+            replicas = item.get('replicas')
+            valid = isinstance(replicas, int) and \
+                0 < replicas <= DEMO_MAX_REPLICAS
+            if replicas is not None and not valid:
+                raise ValueError('Replica count {} of demo {} is not '
+                                 'valid'.format(replicas, item['demo_id']))
+            item.setdefault('placement', payload.get('placement'))
+    except ValueError as e:
+        logging.warn('Invalid bulk deploy request : {}'.format(e))
+        return resp_invalid_bulk_request(e)
+
+    job = create_bulk_job(BULK_DEPLOY, items, ORIGAMI_BUILD_CONCURRENCY)
+    dispatch_bulk_job(job)
+    return resp_bulk_job_triggered(job.job_id, len(items))
+
+
+@app.route('/bulk/remove', methods=['POST'])
+def bulk_remove():
+    """
+    Triggers the removal of the containers of many demos at once. The
+    request body is a JSON object with a `demos` list of demo IDs.
 
-    except OrigamiDockerConnectionError as e:
-        # Error while communicating using Docker API.
-        return resp_docker_api_error(e)
+    .. code-block:: bash
+
+        $ curl --include -X POST 127.0.0.1:9002/bulk/remove \
+            -H 'Content-Type: application/json' \
+            --data '{"demos": ["ff90c8", "ff90c9"]}'
+
+        HTTP/1.1 202 ACCEPTED
+        Content-Type: application/json
+        Content-Length: 131
+        Server: TornadoServer/5.0.2
+
+        {
+          "job_id": "5d1e7c2b9a8f4e3d8c6b5a4f3e2d1c0b",
+          "message": "Bulk job 5d1e7c2b9a8f4e3d8c6b5a4f3e2d1c0b triggered \
+            for 2 demos",
+          "response": "BulkJobTriggered"
+        }
+    """
+    try:
+        items = _get_bulk_items(request.get_json(silent=True), 'demos')
+    except ValueError as e:
+        logging.warn('Invalid bulk remove request : {}'.format(e))
+        return resp_invalid_bulk_request(e)
+
+    job = create_bulk_job(BULK_REMOVE, items, ORIGAMI_BUILD_CONCURRENCY)
+    dispatch_bulk_job(job)
+    return resp_bulk_job_triggered(job.job_id, len(items))
+
+
+@app.route('/bulk/jobs/<job_id>', methods=['GET'])
+def bulk_job_status(job_id):
+    """
+    Returns the status of a bulk job and the outcome of each of its demos.
+    The job is pending, running or finished, each demo is pending, running,
+    succeeded or failed with the reason in message.
+
+    .. code-block:: bash
+
+        $ curl --include -X GET \
+            127.0.0.1:9002/bulk/jobs/c0b9f2a8d6e34e5c9f3f4c7e0a1b2d3e
+
+        HTTP/1.1 200 OK
+        Content-Type: application/json
+        Content-Length: 402
+        Server: TornadoServer/5.0.2
+
+        {
+          "job_id": "c0b9f2a8d6e34e5c9f3f4c7e0a1b2d3e",
+          "action": "deploy",
+          "status": "finished",
+          "total": 2,
+          "counts": {"pending": 0, "running": 0, "succeeded": 1, "failed": 1},
+          "items": [
+            {"demo_id": "ff90c8", "status": "succeeded", "message": null},
+            {"demo_id": "ff90c9", "status": "failed",
+             "message": "requirements.txt was not valid"}
+          ]
+        }
+    """
+    job = BulkJobs.get_or_none(BulkJobs.job_id == job_id)
+    if not job:
+        return resp_bulk_job_does_not_exist(job_id)
+    return jsonify(get_bulk_job_status(job))
+
+
+@app.route('/operations', methods=['GET'])
+def list_operations():
+    """
+    Returns the deploy and remove operations, most recently enqueued first.
+    The operations can be filtered with the `demo_id`, `kind` (deploy or
+    remove) and `status` (pending, running, succeeded or failed) query
+    parameters, `limit` sets the number of operations returned (50 by
+    default).
+
+    .. code-block:: bash
+
+        $ curl --include -X GET '127.0.0.1:9002/operations?demo_id=ffc806'
+
+        HTTP/1.1 200 OK
+        Content-Type: application/json
+        Content-Length: 392
+        Server: TornadoServer/5.0.2
+
+        {
+          "operations": [
+            {
+              "operation_id": "8f14e45fceea467a9c4b0e5d7a2b1c3d",
+              "kind": "deploy",
+              "demo_id": "ffc806",
+              "node": "local",
+              "queue": "celery",
+              "status": "running",
+              "stage": "building",
+              "message": null,
+              "enqueued_at": "2018-07-12T10:21:03.118092",
+              "started_at": "2018-07-12T10:21:03.342517",
+              "finished_at": null
+            }
+          ]
+        }
+    """
+    query = Operations.select().order_by(Operations.enqueued_at.desc(),
+                                         Operations.id.desc())
+    for key in ('demo_id', 'kind', 'status'):
+        value = request.args.get(key)
+        if value:
+            query = query.where(getattr(Operations, key) == value)
+    limit = request.args.get('limit', 50, type=int)
+    return jsonify({
+        'operations': [operation_to_dict(o) for o in query.limit(limit)]
+    })
+
+
+@app.route('/operations/stats', methods=['GET'])
+def operations_stats():
+    """
+    Returns the number of operations by status, the time they waited in
+    the queue and ran, and the throughput in operations finished per
+    minute. Only operations enqueued in the last `window` seconds (3600 by
+    default) are accounted, a window which is not positive is refused.
+    `kind` restricts the statistics to deploys or removals.
+
+    .. code-block:: bash
+
+        $ curl --include -X GET '127.0.0.1:9002/operations/stats?kind=deploy'
+
+        HTTP/1.1 200 OK
+        Content-Type: application/json
+        Content-Length: 402
+        Server: TornadoServer/5.0.2
+
+        {
+          "kind": "deploy",
+          "window": 3600,
+          "counts": {"pending": 1, "running": 2, "succeeded": 40,
+                     "failed": 3},
+          "queue_latency": {"count": 45, "mean": 0.84, "p50": 0.02,
+                            "p95": 6.1, "max": 9.7},
+          "duration": {"count": 43, "mean": 41.2, "p50": 35.0, "p95": 98.3,
+                       "max": 130.4},
+          "throughput": 0.716
+        }
+    """
+    window = request.args.get('window', 3600, type=int)
+    if window <= 0:
+        return resp_invalid_stats_window(window)
+    return jsonify(get_operation_stats(request.args.get('kind'), window))
+
+
+@app.route('/operations/<operation_id>', methods=['GET'])
+def operation_status(operation_id):
+    """
+    Returns the operation with the provided ID, see /operations.
+    """
+    operation = Operations.get_or_none(
+        Operations.operation_id == operation_id)
+    if not operation:
+        return resp_operation_does_not_exist(operation_id)
+    return jsonify(operation_to_dict(operation))
+
+
+@app.route('/traces', methods=['GET'])
+def list_traces():
+    """
+    Returns the slowest recorded traces, a trace covers a deploy from the
+    request to the API server to the switch to the new container. `name`
+    restricts the traces to the ones whose root span has this name, for
+    example deploy_trigger, `limit` sets the number of traces returned (20
+    by default).
+
+    .. code-block:: bash
+
+        $ curl --include -X GET '127.0.0.1:9002/traces?limit=1'
+
+        HTTP/1.1 200 OK
+        Content-Type: application/json
+        Content-Length: 163
+        Server: TornadoServer/5.0.2
+
+        {
+          "traces": [
+            {
+              "trace_id": "5d41402abc4b2a76b9719d911017c592",
+              "name": "deploy_trigger",
+              "start": 1531390863.118092,
+              "duration": 48.213,
+              "spans": 14
+            }
+          ]
+        }
+    """
+    limit = request.args.get('limit', 20, type=int)
+    return jsonify({
+        'traces': get_slowest_traces(request.args.get('name'), limit)
+    })
+
+
+@app.route('/traces/<trace_id>', methods=['GET'])
+def trace_detail(trace_id):
+    """
+    Returns the spans of a trace ordered by start time, the ID of the trace
+    of a deploy is returned by /deploy_trigger. `slowest` is the name of
+    the slowest step of the trace.
+
+    .. code-block:: bash
+
+        $ curl --include -X GET 127.0.0.1:9002/traces/5d41402abc4b2a76b9...
+
+        HTTP/1.1 200 OK
+        Content-Type: application/json
+        Content-Length: 1913
+        Server: TornadoServer/5.0.2
+
+        {
+          "trace_id": "5d41402abc4b2a76b9719d911017c592",
+          "start": 1531390863.118092,
+          "duration": 48.213,
+          "slowest": "build",
+          "spans": [
+            {
+              "span_id": "a87ff679a2f3e71d",
+              "parent_id": null,
+              "name": "deploy_trigger",
+              "start": 1531390863.118092,
+              "duration": 0.412,
+              "error": null,
+              "attributes": {"demo_id": "ffc806"}
+            },
+            ...
+          ]
+        }
+    """
+    trace = get_trace(trace_id)
+    if trace is None:
+        return resp_trace_does_not_exist(trace_id)
+    return jsonify(trace)
+
+
+@app.route('/health', methods=['GET'])
+def health():
+    """
+    Returns the health of the daemon and the state of the circuit breakers
+    of the docker engines of the nodes, merged from the API server and the
+    celery workers. The status is degraded while any breaker is not closed,
+    calls to an engine whose breaker is open fail fast until `retry_at`.
+
+    .. code-block:: bash
+
+        $ curl --include -X GET 127.0.0.1:9002/health
+
+        HTTP/1.1 200 OK
+        Content-Type: application/json
+        Content-Length: 152
+        Server: TornadoServer/5.0.2
+
+        {
+          "status": "degraded",
+          "breakers": [
+            {"node": "local", "state": "closed", "failures": 0,
+             "retry_at": null},
+            {"node": "gpu-1", "state": "open", "failures": 5,
+             "retry_at": 1531390893.11}
+          ]
+        }
+    """
+    breakers = get_breaker_states(broker.breakers.values())
+    healthy = all(b['state'] == BREAKER_CLOSED for b in breakers)
+    return jsonify({
+        'status': 'ok' if healthy else 'degraded',
+        'breakers': breakers
+    })
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """
+    Returns metrics of the API server in the Prometheus text format, the
+    state of the docker engine circuit breakers (0 closed, 1 half open, 2
+    open), the docker calls and retries made by the API server, the hits
+    and misses of the demo cache and of the base image pre-pulls, and the
+    requests refused by the rate limiter.
+
+    .. code-block:: bash
+
+        $ curl -X GET 127.0.0.1:9002/metrics
+
+        # TYPE origami_docker_breaker_state gauge
+        origami_docker_breaker_state{node="local"} 0
+        # TYPE origami_docker_calls_total counter
+        origami_docker_calls_total{node="local",endpoint="inspect",\
+outcome="success"} 42
+        ...
+    """
+    severity = {'closed': 0, 'half_open': 1, 'open': 2}
+    breakers = get_breaker_states(broker.breakers.values())
+    lines = ['# TYPE origami_docker_breaker_state gauge']
+    for breaker in breakers:
+        lines.append('origami_docker_breaker_state{{node="{}"}} {}'.format(
+            breaker['node'], severity[breaker['state']]))
+    lines.append('# TYPE origami_docker_breaker_failures gauge')
+    for breaker in breakers:
+        lines.append('origami_docker_breaker_failures{{node="{}"}} {}'.format(
+            breaker['node'], breaker['failures']))
+
+    lines.append('# TYPE origami_docker_calls_total counter')
+    for (node, endpoint, outcome), count in sorted(call_counts.items()):
+        lines.append('origami_docker_calls_total{{node="{}",endpoint="{}",'
+                     'outcome="{}"}} {}'.format(node, endpoint, outcome,
+                                                count))
+    lines.append('# TYPE origami_docker_retries_total counter')
+    for (node, endpoint), count in sorted(retry_counts.items()):
+        lines.append('origami_docker_retries_total{{node="{}",endpoint="{}"}}'
+                     ' {}'.format(node, endpoint, count))
+
+    cache = demo_cache.stats()
+    lines.extend([
+        '# TYPE origami_demo_cache_hits_total counter',
+        'origami_demo_cache_hits_total {}'.format(cache['hits']),
+        '# TYPE origami_demo_cache_misses_total counter',
+        'origami_demo_cache_misses_total {}'.format(cache['misses']),
+        '# TYPE origami_demo_cache_size gauge',
+        'origami_demo_cache_size {}'.format(cache['size']),
+    ])
+    prepull = get_prepull_stats()
+    lines.extend([
+        '# TYPE origami_prepull_hits_total counter',
+        'origami_prepull_hits_total {}'.format(prepull['hits']),
+        '# TYPE origami_prepull_misses_total counter',
+        'origami_prepull_misses_total {}'.format(prepull['misses']),
+        '# TYPE origami_prepull_wait_seconds_total counter',
+        'origami_prepull_wait_seconds_total {:.3f}'.format(prepull['wait']),
+    ])
+    lines.append('# TYPE origami_rate_limited_total counter')
+    for route, count in sorted(rate_limiter.limited.items()):
+        lines.append('origami_rate_limited_total{{route="{}"}} {}'.format(
+            route, count))
+    return '\n'.join(lines) + '\n', 200, {
+        'Content-Type': 'text/plain; version=0.0.4'
+    }
 
 
 @app.route('/static/logs/<uid>', methods=['GET'])
@@ -269,7 +1075,7 @@ def get_logs(uid):
     """
     Return log file for the provided log ID
     """
-    demo = Demos.get_or_none(Demos.demo_id == uid)
+    demo = demo_cache.get(uid)
     logs_id = demo.log_id if demo else uid
 
     logfile = safe_join(
@@ -302,27 +1108,34 @@ def configure_flask_logging():
     """
     Configure logging for running python flask server.
     It is handled accordingly the global OrigamiLogger which was
-    setup in the __init__.py
+    setup in the __init__.py, the records of the flask logger propagate to
+    the queue handler of the root logger.
     """
     logging.info('Setting up logger for the flask server')
-    logger = logging.getLogger()
-    handlers = logger.handlers
-
-    app.logger.handlers = handlers
+    app.logger.handlers = []
+    app.logger.propagate = True
 
 
 def configure_origami_db(base_dir):
     """
     Configure database for origamid, it creates a new
     database with the required schema if no database exist in origami
-    config directory.
+    config directory and adds any missing tables or columns otherwise.
+    The demos already running are rebuilt from their containers into a new
+    database, see `reconcile.rebuild_state`.
     """
     logging.info('Configuring database')
     db_path = os.path.join(base_dir, ORIGAMI_DB_NAME)
-    if not os.path.exists(db_path):
+    created = not os.path.exists(db_path)
+    if created:
         logging.warn('No database found, creating new.')
-        from .database import bootstrap_db
-        bootstrap_db()
+
+    # Creating tables is a no-op for the tables which already exist, this
+    # also migrates databases created by older versions of origamid.
+    from .database import bootstrap_db
+    bootstrap_db()
+    if created:
+        rebuild_state()
     logging.info('Database configured')
 
 
@@ -332,7 +1145,7 @@ def run_origami_bootsteps():
     This includes the following
 
     * Configure web server logging
-    * Configure Database
+    * Configure Database, rebuilding the demos if it is new
     * Validating origami configs.
     """
     logging.info('Running origami bootsteps')
@@ -353,17 +1166,30 @@ def run_origami_bootsteps():
 
 @click.command()
 @click.option('--port', default=DEFAULT_API_SERVER_PORT)
-def run_server(port):
+@click.option('--rate-limit/--no-rate-limit', default=True,
+              help='Limit the rate of requests of each client.')
+def run_server(port, rate_limit):
     """Starts the API server for the daemon.
 
     It starts an API server to provide an interface to interact with the
     application. The commands takes an argument `--port` to specify the
-    port to start the API server to listen.
+    port to start the API server to listen. The server also receives the
+    events published by the celery workers and streams them on
+    /demo/events. With the local task backend the server runs the tasks
+    itself, see `executor.LocalExecutor`. Requests are rate limited per
+    client unless `--no-rate-limit` is given, for example to load test the
+    daemon from a single client.
 
     Args:
         port (int): Port for API server to listen on
+        rate_limit (bool): Whether to limit the rate of requests
     """
+    rate_limiter.enabled = rate_limit
     server.listen(port)
     run_origami_bootsteps()
+    broker.start()
+    log_sweeper.start()
+    if get_task_backend() == TASK_BACKEND_LOCAL:
+        local_executor.start()
     logging.info('API server started on port : {}'.format(port))
     IOLoop.instance().start()
@@ -24,6 +24,49 @@ def resp_invalid_deploy_params():
     }), 400
 
 
+def resp_missing_request_param(param):
+    return jsonify({
+        'response': 'InvalidRequestParameters',
+        'message': 'Required parameters : {}'.format(param)
+    }), 400
+
+
+def resp_demo_instance_does_not_exist(demo_id, instance_id):
+    return jsonify({
+        'response': 'DemoInstanceDoesNotExist',
+        'message': 'Instance {} is not an instance of demo {}'.format(
+            instance_id, demo_id)
+    }), 404
+
+
+def resp_invalid_replica_count(replicas):
+    return jsonify({
+        'response': 'InvalidRequestParameters',
+        'message': 'Replica count {} is not valid'.format(replicas)
+    }), 400
+
+
+def resp_invalid_stats_window(window):
+    return jsonify({
+        'response': 'InvalidRequestParameters',
+        'message': 'Window of {} seconds is not valid'.format(window)
+    }), 400
+
+
+def resp_no_running_demo_instance(demo_id):
+    return jsonify({
+        'response': 'NoRunningDemoInstance',
+        'message': 'No running instance found for demo {}'.format(demo_id)
+    }), 503
+
+
+def resp_invalid_balancing_strategy(strategy):
+    return jsonify({
+        'response': 'InvalidRequestParameters',
+        'message': 'Load balancing strategy {} is not valid'.format(strategy)
+    }), 400
+
+
 def resp_invalid_demo_bundle(reason):
     return jsonify({
         'response': 'InvalidDemoBundle',
@@ -32,13 +75,17 @@ def resp_invalid_demo_bundle(reason):
     }), 400
 
 
-def resp_demo_deployment_trig(demo_dir):
+def resp_demo_deployment_trig(demo_dir, operation_id=None, trace_id=None):
     return jsonify({
         'response':
         'BundleValidated',
         'message':
         'Deploy has been triggred for bundle : {}, checks stats'.format(
-            demo_dir)
+            demo_dir),
+        'operation_id':
+        operation_id,
+        'trace_id':
+        trace_id
     }), 200
 
 
@@ -48,3 +95,79 @@ def resp_docker_api_error(error):
         'message': 'Problem with docker API connection',
         'reason': '{}'.format(error)
     }), 500
+
+
+def resp_docker_unavailable(error, retry_after):
+    response = jsonify({
+        'response': 'DockerUnavailable',
+        'message': 'Docker engine is unavailable, try again later',
+        'reason': '{}'.format(error)
+    })
+    response.headers['Retry-After'] = '{}'.format(retry_after)
+    return response, 503
+
+
+def resp_insufficient_capacity(error):
+    return jsonify({
+        'response': 'InsufficientCapacity',
+        'message': 'No node has enough free resources for the demo',
+        'reason': '{}'.format(error)
+    }), 503
+
+
+def resp_invalid_bulk_request(reason):
+    return jsonify({
+        'response': 'InvalidRequestParameters',
+        'message': 'The bulk request is not valid',
+        'reason': '{}'.format(reason)
+    }), 400
+
+
+def resp_bulk_job_triggered(job_id, count):
+    return jsonify({
+        'response': 'BulkJobTriggered',
+        'message': 'Bulk job {} triggered for {} demos'.format(job_id, count),
+        'job_id': job_id
+    }), 202
+
+
+def resp_bulk_job_does_not_exist(job_id):
+    return jsonify({
+        'response': 'BulkJobDoesNotExist',
+        'message': 'Bulk job {} does not exist'.format(job_id)
+    }), 404
+
+
+def resp_demo_removal_trig(demo_id, operation_id):
+    return jsonify({
+        'response':
+        'TriggeredRemoveDeployedInstance',
+        'message':
+        'Removal of demo instance with id: {} initiated'.format(demo_id),
+        'operation_id':
+        operation_id
+    }), 200
+
+
+def resp_operation_does_not_exist(operation_id):
+    return jsonify({
+        'response': 'OperationDoesNotExist',
+        'message': 'Operation {} does not exist'.format(operation_id)
+    }), 404
+
+
+def resp_trace_does_not_exist(trace_id):
+    return jsonify({
+        'response': 'TraceDoesNotExist',
+        'message': 'No trace with ID {} was recorded'.format(trace_id)
+    }), 404
+
+
+def resp_rate_limited(retry_after):
+    response = jsonify({
+        'response': 'RateLimited',
+        'message': 'Too many requests, try again in {} seconds'.format(
+            retry_after)
+    })
+    response.headers['Retry-After'] = '{}'.format(retry_after)
+    return response, 429
@@ -0,0 +1,178 @@
+import logging
+import threading
+import time
+
+from .constants import BALANCER_LEASE_TIMEOUT
+
+ROUND_ROBIN = 'round_robin'
+LEAST_CONNECTIONS = 'least_connections'
+
+
+class RoundRobinBalancer(object):
+    """
+    Hands out the instances of a demo one after the other.
+
+    The position for each demo is kept in memory of the API process, it
+    does not need to survive restarts.
+    """
+
+    def __init__(self):
+        self._positions = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, demo_id, instances):
+        """
+        Returns the next instance for the demo.
+
+        Args:
+            demo_id (str): ID of the demo.
+            instances (list): Running `DemoInstances` of the demo ordered by
+                replica index.
+
+        Returns:
+            instance (DemoInstances, None): Chosen instance or None if there
+                are no instances.
+        """
+        if not instances:
+            return None
+        with self._lock:
+            position = self._positions.get(demo_id, 0)
+            self._positions[demo_id] = (position + 1) % len(instances)
+        return instances[position % len(instances)]
+
+    def release(self, demo_id, container_id):
+        """
+        Round robin does not track connections, nothing to release.
+
+        Returns:
+            (bool): Always False.
+        """
+        return False
+
+
+class LeastConnectionsBalancer(object):
+    """
+    Hands out the instance of a demo with the least number of active
+    connections.
+
+    A connection is counted from the moment an instance is acquired until
+    the client releases it or `lease_timeout` seconds passed, so a client
+    which never releases its instance does not hold it forever. The leases
+    are kept per demo in memory of the API process. The leases on the
+    containers which are not instances of the demo anymore, replaced by a
+    redeploy or removed, are dropped on the next acquire and the leases of
+    demos which are not used anymore expire.
+    """
+
+    def __init__(self, lease_timeout=BALANCER_LEASE_TIMEOUT):
+        self.lease_timeout = lease_timeout
+        # Expiry of the leases keyed by demo ID and container ID.
+        self._leases = {}
+        self._swept_at = time.time()
+        self._lock = threading.Lock()
+
+    def _sweep(self, now):
+        """
+        Drop the expired leases of all the demos, at most once per
+        `lease_timeout`.
+        """
+        if now - self._swept_at < self.lease_timeout:
+            return
+        self._swept_at = now
+        for demo_id in list(self._leases):
+            leases = self._leases[demo_id]
+            for container_id in list(leases):
+                leases[container_id] = [
+                    e for e in leases[container_id] if e > now
+                ]
+                if not leases[container_id]:
+                    del leases[container_id]
+            if not leases:
+                del self._leases[demo_id]
+
+    def acquire(self, demo_id, instances):
+        """
+        Returns the instance with the least active connections and counts
+        a new connection against it. Ties are broken by the replica index.
+
+        Args:
+            demo_id (str): ID of the demo.
+            instances (list): Running `DemoInstances` of the demo ordered by
+                replica index.
+
+        Returns:
+            instance (DemoInstances, None): Chosen instance or None if there
+                are no instances.
+        """
+        if not instances:
+            return None
+        now = time.time()
+        with self._lock:
+            self._sweep(now)
+            container_ids = set(i.container_id for i in instances)
+            leases = {
+                container_id: [e for e in expiries if e > now]
+                for container_id, expiries in self._leases.get(
+                    demo_id, {}).items() if container_id in container_ids
+            }
+            instance = min(
+                instances, key=lambda i: len(leases.get(i.container_id, [])))
+            leases.setdefault(instance.container_id, []).append(
+                now + self.lease_timeout)
+            self._leases[demo_id] = leases
+        return instance
+
+    def release(self, demo_id, container_id):
+        """
+        Release a connection acquired on the instance with `container_id`.
+
+        Args:
+            demo_id (str): ID of the demo.
+            container_id (str): Container ID of the instance.
+
+        Returns:
+            (bool): False if the demo holds no lease on the instance.
+        """
+        with self._lock:
+            leases = self._leases.get(demo_id, {})
+            expiries = leases.get(container_id)
+            if not expiries:
+                return False
+            # The oldest lease is released, it would expire first.
+            expiries.pop(0)
+            if not expiries:
+                del leases[container_id]
+            return True
+
+    def connections(self, demo_id, container_id):
+        """
+        Returns the number of active connections for an instance.
+        """
+        now = time.time()
+        with self._lock:
+            expiries = self._leases.get(demo_id, {}).get(container_id, [])
+            return len([e for e in expiries if e > now])
+
+
+BALANCERS = {
+    ROUND_ROBIN: RoundRobinBalancer(),
+    LEAST_CONNECTIONS: LeastConnectionsBalancer(),
+}
+
+
+def get_balancer(strategy):
+    """
+    Returns the balancer for the strategy, either `round_robin` or
+    `least_connections`.
+
+    Args:
+        strategy (str): Load balancing strategy.
+
+    Returns:
+        balancer (RoundRobinBalancer, LeastConnectionsBalancer, None): The
+            balancer or None if the strategy is not known.
+    """
+    balancer = BALANCERS.get(strategy)
+    if not balancer:
+        logging.warn('Unknown load balancing strategy : {}'.format(strategy))
+    return balancer
@@ -0,0 +1,483 @@
+import asyncio
+import click
+import datetime
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+import zipfile
+
+from six.moves.urllib.parse import urlencode
+from tornado.httpclient import AsyncHTTPClient, HTTPRequest
+
+from .constants import DEFAULT_API_SERVER_PORT, DOCKERFILE_FILE, \
+    REQUIREMENTS_FILE, ENTRYPOINT_PYTHON_MODULE, ORIGAMI_WRAPPED_DEMO_PORT, \
+    BENCH_MIX, BENCH_REQUEST_TIMEOUT, BENCH_TOLERANCE, \
+    BENCH_ERROR_TOLERANCE
+from .operations import summarize
+
+OPERATIONS = ('deploy', 'status', 'port', 'logs')
+PERCENTS = (50, 90, 95, 99)
+RESULTS_VERSION = 1
+
+# Paths of the read operations, formatted with the demo ID.
+READ_PATHS = {
+    'status': '/demo/status/{}',
+    'port': '/demo/port/{}',
+    'logs': '/static/logs/{}',
+}
+
+BUNDLE_DOCKERFILE = '''FROM python:3.6-slim
+WORKDIR /app
+COPY requirements.txt .
+RUN pip install -r requirements.txt
+COPY . .
+EXPOSE {port}
+CMD ["python", "main.py"]
+'''
+
+BUNDLE_MAIN = '''from http.server import HTTPServer, SimpleHTTPRequestHandler
+
+HTTPServer(('0.0.0.0', {port}), SimpleHTTPRequestHandler).serve_forever()
+'''
+
+
+def make_bundle(path, size):
+    """
+    Write a synthetic demo bundle, a static file server with a random
+    payload so the bundle is about `size` bytes.
+
+    Args:
+        path (str): Path of the bundle zip.
+        size (int): Size in bytes of the payload of the bundle.
+    """
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_STORED) as bundle:
+        bundle.writestr(DOCKERFILE_FILE, BUNDLE_DOCKERFILE.format(
+            port=ORIGAMI_WRAPPED_DEMO_PORT))
+        bundle.writestr(REQUIREMENTS_FILE, 'six==1.11.0\n')
+        bundle.writestr(ENTRYPOINT_PYTHON_MODULE, BUNDLE_MAIN.format(
+            port=ORIGAMI_WRAPPED_DEMO_PORT))
+        if size > 0:
+            bundle.writestr('payload.bin', os.urandom(size))
+
+
+def parse_mix(mix):
+    """
+    Parse the weights of the operations of a benchmark, for example
+    deploy=1,status=5.
+
+    Returns:
+        weights (dict): Weight of the operations keyed by operation.
+
+    Raises:
+        ValueError: The mix is not valid.
+    """
+    weights = {}
+    for item in mix.split(','):
+        operation, _, weight = item.strip().partition('=')
+        if operation not in OPERATIONS:
+            raise ValueError('Unknown operation {}, expected one of {}'.format(
+                operation, ', '.join(OPERATIONS)))
+        weights[operation] = float(weight or 1)
+        if weights[operation] < 0:
+            raise ValueError('Weight of {} is negative'.format(operation))
+    if not any(weights.values()):
+        raise ValueError('At least one operation must have a weight')
+    return weights
+
+
+def _choose(rng, weights):
+    operations = [o for o in OPERATIONS if weights.get(o)]
+    point = rng.random() * sum(weights[o] for o in operations)
+    for operation in operations:
+        point -= weights[operation]
+        if point < 0:
+            break
+    return operation
+
+
+async def _request(client, url, operation, demo_id, bundle_path, timeout):
+    """
+    Send the request of an operation and return its status code and latency,
+    599 if no response was received.
+    """
+    if operation == 'deploy':
+        request = HTTPRequest(
+            '{}/deploy_trigger/{}'.format(url, demo_id),
+            method='POST',
+            body=urlencode({'bundle_path': bundle_path}),
+            request_timeout=timeout)
+    else:
+        request = HTTPRequest(
+            url + READ_PATHS[operation].format(demo_id),
+            request_timeout=timeout)
+    started = time.time()
+    try:
+        response = await client.fetch(request, raise_error=False)
+        code = response.code
+    except Exception:
+        code = 599
+    return code, time.time() - started
+
+
+async def _run_clients(url, weights, demos, concurrency, requests, duration,
+                       timeout, rng):
+    client = AsyncHTTPClient(force_instance=True, max_clients=concurrency)
+    deadline = time.time() + duration
+    samples = []
+    sent = [0]
+
+    async def run_client():
+        while True:
+            if requests is not None:
+                if sent[0] >= requests:
+                    return
+                sent[0] += 1
+            elif time.time() >= deadline:
+                return
+            demo_id, bundle_path = demos[rng.randrange(len(demos))]
+            operation = _choose(rng, weights)
+            code, latency = await _request(client, url, operation, demo_id,
+                                           bundle_path, timeout)
+            samples.append((operation, code, latency))
+
+    try:
+        await asyncio.gather(*[run_client() for _ in range(concurrency)])
+    finally:
+        client.close()
+    return samples
+
+
+def _summarize_samples(samples, elapsed):
+    codes = {}
+    for _, code, _ in samples:
+        key = '{}'.format(code)
+        codes[key] = codes.get(key, 0) + 1
+    errors = sum(1 for _, code, _ in samples if code >= 500 or code == 429)
+    return {
+        'count': len(samples),
+        'errors': errors,
+        'error_rate': float(errors) / len(samples) if samples else 0.0,
+        'throughput': len(samples) / elapsed if elapsed else 0.0,
+        'codes': codes,
+        'latency': summarize([s[2] * 1000 for s in samples], PERCENTS)
+    }
+
+
+def summarize_samples(samples, elapsed):
+    """
+    Returns the statistics of the requests of a benchmark, for all the
+    requests and by operation.
+
+    * count, errors: Number of requests, and of requests which failed with
+        a 5xx status, were rate limited or got no response.
+    * error_rate: Ratio of failed requests.
+    * throughput: Requests per second.
+    * codes: Number of requests by status code.
+    * latency: Mean, percentiles and maximum latency in milliseconds.
+
+    Args:
+        samples (list): (operation, status code, latency in seconds) tuples.
+        elapsed (float): Duration of the benchmark in seconds.
+    """
+    return {
+        'total': _summarize_samples(samples, elapsed),
+        'operations': {
+            operation: _summarize_samples(
+                [s for s in samples if s[0] == operation], elapsed)
+            for operation in OPERATIONS if any(
+                s[0] == operation for s in samples)
+        }
+    }
+
+
+def run_bench(url,
+              weights,
+              demo_ids,
+              bundle_dir,
+              bundle_size,
+              concurrency=10,
+              requests=None,
+              duration=30,
+              timeout=BENCH_REQUEST_TIMEOUT,
+              seed=None):
+    """
+    Load test a running daemon with concurrent clients, each one sends a
+    request at a time. The operation and the demo of each request are
+    picked at random, deploys trigger a deploy of a synthetic bundle, see
+    `make_bundle`.
+
+    Args:
+        url (str): Base URL of the API server.
+        weights (dict): Weights of the operations, see `parse_mix`.
+        demo_ids (list): IDs of the demos to deploy and read.
+        bundle_dir (str): Directory to write the bundles to, it must be
+            readable by the daemon.
+        bundle_size (int): Size in bytes of the payload of the bundles.
+        concurrency (int): Number of clients.
+        requests (int, None): Number of requests to send, the benchmark
+            runs for `duration` seconds if not provided.
+        duration (float): Duration of the benchmark in seconds.
+        timeout (float): Seconds to wait for a response.
+        seed (int, None): Seed of the random picks.
+
+    Returns:
+        results (dict): Configuration and statistics of the benchmark, see
+            `summarize_samples`.
+    """
+    demos = []
+    for demo_id in demo_ids:
+        bundle_path = os.path.abspath(
+            os.path.join(bundle_dir, '{}.zip'.format(demo_id)))
+        if weights.get('deploy'):
+            make_bundle(bundle_path, bundle_size)
+        demos.append((demo_id, bundle_path))
+
+    started_at = datetime.datetime.now()
+    started = time.time()
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        samples = loop.run_until_complete(_run_clients(
+            url.rstrip('/'), weights, demos, concurrency, requests, duration,
+            timeout, random.Random(seed)))
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+    elapsed = time.time() - started
+
+    results = {
+        'version': RESULTS_VERSION,
+        'url': url,
+        'started_at': started_at.isoformat(),
+        'elapsed': elapsed,
+        'config': {
+            'weights': weights,
+            'demos': len(demo_ids),
+            'bundle_size': bundle_size,
+            'concurrency': concurrency,
+            'requests': requests,
+            'duration': duration,
+            'seed': seed
+        }
+    }
+    results.update(summarize_samples(samples, elapsed))
+    return results
+
+
+def compare_results(baseline, results, tolerance=BENCH_TOLERANCE):
+    """
+    Compare the results of a benchmark with the results of a baseline run
+    on the same operations. An operation regresses when its throughput is
+    lower or its 95th percentile latency higher than the baseline by more
+    than `tolerance` percent, or when its error rate is higher by more
+    than BENCH_ERROR_TOLERANCE percentage points.
+
+    Args:
+        baseline (dict): Results of the baseline run.
+        results (dict): Results of the run to compare.
+        tolerance (float): Tolerance in percent.
+
+    Returns:
+        rows (list): Operation, metric, baseline and current value, change
+            in percent and whether it regressed.
+    """
+    rows = []
+    names = ['total'] + [
+        o for o in OPERATIONS
+        if o in baseline['operations'] and o in results['operations']
+    ]
+    for name in names:
+        before = baseline['total'] if name == 'total' else \
+            baseline['operations'][name]
+        after = results['total'] if name == 'total' else \
+            results['operations'][name]
+        metrics = (
+            ('throughput', before['throughput'], after['throughput'], -1),
+            ('p95', before['latency']['p95'], after['latency']['p95'], 1),
+            ('error_rate', before['error_rate'], after['error_rate'], 0),
+        )
+        for metric, old, new, direction in metrics:
+            if old is None or new is None:
+                continue
+            change = (new - old) * 100.0 / old if old else None
+            if direction == 0:
+                regressed = (new - old) * 100 > BENCH_ERROR_TOLERANCE
+            else:
+                regressed = change is not None and \
+                    change * direction > tolerance
+            rows.append({
+                'operation': name,
+                'metric': metric,
+                'baseline': old,
+                'current': new,
+                'change': change,
+                'regressed': regressed
+            })
+    return rows
+
+
+def _echo_results(results):
+    click.echo('{:<8} {:>8} {:>8} {:>9} {:>9} {:>9} {:>9} {:>9}'.format(
+        'op', 'count', 'errors', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms',
+        'max ms'))
+    rows = [(o, results['operations'][o]) for o in OPERATIONS
+            if o in results['operations']]
+    for name, stats in rows + [('total', results['total'])]:
+        latency = stats['latency']
+        if not stats['count']:
+            continue
+        click.echo(
+            '{:<8} {:>8} {:>8} {:>9.1f} {:>9.1f} {:>9.1f} {:>9.1f} '
+            '{:>9.1f}'.format(name, stats['count'], stats['errors'],
+                              stats['throughput'], latency['p50'],
+                              latency['p95'], latency['p99'],
+                              latency['max']))
+
+
+def _echo_comparison(rows):
+    click.echo('{:<8} {:<11} {:>12} {:>12} {:>9}'.format(
+        'op', 'metric', 'baseline', 'current', 'change'))
+    for row in rows:
+        change = '' if row['change'] is None else '{:+.1f}%'.format(
+            row['change'])
+        click.echo('{:<8} {:<11} {:>12.3f} {:>12.3f} {:>9}{}'.format(
+            row['operation'], row['metric'], row['baseline'], row['current'],
+            change, '  REGRESSED' if row['regressed'] else ''))
+
+
+def _load_results(path):
+    with open(path, 'r') as fp:
+        results = json.load(fp)
+    if results.get('version') != RESULTS_VERSION:
+        raise click.ClickException(
+            '{} is not a result file of origamid bench'.format(path))
+    return results
+
+
+def _check_comparison(baseline, results, tolerance):
+    keys = set(baseline['config']) | set(results['config'])
+    changed = sorted(
+        key for key in keys - {'seed'}
+        if baseline['config'].get(key) != results['config'].get(key))
+    if changed:
+        click.echo('The runs were configured differently : {}'.format(
+            ', '.join(changed)))
+    rows = compare_results(baseline, results, tolerance)
+    _echo_comparison(rows)
+    if any(row['regressed'] for row in rows):
+        raise click.ClickException(
+            'Performance regressed beyond the tolerance of {}%'.format(
+                tolerance))
+
+
+def _validate_mix(ctx, param, value):
+    try:
+        return parse_mix(value)
+    except ValueError as e:
+        raise click.BadParameter('{}'.format(e))
+
+
+@click.command('bench')
+@click.option(
+    '--url',
+    default='http://127.0.0.1:{}'.format(DEFAULT_API_SERVER_PORT),
+    help='URL of the API server')
+@click.option('--concurrency', default=10, help='Number of clients')
+@click.option('--duration', default=30, help='Seconds to run for')
+@click.option(
+    '--requests',
+    type=int,
+    default=None,
+    help='Number of requests to send instead of running for a duration')
+@click.option('--demos', default=10, help='Number of demos to spread on')
+@click.option('--prefix', default='bench', help='Prefix of the demo IDs')
+@click.option(
+    '--bundle-size',
+    default=1024 * 1024,
+    help='Size in bytes of the payload of the bundles')
+@click.option(
+    '--bundle-dir',
+    type=click.Path(file_okay=False),
+    default=None,
+    help='Directory of the bundles, it must be readable by the daemon')
+@click.option(
+    '--mix',
+    default=BENCH_MIX,
+    callback=_validate_mix,
+    help='Weights of the deploy, status, port and logs operations')
+@click.option('--timeout', default=BENCH_REQUEST_TIMEOUT,
+              help='Seconds to wait for a response')
+@click.option('--seed', type=int, default=None, help='Seed of the picks')
+@click.option(
+    '--save',
+    type=click.Path(dir_okay=False),
+    default=None,
+    help='File to save the results to')
+@click.option(
+    '--compare',
+    type=click.Path(exists=True, dir_okay=False),
+    default=None,
+    help='Results of a baseline run to compare with')
+@click.option('--tolerance', default=BENCH_TOLERANCE,
+              help='Percent of regression tolerated by --compare')
+def bench(url, concurrency, duration, requests, demos, prefix, bundle_size,
+          bundle_dir, mix, timeout, seed, save, compare, tolerance):
+    """Load tests a running daemon.
+
+    Concurrent clients trigger deploys of synthetic bundles and read the
+    status, port and logs of the demos, the throughput, latency percentiles
+    and error rate of each operation are reported. Deploys build and run
+    the demos for real, use a mix without deploys against a production
+    daemon. The bundles are written to a temporary directory unless
+    --bundle-dir is provided, the daemon must be able to read them.
+
+    .. code-block:: bash
+
+        $ origamid bench --duration 60 --concurrency 50 --save before.json
+
+        $ origamid bench --duration 60 --concurrency 50 --compare before.json
+
+    The command fails when --compare finds a regression, see
+    `compare_results`.
+    """
+    baseline = _load_results(compare) if compare else None
+    temporary = bundle_dir is None
+    if temporary:
+        bundle_dir = tempfile.mkdtemp()
+    elif not os.path.isdir(bundle_dir):
+        os.makedirs(bundle_dir)
+    demo_ids = ['{}{:04d}'.format(prefix, i) for i in range(demos)]
+    try:
+        results = run_bench(url, mix, demo_ids, bundle_dir, bundle_size,
+                            concurrency, requests, duration, timeout, seed)
+    finally:
+        # Deployed bundles are staged in the directories of the demos.
+        if temporary:
+            shutil.rmtree(bundle_dir)
+
+    _echo_results(results)
+    if save:
+        with open(save, 'w') as fp:
+            json.dump(results, fp, indent=2, sort_keys=True)
+        click.echo('Results saved to {}'.format(save))
+    if baseline:
+        _check_comparison(baseline, results, tolerance)
+
+
+@click.command('bench-compare')
+@click.argument('baseline', type=click.Path(exists=True, dir_okay=False))
+@click.argument('results', type=click.Path(exists=True, dir_okay=False))
+@click.option('--tolerance', default=BENCH_TOLERANCE,
+              help='Percent of regression tolerated')
+def bench_compare(baseline, results, tolerance):
+    """Compares two result files of origamid bench.
+
+    .. code-block:: bash
+
+        $ origamid bench-compare before.json after.json --tolerance 5
+    """
+    _check_comparison(
+        _load_results(baseline), _load_results(results), tolerance)
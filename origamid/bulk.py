@@ -0,0 +1,127 @@
+import logging
+import uuid
+
+from celery import chain, group
+
+from .celery import get_task_backend
+from .constants import ORIGAMI_BUILD_CONCURRENCY, DEFAULT_CELERY_QUEUE, \
+    TASK_BACKEND_LOCAL
+from .database import db, BulkJobs, BulkJobItems
+from .executor import enqueue_job
+from . import tasks
+
+BULK_DEPLOY = 'deploy'
+BULK_REMOVE = 'remove'
+
+BULK_TASKS = {
+    BULK_DEPLOY: tasks.bulk_deploy_demo,
+    BULK_REMOVE: tasks.bulk_remove_demo,
+}
+
+
+def create_bulk_job(action, items, concurrency=ORIGAMI_BUILD_CONCURRENCY):
+    """
+    Record a bulk job and one pending item per demo in the database.
+
+    Args:
+        action (str): Either deploy or remove.
+        items (list): Dicts with the demo_id and, for a deploy, the
+            bundle_path, replicas, node and placement of each demo.
+        concurrency (int): Number of demos processed in parallel.
+
+    Returns:
+        job (BulkJobs): The created job.
+    """
+    with db.atomic():
+        job = BulkJobs.create(
+            job_id=uuid.uuid4().hex, action=action, concurrency=concurrency)
+        for item in items:
+            BulkJobItems.create(
+                job=job,
+                demo_id=item['demo_id'],
+                bundle_path=item.get('bundle_path'),
+                replicas=item.get('replicas'),
+                node=item.get('node'),
+                placement=item.get('placement'))
+    return job
+
+
+def dispatch_bulk_job(job):
+    """
+    Fan the items of a bulk job out to the celery workers.
+
+    The items are split into `concurrency` lanes, each lane is a chain which
+    processes its demos one after the other and the lanes run as a group.
+    At most `concurrency` demos of the job are built at the same time no
+    matter how many workers consume the queue. The outcome of each demo is
+    recorded by the task itself, so no result backend is needed.
+
+    With the local task backend each lane is queued as jobs which wait for
+    the previous job of their lane, see `executor.enqueue_job`.
+
+    Args:
+        job (BulkJobs): Job to dispatch.
+    """
+    task = BULK_TASKS[job.action]
+    items = list(job.items.order_by(BulkJobItems.id))
+    lanes = [items[i::job.concurrency] for i in range(job.concurrency)]
+    if get_task_backend() == TASK_BACKEND_LOCAL:
+        for lane in lanes:
+            previous = None
+            for item in lane:
+                previous = enqueue_job(task.name, (item.id, ),
+                                       queue=DEFAULT_CELERY_QUEUE,
+                                       after=previous)
+    else:
+        # The deploys are replaced by a task on the queue of their node,
+        # see `tasks.bulk_deploy_demo`, the next item of the lane must still
+        # be sent to the default queue.
+        group(
+            chain(
+                task.si(item.id).set(queue=DEFAULT_CELERY_QUEUE)
+                for item in lane) for lane in lanes
+            if lane).apply_async(queue=DEFAULT_CELERY_QUEUE)
+    logging.info('Dispatched bulk {} job {} with {} demos in {} lanes'.format(
+        job.action, job.job_id, len(items), min(len(items),
+                                                job.concurrency)))
+
+
+def get_bulk_job_status(job):
+    """
+    Returns the aggregate status of a bulk job and the outcome of each of
+    its demos.
+
+    The job is pending until its first demo starts, running until all of
+    its demos are done and then finished.
+
+    Args:
+        job (BulkJobs): Job to report on.
+
+    Returns:
+        status (dict): Status of the job.
+    """
+    items = list(job.items.order_by(BulkJobItems.id))
+    counts = dict((s, 0)
+                  for s in ('pending', 'running', 'succeeded', 'failed'))
+    for item in items:
+        counts[item.status] = counts.get(item.status, 0) + 1
+
+    if counts['pending'] == len(items):
+        status = 'pending'
+    elif counts['pending'] or counts['running']:
+        status = 'running'
+    else:
+        status = 'finished'
+
+    return {
+        'job_id': job.job_id,
+        'action': job.action,
+        'status': status,
+        'total': len(items),
+        'counts': counts,
+        'items': [{
+            'demo_id': item.demo_id,
+            'status': item.status,
+            'message': item.message
+        } for item in items]
+    }
@@ -0,0 +1,118 @@
+import threading
+import time
+
+from collections import OrderedDict
+
+from .constants import DEMO_CACHE_SIZE, DEMO_CACHE_TTL
+from .database import db, Demos, DemoInstances, demo_save_hooks
+
+
+class DemoCache(object):
+    """
+    Bounded read-through cache of the demos and their instances, used by the
+    API server to answer status, port and log requests from memory.
+
+    Entries are evicted in least recently used order once the cache holds
+    `max_size` demos and expire after `ttl` seconds. The cache stays
+    consistent with the database in three ways
+
+    * A demo saved by the API server invalidates its entry right away
+        through `database.demo_save_hooks`.
+    * The status events published by the celery workers invalidate the
+        entry of the demo when they reach the event broker.
+    * Before each lookup the SQLite data_version of the connection is
+        compared to the one the entries were read at. It changes whenever
+        another process commits, the whole cache is dropped then. This keeps
+        reads consistent after a deploy even if an event was lost.
+
+    Attributes:
+        hits: Number of lookups served from memory.
+        misses: Number of lookups read from the database.
+    """
+
+    def __init__(self, max_size=DEMO_CACHE_SIZE, ttl=DEMO_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._data_version = None
+        self._lock = threading.Lock()
+
+    def _check_data_version(self):
+        version = db.execute_sql('PRAGMA data_version').fetchone()[0]
+        if version != self._data_version:
+            with self._lock:
+                self._entries.clear()
+                self._data_version = version
+
+    def _lookup(self, demo_id):
+        self._check_data_version()
+        with self._lock:
+            entry = self._entries.pop(demo_id, None)
+            if entry and entry[0] > time.time():
+                # Reinsert to mark the demo as most recently used.
+                self._entries[demo_id] = entry
+                self.hits += 1
+                return entry
+
+        self.misses += 1
+        demo = Demos.get_or_none(Demos.demo_id == demo_id)
+        if demo is None:
+            return None
+        instances = list(demo.instances.order_by(DemoInstances.replica))
+        entry = (time.time() + self.ttl, demo, instances)
+        with self._lock:
+            self._entries[demo_id] = entry
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return entry
+
+    def get(self, demo_id):
+        """
+        Returns the demo with the provided ID or None if it does not exist.
+        The returned object is shared, it must be saved if it is modified.
+
+        Args:
+            demo_id (str): ID of the demo.
+
+        Returns:
+            demo (Demos, None): The demo.
+        """
+        entry = self._lookup(demo_id)
+        return entry[1] if entry else None
+
+    def get_instances(self, demo_id):
+        """
+        Returns the instances of a demo ordered by replica.
+
+        Args:
+            demo_id (str): ID of the demo.
+
+        Returns:
+            instances (list): `DemoInstances` of the demo.
+        """
+        entry = self._lookup(demo_id)
+        return list(entry[2]) if entry else []
+
+    def invalidate(self, demo_id=None):
+        """
+        Drop the cached demo with the provided ID, or all the cached demos if
+        no ID is provided.
+        """
+        with self._lock:
+            if demo_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(demo_id, None)
+
+    def stats(self):
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+
+demo_cache = DemoCache()
+demo_save_hooks.append(lambda demo: demo_cache.invalidate(demo.demo_id))
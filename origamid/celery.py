@@ -1,8 +1,58 @@
 from __future__ import absolute_import
 
-from celery import Celery
+import os
 
-app = Celery('origamid', broker='amqp://', include=['origamid.tasks'])
+from celery import Celery, Task
+
+from .constants import TASK_BACKEND_ENV, TASK_BACKEND_LOCAL, \
+    DEFAULT_TASK_BACKEND, DEFAULT_CELERY_QUEUE, RECONCILE_INTERVAL
+from .tracing import get_trace_headers
+
+
+def get_task_backend():
+    """
+    Returns the backend running the tasks, either celery or local.
+    """
+    return os.environ.get(TASK_BACKEND_ENV, DEFAULT_TASK_BACKEND)
+
+
+class OrigamiTask(Task):
+    """
+    Task sent to the celery workers, or queued for the local executor of the
+    API server when the local task backend is used. `delay` and
+    `apply_async` work the same with both backends, with the local backend
+    they return the queued `Jobs` row instead of an `AsyncResult`.
+    """
+
+    def apply_async(self, args=None, kwargs=None, **options):
+        # The task joins the trace it is sent from, see `tracing`.
+        headers = dict(options.pop('headers', None) or {})
+        headers.update(get_trace_headers())
+        if get_task_backend() == TASK_BACKEND_LOCAL:
+            # Imported here, the executor imports the tasks.
+            from .executor import enqueue_job
+            return enqueue_job(self.name, args, kwargs, options.get('queue'),
+                               headers=headers)
+        return super(OrigamiTask, self).apply_async(
+            args, kwargs, headers=headers, **options)
+
+
+app = Celery(
+    'origamid',
+    broker='amqp://',
+    include=['origamid.tasks'],
+    task_cls=OrigamiTask)
+
+# Periodic tasks, sent by celery beat or by the local executor.
+app.conf.beat_schedule = {
+    'reconcile-demos': {
+        'task': 'origamid.tasks.reconcile_demos',
+        'schedule': RECONCILE_INTERVAL,
+        'options': {
+            'queue': DEFAULT_CELERY_QUEUE
+        }
+    }
+}
 
 if __name__ == '__main__':
     app.start()
@@ -11,6 +11,7 @@ WELCOME_TEXT = """\
 
 ORIGAMI_CONFIG_DIR = '.origami'
 ORIGAMI_DEMOS_DIRNAME = 'demos'
+ORIGAMI_UPLOADS_DIRNAME = 'uploads'
 
 DEFAULT_API_SERVER_PORT = 9002
 
@@ -23,6 +24,15 @@ DEFAULT_LOG_FILE = 'origami.log'
 REQUIREMENTS_FILE = 'requirements.txt'
 ENTRYPOINT_PYTHON_MODULE = 'main.py'
 DOCKERFILE_FILE = 'Dockerfile'
+DOCKERIGNORE_FILE = '.dockerignore'
+
+# The demo bundle is kept in the demo directory under this name and the
+# build context is streamed from it in chunks of BUILD_CONTEXT_CHUNK_SIZE.
+ORIGAMI_BUNDLE_ZIP = 'bundle.zip'
+# Path, size and sha256 of the files of the bundle, clients diff their bundle
+# against it to send only the changed files in a delta deploy.
+ORIGAMI_MANIFEST_FILE = 'manifest.json'
+BUILD_CONTEXT_CHUNK_SIZE = 64 * 1024
 
 BUNDLE_ZIP_MAX_COMPRESSED_SIZE = 500 * 1000 * 1000  # 500 MB
 BUNDLE_ZIP_MAX_UNCOMPRESSED_SIZE = 1000 * 1000 * 1000  # 1000 MB
@@ -36,4 +46,226 @@ DOCKER_UNIX_SOCKET = 'unix://var/run/docker.sock'
 DEMOS_PORT_COUNT_START = 20001
 DEMOS_PORT_COUNT_END = 30000
 
+# Ports handed out to a deploy are reserved until it switches to its new
+# containers or rolls back, reservations of deploys which were interrupted
+# are ignored after PORT_RESERVATION_TIMEOUT seconds.
+PORT_RESERVATION_TIMEOUT = 30 * 60
+PORT_RESERVATION_ATTEMPTS = 5
+
 ORIGAMI_WRAPPED_DEMO_PORT = 9001
+
+DEFAULT_DEMO_REPLICAS = 1
+DEMO_MAX_REPLICAS = 16
+
+# Seconds an instance handed out by the least connections balancer counts as
+# connected if the client does not release it.
+BALANCER_LEASE_TIMEOUT = 10 * 60
+
+DEFAULT_NODE_NAME = 'local'
+DEFAULT_CELERY_QUEUE = 'celery'
+
+PLACEMENT_LEAST_LOADED = 'least_loaded'
+PLACEMENT_FREE_MEMORY = 'free_memory'
+PLACEMENT_BIN_PACK = 'bin_pack'
+DEFAULT_PLACEMENT_POLICY = PLACEMENT_BIN_PACK
+
+# Resources accounted for each replica of a demo which does not declare a
+# CPU or memory request.
+DEMO_DEFAULT_CPU_RESERVATION = 0.5
+DEMO_DEFAULT_MEMORY_RESERVATION = 512 * 1024 * 1024  # 512 MiB
+
+# Resource requests and limits which can be declared in ORIGAMI_ENV_FILE,
+# keyed by the name of the corresponding deploy parameter.
+ORIGAMI_ENV_RESOURCE_KEYS = {
+    'cpu_request': 'ORIGAMI_CPU_REQUEST',
+    'memory_request': 'ORIGAMI_MEMORY_REQUEST',
+    'cpu_limit': 'ORIGAMI_CPU_LIMIT',
+    'memory_limit': 'ORIGAMI_MEMORY_LIMIT',
+    'cpuset': 'ORIGAMI_CPUSET',
+}
+
+# Number of images built before the current one which are kept for every
+# demo, older images are removed by the image garbage collector.
+ORIGAMI_IMAGE_RETAIN_PREVIOUS = 2
+# Disk space images and build cache are allowed to use on each node, the
+# garbage collector removes previous images in least recently used order and
+# prunes the build cache to stay within it.
+ORIGAMI_IMAGE_DISK_BUDGET = 20 * 1024 * 1024 * 1024  # 20 GiB
+
+# Readiness probing of new demo containers, the probe is retried with an
+# exponential backoff between the initial and the maximum interval until
+# the timeout in seconds is reached. Demos can override the probe in
+# ORIGAMI_ENV_FILE with the keys below.
+DEMO_READINESS_PROBE_TCP = 'tcp'
+DEMO_READINESS_PROBE_HTTP = 'http'
+DEMO_READINESS_TIMEOUT = 120
+DEMO_READINESS_INITIAL_BACKOFF = 0.1
+DEMO_READINESS_MAX_BACKOFF = 2.0
+ORIGAMI_ENV_READINESS_PROBE = 'ORIGAMI_READINESS_PROBE'
+ORIGAMI_ENV_READINESS_PATH = 'ORIGAMI_READINESS_PATH'
+ORIGAMI_ENV_READINESS_TIMEOUT = 'ORIGAMI_READINESS_TIMEOUT'
+
+# Number of demos of a bulk job built in parallel and the maximum number of
+# demos a single bulk request may contain.
+ORIGAMI_BUILD_CONCURRENCY = 4
+BULK_MAX_DEMOS = 1000
+
+# Unix datagram socket in ORIGAMI_CONFIG_DIR the celery workers publish demo
+# events on, the API server listens on it and pushes the events to the
+# clients of /demo/events.
+ORIGAMI_EVENTS_SOCKET = 'events.sock'
+# Events buffered for each client of /demo/events before it is disconnected
+# as too slow, and the interval in seconds of the keep alive comments.
+EVENTS_CLIENT_QUEUE_SIZE = 256
+EVENTS_KEEPALIVE_INTERVAL = 15
+# Receive buffer in bytes of the events socket of the API server.
+EVENTS_SOCKET_BUFFER = 1024 * 1024
+# Build log lines buffered for each viewer of /demo/logs/<demo_id>/stream,
+# older lines are dropped for viewers which cannot keep up. The workers
+# publish the build output in batches of at most BUILD_LOG_BATCH_SIZE bytes
+# every BUILD_LOG_FLUSH_INTERVAL seconds.
+LOGS_STREAM_CLIENT_BUFFER = 1000
+BUILD_LOG_MAX_LINE = 8192
+BUILD_LOG_BATCH_SIZE = 32 * 1024
+BUILD_LOG_FLUSH_INTERVAL = 0.1
+
+# Demos cached by the API server and the seconds a cached demo is served
+# before it is read again from the database.
+DEMO_CACHE_SIZE = 1024
+DEMO_CACHE_TTL = 30
+
+# Resilience of the calls to the docker engines. Calls failing with a
+# transient error are retried with a jittered exponential backoff, each
+# kind of call has its own timeout in seconds. After
+# DOCKER_BREAKER_FAILURE_THRESHOLD consecutive transient failures the
+# circuit breaker of the engine opens and calls fail fast for
+# DOCKER_BREAKER_RESET_TIMEOUT seconds before the engine is probed again.
+DOCKER_RETRY_ATTEMPTS = 3
+DOCKER_RETRY_BASE_DELAY = 0.5
+DOCKER_RETRY_MAX_DELAY = 8
+DOCKER_BREAKER_FAILURE_THRESHOLD = 5
+DOCKER_BREAKER_RESET_TIMEOUT = 30
+# An open breaker reported by a worker is half open once its retry time
+# passed. A worker reports again when its probe call is made, a report left
+# unanswered DOCKER_BREAKER_REPORT_GRACE seconds after the retry time comes
+# from a worker which exited or is idle and is considered closed.
+DOCKER_BREAKER_REPORT_GRACE = 60
+DOCKER_ENDPOINT_TIMEOUTS = {
+    'info': 5,
+    'inspect': 10,
+    'run': 60,
+    'stop': 30,
+    'remove': 30,
+    'build': 1800,
+    'pull': 1800,
+    'list': 30,
+    'df': 60,
+    'prune': 600,
+}
+
+# Backend running the tasks, selected with the ORIGAMI_TASK_BACKEND
+# environment variable. The celery backend sends the tasks to celery workers
+# through an AMQP broker, the local backend queues them in the database and
+# runs them in a pool of LOCAL_EXECUTOR_PROCESSES processes of the API
+# server, see `executor`. The queue is polled every
+# LOCAL_EXECUTOR_POLL_INTERVAL seconds in case a wake up event was lost.
+TASK_BACKEND_ENV = 'ORIGAMI_TASK_BACKEND'
+TASK_BACKEND_CELERY = 'celery'
+TASK_BACKEND_LOCAL = 'local'
+DEFAULT_TASK_BACKEND = TASK_BACKEND_CELERY
+LOCAL_EXECUTOR_PROCESSES = 4
+LOCAL_EXECUTOR_POLL_INTERVAL = 1
+
+# Logging pipeline, records are put on a queue of LOG_QUEUE_SIZE records and
+# written by a background thread, records are dropped when the queue is
+# full. Each logging call site logs at most LOG_RATE_LIMIT records per
+# LOG_RATE_LIMIT_INTERVAL seconds. LOG_LEVELS sets the level of noisy
+# loggers, it is extended with the ORIGAMI_LOG_LEVELS environment variable,
+# for example ORIGAMI_LOG_LEVELS=peewee=DEBUG,tornado.access=WARNING
+LOG_QUEUE_SIZE = 10000
+LOG_RATE_LIMIT = 20
+LOG_RATE_LIMIT_INTERVAL = 10
+LOG_LEVELS = {
+    'peewee': 'INFO',
+    'urllib3': 'WARNING',
+    'docker': 'INFO',
+    'amqp': 'INFO',
+}
+LOG_LEVELS_ENV = 'ORIGAMI_LOG_LEVELS'
+
+# Retention of the logs. The daemon log is rotated once it reaches
+# LOG_MAX_BYTES or after LOG_ROTATE_INTERVAL seconds, LOG_BACKUP_COUNT
+# rotated files are kept gzip compressed. The previous DEPLOY_LOG_ATTEMPTS
+# build logs of each demo are kept compressed next to its current log and
+# rotated deploy logs are removed oldest first while the deploy logs use
+# more than DEPLOY_LOGS_DISK_CAP bytes. The deploy logs are swept every
+# LOG_SWEEP_INTERVAL seconds, at most LOG_SWEEP_BATCH files are compressed
+# per sweep.
+LOG_MAX_BYTES = 10 * 1024 * 1024  # 10 MiB
+LOG_ROTATE_INTERVAL = 24 * 60 * 60
+LOG_BACKUP_COUNT = 7
+LOG_FILE_MODE = 'a'
+DEPLOY_LOG_ATTEMPTS = 5
+DEPLOY_LOGS_DISK_CAP = 1024 * 1024 * 1024  # 1 GiB
+LOG_SWEEP_INTERVAL = 300
+LOG_SWEEP_BATCH = 50
+
+# Chunked bundle uploads. A single request carries at most UPLOAD_MAX_CHUNK
+# bytes of the bundle, the size of a bundle is limited by
+# BUNDLE_ZIP_MAX_COMPRESSED_SIZE. Uploads which are not complete after
+# UPLOAD_EXPIRY seconds are removed.
+UPLOAD_MAX_CHUNK = 64 * 1024 * 1024  # 64 MiB
+UPLOAD_EXPIRY = 24 * 60 * 60
+
+# Base images of the demos are pulled on the node by the API server as soon
+# as a bundle is validated, with at most PREPULL_CONCURRENCY pulls at a time.
+# A build waits up to PREPULL_WAIT_TIMEOUT seconds for the pulls of its base
+# images which are still in progress.
+PREPULL_CONCURRENCY = 2
+PREPULL_WAIT_TIMEOUT = 600
+PREPULL_POLL_INTERVAL = 1
+
+# Header of the tasks carrying the trace context of the deploys, at most
+# TRACE_MAX_SPANS spans are kept in the database.
+TRACE_HEADER = 'origami_trace'
+TRACE_MAX_SPANS = 100000
+
+# Defaults of `origamid bench`, the mix of requests is given as weights of
+# the operations. A run regresses when the throughput or the latency of an
+# operation is BENCH_TOLERANCE percent worse than the baseline, or its error
+# rate is BENCH_ERROR_TOLERANCE percentage points higher.
+BENCH_MIX = 'deploy=1,status=5,port=3,logs=1'
+BENCH_REQUEST_TIMEOUT = 60
+BENCH_TOLERANCE = 10.0
+BENCH_ERROR_TOLERANCE = 1.0
+
+# Labels of the images and containers of the demos, the containers of the
+# demos are listed with a filter on ORIGAMI_LABEL_DEMO_ID. The demos can be
+# rebuilt from the labels of their containers if the database is lost.
+ORIGAMI_LABEL_DEMO_ID = 'origami.demo_id'
+ORIGAMI_LABEL_LOG_ID = 'origami.log_id'
+ORIGAMI_LABEL_BUNDLE_DIGEST = 'origami.bundle_digest'
+ORIGAMI_LABEL_GENERATION = 'origami.generation'
+ORIGAMI_LABEL_REPLICA = 'origami.replica'
+ORIGAMI_LABEL_REPLICAS = 'origami.replicas'
+ORIGAMI_LABEL_PORT = 'origami.port'
+ORIGAMI_LABEL_RESOURCES = 'origami.resources'
+
+# The demos are reconciled with the containers of their node every
+# RECONCILE_INTERVAL seconds. Operations pending or running for more than
+# RECONCILE_STALE_AFTER seconds were interrupted.
+RECONCILE_INTERVAL = 300
+RECONCILE_STALE_AFTER = 2 * 60 * 60
+
+# Token buckets of the clients of the API server. A client sends at most
+# RATE_LIMIT_RATE requests per second to a route, with bursts of
+# RATE_LIMIT_BURST requests. The routes triggering deploys and removals are
+# limited to RATE_LIMIT_EXPENSIVE_RATE requests per second instead. At most
+# RATE_LIMIT_MAX_BUCKETS buckets are kept in memory, and a client uploads at
+# most RATE_LIMIT_MAX_UPLOADS chunks of bundles at the same time.
+RATE_LIMIT_RATE = 10
+RATE_LIMIT_BURST = 20
+RATE_LIMIT_EXPENSIVE_RATE = 0.2
+RATE_LIMIT_EXPENSIVE_BURST = 5
+RATE_LIMIT_MAX_BUCKETS = 10000
+RATE_LIMIT_MAX_UPLOADS = 4
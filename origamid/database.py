@@ -3,20 +3,70 @@ import logging
 
 import os
 from peewee import SqliteDatabase, Model, CharField, DateTimeField, \
-    IntegerField, ForeignKeyField, TextField
+    IntegerField, ForeignKeyField, TextField, FloatField, BigIntegerField, \
+    IntegrityError
+from playhouse.migrate import SqliteMigrator, migrate
 
 from .constants import DEMOS_PORT_COUNT_START, DEMOS_PORT_COUNT_END, \
-    ORIGAMI_CONFIG_DIR, ORIGAMI_DB_NAME
+    ORIGAMI_CONFIG_DIR, ORIGAMI_DB_NAME, DEFAULT_NODE_NAME, \
+    DEFAULT_CELERY_QUEUE, PORT_RESERVATION_TIMEOUT, PORT_RESERVATION_ATTEMPTS
+from .events import publish_demo_status
 
 db_path = os.path.join(os.environ['HOME'], ORIGAMI_CONFIG_DIR, ORIGAMI_DB_NAME)
 db = SqliteDatabase(db_path)
 
 
+# Callables run with the demo after a demo is saved, the API server uses
+# them to invalidate its cache of demos.
+demo_save_hooks = []
+
+
+def notify_demo_saved(demo):
+    """
+    Run the save hooks of a demo and publish its status. `Demos.save` does
+    it, demos or instances written with update queries must call it.
+
+    Args:
+        demo (Demos): Demo which was written.
+    """
+    for hook in demo_save_hooks:
+        hook(demo)
+    publish_demo_status(demo)
+
+
 class BaseModel(Model):
     class Meta:
         database = db
 
 
+class Nodes(BaseModel):
+    """
+    Registry of the docker engines demos can be deployed on. If the table
+    is empty the local docker engine is used as the only node.
+
+    The table has the following fields
+
+    * name: Unique name of the node.
+    * base_url: URL of the docker engine, for example
+        unix://var/run/docker.sock or tcp://10.0.0.2:2375
+    * queue: Celery queue consumed by the worker running on the node.
+    * status: Either active or disabled, disabled nodes are not used for
+        new deployments.
+    * cpus: CPUs of the node available to demos, if not set the CPUs
+        reported by the docker engine are used.
+    * memory: Memory in bytes of the node available to demos, if not set the
+        memory reported by the docker engine is used.
+    * timestamp: Timestamp corresponding to registration of the node.
+    """
+    name = CharField(unique=True, null=False)
+    base_url = CharField(null=False)
+    queue = CharField(default=DEFAULT_CELERY_QUEUE)
+    status = CharField(default='active')
+    cpus = FloatField(null=True)
+    memory = BigIntegerField(null=True)
+    timestamp = DateTimeField(default=datetime.datetime.now)
+
+
 class Demos(BaseModel):
     """
     This table holds the information about the details regarding
@@ -32,8 +82,25 @@ class Demos(BaseModel):
         here
     * log_id: id of the Log file for the demo.
     * status: Status for the deployement of demo.
-        - It can be one of running, stopped, redeploying, deploying, empty,
-            error
+        - It can be one of deploying, redeploying, starting, ready, failed,
+            running, stopped, empty, error
+        - starting means the containers are started but the readiness probe
+            has not succeeded yet, ready means the demo is serving and failed
+            means the readiness probe did not succeed before its timeout.
+            running is reported for containers which are up but were not
+            probed.
+    * replicas: Number of container instances to run for the demo, each
+        instance is recorded in `DemoInstances`. The container_id and port
+        above always correspond to the first replica.
+    * node: Name of the node from `Nodes` the demo is deployed on.
+    * cpu_request, memory_request: CPUs and memory in bytes reserved on the
+        node for each replica.
+    * cpu_limit, memory_limit: Maximum CPUs and memory in bytes each replica
+        is allowed to use.
+    * cpuset: CPUs the replicas are pinned to, for example 0-3.
+    * started_at: When the containers of the last deploy were started.
+    * ready_at: When the containers of the last deploy became ready.
+    * time_to_ready: Seconds between started_at and ready_at.
     * timestamp: Timestamp corresponding to creation of container.
     """
     demo_id = CharField(unique=True, null=False)
@@ -42,9 +109,304 @@ class Demos(BaseModel):
     port = IntegerField(unique=True, null=True)
     log_id = CharField(unique=True, null=False)
     status = CharField(null=False)
+    replicas = IntegerField(default=1)
+    node = CharField(default=DEFAULT_NODE_NAME)
+    cpu_request = FloatField(null=True)
+    memory_request = BigIntegerField(null=True)
+    cpu_limit = FloatField(null=True)
+    memory_limit = BigIntegerField(null=True)
+    cpuset = CharField(null=True)
+    started_at = DateTimeField(null=True)
+    ready_at = DateTimeField(null=True)
+    time_to_ready = FloatField(null=True)
+    timestamp = DateTimeField(default=datetime.datetime.now)
+
+    def save(self, *args, **kwargs):
+        """
+        Save the demo and publish its status, clients of /demo/events are
+        notified when the status changed and the API server invalidates the
+        cached demo.
+        """
+        rows = super(Demos, self).save(*args, **kwargs)
+        notify_demo_saved(self)
+        return rows
+
+
+class DemoInstances(BaseModel):
+    """
+    Container instances (replicas) running for a demo. A demo with
+    `replicas` set to N has N rows in this table once it is deployed.
+
+    The table has the following fields
+
+    * demo: Foreign key corresponding to Demos
+    * replica: Index of the replica, starting from 0.
+    * container_id: container ID of the replica.
+    * port: Host port the replica is published on.
+    * status: Status of the replica container, same values as Demos.status
+    * timestamp: Timestamp corresponding to creation of container.
+    """
+    demo = ForeignKeyField(Demos, backref='instances', on_delete='CASCADE')
+    replica = IntegerField(default=0)
+    container_id = CharField(unique=True, null=True)
+    port = IntegerField(unique=True, null=True)
+    status = CharField(null=False)
+    timestamp = DateTimeField(default=datetime.datetime.now)
+
+
+class PortReservations(BaseModel):
+    """
+    Host ports handed out to deploys which did not switch to their new
+    containers yet, see `reserve_ports`.
+
+    The table has the following fields
+
+    * port: Reserved host port.
+    * demo_id: ID of the demo being deployed.
+    * timestamp: When the port was reserved.
+    """
+    port = IntegerField(unique=True)
+    demo_id = CharField(null=False)
+    timestamp = DateTimeField(default=datetime.datetime.now)
+
+
+class DemoImages(BaseModel):
+    """
+    Images built for the demos, the image garbage collector uses this table
+    to decide which images can be removed.
+
+    The table has the following fields
+
+    * demo: Foreign key corresponding to Demos
+    * image_id: ID of the image.
+    * node: Name of the node the image was built on.
+    * size: Size of the image in bytes, filled in by the garbage collector.
+    * timestamp: Timestamp corresponding to creation of the image.
+    * last_used: Timestamp of the last deploy which ran the image.
+    """
+    demo = ForeignKeyField(Demos, backref='images', on_delete='CASCADE')
+    image_id = CharField(null=False)
+    node = CharField(default=DEFAULT_NODE_NAME)
+    size = BigIntegerField(null=True)
+    timestamp = DateTimeField(default=datetime.datetime.now)
+    last_used = DateTimeField(default=datetime.datetime.now)
+
+    class Meta:
+        indexes = ((('demo', 'image_id'), True), )
+
+
+class ImageCollections(BaseModel):
+    """
+    Report of each run of the image garbage collector.
+
+    The table has the following fields
+
+    * node: Name of the node the garbage collector ran on.
+    * images_removed: Number of demo images removed.
+    * bytes_reclaimed: Disk space in bytes reclaimed by the run.
+    * disk_usage: Disk space in bytes used by images and build cache after
+        the run.
+    * timestamp: Timestamp corresponding to the end of the run.
+    """
+    node = CharField(null=False)
+    images_removed = IntegerField(default=0)
+    bytes_reclaimed = BigIntegerField(default=0)
+    disk_usage = BigIntegerField(null=True)
+    timestamp = DateTimeField(default=datetime.datetime.now)
+
+
+class BulkJobs(BaseModel):
+    """
+    Bulk deploys and removals of demos, each demo of a job is recorded in
+    `BulkJobItems`.
+
+    The table has the following fields
+
+    * job_id: Unique ID of the job handed out to the client.
+    * action: Either deploy or remove.
+    * concurrency: Number of demos of the job processed in parallel.
+    * timestamp: Timestamp corresponding to creation of the job.
+    """
+    job_id = CharField(unique=True, null=False)
+    action = CharField(null=False)
+    concurrency = IntegerField(default=1)
+    timestamp = DateTimeField(default=datetime.datetime.now)
+
+
+class BulkJobItems(BaseModel):
+    """
+    Outcome of one demo of a bulk job.
+
+    The table has the following fields
+
+    * job: Foreign key corresponding to BulkJobs
+    * demo_id: Demo unique ID provided by origami_server
+    * bundle_path, replicas, node, placement: Deploy parameters of the demo,
+        same as the parameters of /deploy_trigger.
+    * status: One of pending, running, succeeded, failed
+    * message: Reason the demo failed.
+    * timestamp: Timestamp corresponding to the last status change.
+    """
+    job = ForeignKeyField(BulkJobs, backref='items', on_delete='CASCADE')
+    demo_id = CharField(null=False)
+    bundle_path = CharField(null=True)
+    replicas = IntegerField(null=True)
+    node = CharField(null=True)
+    placement = CharField(null=True)
+    status = CharField(default='pending')
+    message = TextField(null=True)
     timestamp = DateTimeField(default=datetime.datetime.now)
 
 
+class Operations(BaseModel):
+    """
+    Record of every deploy and remove of a demo, from the moment it is
+    enqueued until a worker finished it.
+
+    The table has the following fields
+
+    * operation_id: Unique ID of the operation handed out to the client.
+    * kind: Either deploy or remove.
+    * demo_id: Demo unique ID provided by origami_server
+    * node, queue: Node and celery queue the operation was sent to.
+    * status: One of pending, running, succeeded, failed
+    * stage: Current stage of a running operation, for example building.
+    * message: Reason the operation failed.
+    * enqueued_at, started_at, finished_at: When the operation was enqueued,
+        picked up by a worker and finished.
+    * trace_id: ID of the trace of the operation, see `tracing`.
+    * cpu_request, memory_request, replicas: Resources requested by a
+        deploy, they are reserved on its node until the deploy is finished.
+        A deploy without a replica count keeps the one of the demo.
+    """
+    operation_id = CharField(unique=True, null=False)
+    kind = CharField(null=False)
+    demo_id = CharField(null=False, index=True)
+    node = CharField(null=True)
+    queue = CharField(null=True)
+    status = CharField(default='pending')
+    stage = CharField(default='queued')
+    message = TextField(null=True)
+    enqueued_at = DateTimeField(default=datetime.datetime.now, index=True)
+    started_at = DateTimeField(null=True)
+    finished_at = DateTimeField(null=True)
+    trace_id = CharField(null=True)
+    cpu_request = FloatField(null=True)
+    memory_request = BigIntegerField(null=True)
+    replicas = IntegerField(null=True)
+
+
+class Jobs(BaseModel):
+    """
+    Durable queue of the tasks run by the local executor of the API server
+    when the local task backend is used, see `executor`.
+
+    The table has the following fields
+
+    * job_id: Unique ID of the job.
+    * task: Name of the celery task to run.
+    * args, kwargs: JSON encoded arguments of the task.
+    * headers: JSON encoded headers of the task, the trace context.
+    * queue: Celery queue the task was sent to, informative only.
+    * after: Job which must be finished before this one starts, used to run
+        the demos of a bulk job one after the other.
+    * status: One of pending, running, succeeded, failed
+    * error: Reason the job failed.
+    * enqueued_at, started_at, finished_at: When the job was enqueued,
+        started by the executor and finished.
+    """
+    job_id = CharField(unique=True, null=False)
+    task = CharField(null=False)
+    args = TextField(default='[]')
+    kwargs = TextField(default='{}')
+    queue = CharField(null=True)
+    after = ForeignKeyField('self', null=True, backref='next_jobs')
+    headers = TextField(default='{}')
+    status = CharField(default='pending', index=True)
+    error = TextField(null=True)
+    enqueued_at = DateTimeField(default=datetime.datetime.now)
+    started_at = DateTimeField(null=True)
+    finished_at = DateTimeField(null=True)
+
+
+class ImagePulls(BaseModel):
+    """
+    Pulls of the base images of the demos started before their build, see
+    `prepull`.
+
+    The table has the following fields
+
+    * node: Name of the node the image is pulled on.
+    * image: Reference of the image, with its tag.
+    * status: One of pulling, pulled, present (the node already had the
+        image), failed, missed (a build used the image before any pull)
+    * error: Reason the pull failed.
+    * builds: Number of builds which used the pull.
+    * wait: Total time in seconds the builds waited for the pull.
+    * requested_at, finished_at: When the pull was started and finished.
+    """
+    node = CharField(null=False)
+    image = CharField(null=False)
+    status = CharField(default='pulling')
+    error = TextField(null=True)
+    builds = IntegerField(default=0)
+    wait = FloatField(default=0)
+    requested_at = DateTimeField(default=datetime.datetime.now)
+    finished_at = DateTimeField(null=True)
+
+    class Meta:
+        indexes = ((('node', 'image'), False), )
+
+
+class Spans(BaseModel):
+    """
+    Spans of the traces of the deploys, see `tracing`. Only the most recent
+    TRACE_MAX_SPANS spans are kept.
+
+    The table has the following fields
+
+    * trace_id: ID of the trace the span belongs to.
+    * span_id: ID of the span, unique within its trace.
+    * parent_id: ID of the parent span, None for the root span of a trace.
+    * name: Name of the step, for example build.
+    * start: Timestamp the span started at.
+    * duration: Duration of the span in seconds.
+    * error: Error raised in the span.
+    * attributes: JSON encoded attributes of the span.
+    """
+    trace_id = CharField(null=False, index=True)
+    span_id = CharField(null=False)
+    parent_id = CharField(null=True)
+    name = CharField(null=False)
+    start = FloatField(null=False)
+    duration = FloatField(null=False)
+    error = TextField(null=True)
+    attributes = TextField(default='{}')
+
+
+class Uploads(BaseModel):
+    """
+    Bundles uploaded to the API server in chunks, see `uploads`.
+
+    The table has the following fields
+
+    * upload_id: Unique ID of the upload.
+    * size: Size in bytes of the complete bundle.
+    * sha256: Checksum of the bundle, provided by the client or computed
+        once the upload is complete.
+    * status: One of pending, complete, failed
+    * error: Reason the upload failed.
+    * created_at, completed_at: When the upload was created and completed.
+    """
+    upload_id = CharField(unique=True, null=False)
+    size = BigIntegerField(null=False)
+    sha256 = CharField(null=True)
+    status = CharField(default='pending')
+    error = TextField(null=True)
+    created_at = DateTimeField(default=datetime.datetime.now)
+    completed_at = DateTimeField(null=True)
+
+
 class Logs(BaseModel):
     """
     Logs relating to any demo which can be retrieved later on
@@ -58,27 +420,132 @@ class Logs(BaseModel):
     timestamp = DateTimeField(default=datetime.datetime.now)
 
 
-def get_a_free_port():
+def get_free_ports(count, exclude=()):
     """
-    Returns a PORT which is free by looking into the database for deployed
-    demos.
+    Returns a list of `count` PORTs which are free by looking into the
+    database for deployed demos, their instances and the ports reserved by
+    the deploys in progress. The ports are not reserved, see
+    `reserve_ports`.
+
+    Args:
+        count (int): Number of ports required.
+        exclude (iterable): Ports which must not be handed out, for example
+            ports which are being allocated by the caller.
+
+    Returns:
+        ports (list, None): Free ports or None if there are not enough free
+            ports in the demos port range.
     """
-    logging.info('Trying to find a free port.')
-    demos = Demos.select(Demos.port).order_by(+Demos.port)
+    logging.info('Trying to find {} free port(s).'.format(count))
+    used = set(exclude)
+    used.update(demo.port for demo in Demos.select(Demos.port)
+                if demo.port is not None)
+    used.update(instance.port
+                for instance in DemoInstances.select(DemoInstances.port)
+                if instance.port is not None)
+    used.update(reservation.port for reservation in PortReservations.select(
+        PortReservations.port).where(
+            PortReservations.timestamp > _get_reservation_expiry()))
 
+    ports = []
     port = DEMOS_PORT_COUNT_START
-    for demo in demos:
-        logging.info('Checking port {}'.format(demo.port))
+    while len(ports) < count:
         if port > DEMOS_PORT_COUNT_END:
             return None
-        if demo.port != port:
-            break
-        else:
-            port += 1
+        if port not in used:
+            ports.append(port)
+        port += 1
+
+    logging.info('Found free port(s) : {}'.format(ports))
+    return ports
+
+
+def _get_reservation_expiry():
+    return datetime.datetime.now() - datetime.timedelta(
+        seconds=PORT_RESERVATION_TIMEOUT)
+
+
+def reserve_ports(count, demo_id):
+    """
+    Returns `count` free PORTs and reserves them for a deploy of the demo,
+    so that the deploys running at the same time get different ports. The
+    reservation is released with `release_ports` once the ports are
+    recorded on the instances of the demo or the deploy rolled back.
+
+    Args:
+        count (int): Number of ports required.
+        demo_id (str): ID of the demo the ports are reserved for.
+
+    Returns:
+        ports (list, None): Reserved ports or None if there are not enough
+            free ports in the demos port range.
+    """
+    for _ in range(PORT_RESERVATION_ATTEMPTS):
+        try:
+            with db.atomic():
+                PortReservations.delete().where(
+                    PortReservations.timestamp <= _get_reservation_expiry()
+                ).execute()
+                ports = get_free_ports(count)
+                if ports is None:
+                    return None
+                PortReservations.insert_many(
+                    [{'port': port, 'demo_id': demo_id} for port in ports]
+                ).execute()
+            return ports
+        except IntegrityError:
+            # Another process reserved one of the ports in the meantime.
+            logging.info('Ports were reserved concurrently, retrying')
+    return None
 
-    logging.info('Found free port : {}'.format(port))
-    return port
+
+def release_ports(ports):
+    """
+    Release the ports reserved with `reserve_ports`.
+
+    Args:
+        ports (list): Reserved ports.
+    """
+    PortReservations.delete().where(PortReservations.port << ports).execute()
+
+
+def get_a_free_port():
+    """
+    Returns a PORT which is free by looking into the database for deployed
+    demos.
+    """
+    ports = get_free_ports(1)
+    return ports[0] if ports else None
+
+
+MODELS = [
+    Nodes, Demos, DemoInstances, PortReservations, DemoImages,
+    ImageCollections, BulkJobs, BulkJobItems, Operations, Jobs, ImagePulls,
+    Spans, Uploads, Logs
+]
+
+
+def migrate_db():
+    """
+    Add the columns which were introduced to the models after the database
+    was bootstrapped. Columns added this way must either be nullable or have
+    a default value.
+    """
+    migrator = SqliteMigrator(db)
+    operations = []
+    for model in MODELS:
+        table = model._meta.table_name
+        columns = set(column.name for column in db.get_columns(table))
+        for field in model._meta.sorted_fields:
+            if field.column_name not in columns:
+                logging.info('Adding column {} to {}'.format(
+                    field.column_name, table))
+                operations.append(
+                    migrator.add_column(table, field.column_name, field))
+    if operations:
+        migrate(*operations)
 
 
 def bootstrap_db():
-    db.create_tables([Demos, Logs])
+    db.create_tables(MODELS)
+    migrate_db()
@@ -2,6 +2,7 @@ from __future__ import absolute_import
 
 import docker
 import logging
+import threading
 
 from .constants import DOCKER_UNIX_SOCKET
 
@@ -10,3 +11,60 @@ try:
 except Exception as e:
     logging.warning('Environment variable are not set propery : {}'.format(e))
     docker_client = docker.DockerClient(base_url=DOCKER_UNIX_SOCKET)
+
+_node_clients = {}
+_node_clients_lock = threading.Lock()
+
+
+def _create_local_client(timeout):
+    try:
+        return docker.from_env(timeout=timeout)
+    except Exception:
+        return docker.DockerClient(base_url=DOCKER_UNIX_SOCKET, timeout=timeout)
+
+
+def get_docker_client(node=None, timeout=None):
+    """
+    Returns the docker client for the provided node, clients are created
+    once per docker engine URL and timeout and reused afterwards.
+
+    Args:
+        node (Nodes, None): Node to connect to, the local docker engine is
+            used if no node or a node without base_url is provided.
+        timeout (int, None): Timeout in seconds of the requests made with the
+            client, the docker-py default is used if not provided.
+
+    Returns:
+        client (docker.DockerClient): Client for the docker engine of the node.
+    """
+    base_url = node.base_url if node is not None else None
+    if not base_url and timeout is None:
+        return docker_client
+
+    with _node_clients_lock:
+        client = _node_clients.get((base_url, timeout))
+        if client is None:
+            if base_url:
+                logging.info('Connecting to docker engine of node {} at '
+                             '{}'.format(node.name, base_url))
+                kwargs = {'timeout': timeout} if timeout else {}
+                client = docker.DockerClient(base_url=base_url, **kwargs)
+            else:
+                client = _create_local_client(timeout)
+            _node_clients[(base_url, timeout)] = client
+    return client
+
+
+def get_docker_api_client(node=None):
+    """
+    Returns a low level docker API client for the provided node, this is
+    used where the high level client does not expose what we need, for
+    example the logs of an image build.
+
+    Args:
+        node (Nodes, None): Node to connect to.
+
+    Returns:
+        client (docker.APIClient): Low level client for the docker engine.
+    """
+    return get_docker_client(node).api
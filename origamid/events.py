@@ -0,0 +1,181 @@
+import errno
+import json
+import logging
+import os
+import socket
+import threading
+import time
+
+from .constants import ORIGAMI_CONFIG_DIR, ORIGAMI_EVENTS_SOCKET, \
+    BUILD_LOG_MAX_LINE, BUILD_LOG_BATCH_SIZE, BUILD_LOG_FLUSH_INTERVAL, \
+    EVENTS_SOCKET_BUFFER
+
+events_socket_path = os.path.join(os.environ['HOME'], ORIGAMI_CONFIG_DIR,
+                                  ORIGAMI_EVENTS_SOCKET)
+
+# Publishing socket of the current process, celery forks its workers so the
+# socket is recreated when the pid changes.
+_publisher = {'pid': None, 'socket': None}
+
+
+def _get_publisher():
+    if _publisher['pid'] != os.getpid():
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sock.setblocking(False)
+        _publisher.update(pid=os.getpid(), socket=sock)
+    return _publisher['socket']
+
+
+def publish_event(event_type, **data):
+    """
+    Publish an event to the API server over the local events socket.
+
+    Publishing never blocks and never fails, the event is dropped if the
+    API server is not running or cannot keep up. Events are small JSON
+    datagrams.
+
+    Args:
+        event_type (str): Type of the event, for example status.
+        data: Payload of the event.
+
+    Returns:
+        (bool): True if the event was sent.
+    """
+    data['type'] = event_type
+    data.setdefault('timestamp', time.time())
+    try:
+        _get_publisher().sendto(
+            json.dumps(data).encode('utf-8'), events_socket_path)
+        return True
+    except (socket.error, OSError, ValueError) as e:
+        if getattr(e, 'errno', None) not in (errno.ENOENT, errno.ECONNREFUSED,
+                                             errno.EAGAIN):
+            logging.debug('Cannot publish {} event : {}'.format(
+                event_type, e))
+        return False
+
+
+def publish_demo_status(demo):
+    """
+    Publish the current status of a demo, the API server turns it into a
+    status transition event if the status changed.
+
+    Args:
+        demo (Demos): Demo whose status was written.
+    """
+    publish_event('status', demo_id=demo.demo_id, status=demo.status)
+
+
+class BuildLogPublisher(object):
+    """
+    Publishes the build output of a demo to the viewers of the build log
+    stream as it is produced. Lines are batched into one event per
+    BUILD_LOG_FLUSH_INTERVAL seconds or BUILD_LOG_BATCH_SIZE bytes so a
+    burst of output does not overflow the events socket, long lines are
+    truncated to BUILD_LOG_MAX_LINE.
+
+    Attributes:
+        demo_id: ID of the demo being built.
+        seq: Index in the build output of the next line to publish, viewers
+            use it to notice lines which were dropped.
+    """
+
+    def __init__(self, demo_id):
+        self.demo_id = demo_id
+        self.seq = 0
+        self._lines = []
+        self._size = 0
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def add(self, entry):
+        """
+        Add one decoded line of the docker build output.
+        """
+        line = entry.get('stream') or entry.get('status') or entry.get(
+            'error') or ''
+        line = line[:BUILD_LOG_MAX_LINE]
+        with self._lock:
+            self._lines.append(line)
+            self._size += len(line)
+            if self._size < BUILD_LOG_BATCH_SIZE:
+                if self._timer is None:
+                    self._timer = threading.Timer(BUILD_LOG_FLUSH_INTERVAL,
+                                                  self.flush)
+                    self._timer.daemon = True
+                    self._timer.start()
+                return
+        self.flush()
+
+    def flush(self):
+        """
+        Publish the lines added since the last flush.
+        """
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            lines, self._lines, self._size = self._lines, [], 0
+            if lines:
+                publish_event(
+                    'log', demo_id=self.demo_id, seq=self.seq, lines=lines)
+                self.seq += len(lines)
+
+    def close(self, status):
+        """
+        Publish the remaining lines and the end of the build output.
+
+        Args:
+            status (str): Either succeeded or failed.
+        """
+        self.flush()
+        publish_event(
+            'log_end', demo_id=self.demo_id, seq=self.seq, status=status)
+
+
+def bind_events_socket(path=None):
+    """
+    Create the non blocking socket the API server receives events on.
+    A stale socket file left behind by a previous server is replaced.
+
+    Args:
+        path (str, None): Path of the socket, events_socket_path by default.
+
+    Returns:
+        sock (socket.socket): The bound socket.
+    """
+    path = path or events_socket_path
+    if os.path.exists(path):
+        os.unlink(path)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    sock.setblocking(False)
+    # A larger receive buffer absorbs bursts of build log lines.
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, EVENTS_SOCKET_BUFFER)
+    sock.bind(path)
+    return sock
+
+
+def read_events(sock, max_size=65536):
+    """
+    Read all the events waiting on a bound events socket.
+
+    Args:
+        sock (socket.socket): Socket returned by `bind_events_socket`.
+        max_size (int): Maximum size in bytes of an event.
+
+    Returns:
+        events (list): Decoded events, malformed datagrams are skipped.
+    """
+    events = []
+    while True:
+        try:
+            datagram = sock.recv(max_size)
+        except (socket.error, OSError) as e:
+            if getattr(e, 'errno', None) in (errno.EAGAIN, errno.EWOULDBLOCK):
+                break
+            raise
+        try:
+            events.append(json.loads(datagram.decode('utf-8')))
+        except ValueError:
+            logging.warn('Dropping malformed event')
+    return events
@@ -29,3 +29,18 @@ class OrigamiDockerConnectionError(OrigamiException):
     or use docker.
     """
     STATUS_CODE = 300
+
+
+class OrigamiCapacityException(OrigamiException):
+    """
+    None of the nodes has enough free resources to run a demo.
+    """
+    STATUS_CODE = 400
+
+
+class OrigamiDockerUnavailableError(OrigamiDockerConnectionError):
+    """
+    The circuit breaker of a docker engine is open, calls to the engine fail
+    fast until it is probed again.
+    """
+    STATUS_CODE = 310
@@ -0,0 +1,261 @@
+import click
+import datetime
+import functools
+import json
+import logging
+import multiprocessing
+import os
+import select
+import shutil
+import tempfile
+import time
+import traceback
+import uuid
+
+from peewee import JOIN
+from tornado.ioloop import IOLoop, PeriodicCallback
+
+from .celery import app, get_task_backend
+from .constants import LOCAL_EXECUTOR_PROCESSES, \
+    LOCAL_EXECUTOR_POLL_INTERVAL, DEFAULT_CELERY_QUEUE
+from .database import Jobs
+from .events import publish_event, bind_events_socket, read_events
+from .operations import summarize
+from .tracing import set_remote_context, clear_remote_context
+from . import tasks
+
+
+def enqueue_job(task,
+                args=None,
+                kwargs=None,
+                queue=None,
+                after=None,
+                headers=None):
+    """
+    Queue a task for the local executor. The job is stored in the database
+    so it survives a restart of the API server, then the executor is woken
+    up with a job event.
+
+    Args:
+        task (str): Name of the celery task.
+        args (tuple, None): Positional arguments of the task.
+        kwargs (dict, None): Keyword arguments of the task.
+        queue (str, None): Celery queue the task was sent to.
+        after (Jobs, None): Job which must be finished before this one
+            starts.
+        headers (dict, None): Headers of the task.
+
+    Returns:
+        job (Jobs): The queued job.
+    """
+    job = Jobs.create(
+        job_id=uuid.uuid4().hex,
+        task=task,
+        args=json.dumps(list(args or ())),
+        kwargs=json.dumps(kwargs or {}),
+        queue=queue,
+        after=after,
+        headers=json.dumps(headers or {}))
+    publish_event('job', job_id=job.job_id)
+    return job
+
+
+def run_job(job_id):
+    """
+    Run a queued job, this is called in a process of the executor pool.
+    Errors are raised to the executor which records them.
+
+    Args:
+        job_id (str): ID of the job.
+
+    Returns:
+        The return value of the task.
+    """
+    job = Jobs.get(Jobs.job_id == job_id)
+    task = app.tasks[job.task]
+    set_remote_context(json.loads(job.headers))
+    try:
+        return task(*json.loads(job.args), **json.loads(job.kwargs))
+    except Exception:
+        # The traceback of the pool process is lost when the error is
+        # raised in the executor.
+        logging.error('Job {} failed :\n{}'.format(job_id,
+                                                   traceback.format_exc()))
+        raise
+    finally:
+        clear_remote_context()
+
+
+class LocalExecutor(object):
+    """
+    Runs the queued jobs in a pool of processes of the API server, which
+    replaces the celery workers and the AMQP broker on a single host.
+
+    Jobs are started in the order they were enqueued, a job whose `after`
+    job is not finished yet waits for it. Jobs left running by a previous
+    API server are run again when the executor starts, the deploy and
+    remove tasks can safely be repeated. The periodic tasks of the celery
+    beat schedule are enqueued on schedule, unless the previous run is
+    still queued.
+
+    The pool is started with the spawn method, forking the API server would
+    share its database and docker connections with the pool processes.
+    """
+
+    def __init__(self,
+                 processes=LOCAL_EXECUTOR_PROCESSES,
+                 poll_interval=LOCAL_EXECUTOR_POLL_INTERVAL):
+        self.processes = processes
+        self.poll_interval = poll_interval
+        self.running = set()
+        self.pool = None
+        self.io_loop = None
+        self._poller = None
+        self._schedulers = []
+
+    def start(self, io_loop=None):
+        """
+        Start the pool and poll the queue on the IOLoop.
+        """
+        recovered = Jobs.update(status='pending', started_at=None).where(
+            Jobs.status == 'running').execute()
+        if recovered:
+            logging.warn('Running {} interrupted job(s) again'.format(
+                recovered))
+
+        self.io_loop = io_loop or IOLoop.current()
+        self.pool = multiprocessing.get_context('spawn').Pool(
+            self.processes)
+        self._poller = PeriodicCallback(self.poll, self.poll_interval * 1000)
+        self._poller.start()
+        for entry in app.conf.beat_schedule.values():
+            scheduler = PeriodicCallback(
+                functools.partial(self.schedule, entry),
+                entry['schedule'] * 1000)
+            scheduler.start()
+            self._schedulers.append(scheduler)
+        self.io_loop.add_callback(self.poll)
+        logging.info('Local executor started with {} processes'.format(
+            self.processes))
+
+    def stop(self):
+        if self._poller:
+            self._poller.stop()
+        for scheduler in self._schedulers:
+            scheduler.stop()
+        self._schedulers = []
+        if self.pool:
+            self.pool.terminate()
+            self.pool = None
+
+    def schedule(self, entry):
+        """
+        Enqueue a periodic task of the beat schedule.
+
+        Args:
+            entry (dict): Entry of the beat schedule.
+
+        Returns:
+            job (Jobs, None): The queued job, None if the task is already
+                queued or running.
+        """
+        queued = Jobs.select().where(Jobs.task == entry['task']).where(
+            Jobs.status.in_(['pending', 'running'])).exists()
+        if queued:
+            return None
+        options = entry.get('options', {})
+        return enqueue_job(entry['task'], entry.get('args'),
+                           entry.get('kwargs'), options.get('queue'))
+
+    def poll(self):
+        """
+        Start the pending jobs which can run, as long as a process of the
+        pool is free.
+        """
+        if self.pool is None:
+            return
+        free = self.processes - len(self.running)
+        if free <= 0:
+            return
+
+        previous = Jobs.alias()
+        previous_finished = previous.status.in_(['succeeded', 'failed'])
+        jobs = Jobs.select(Jobs).join(
+            previous, JOIN.LEFT_OUTER, on=(Jobs.after == previous.id)).where(
+                Jobs.status == 'pending',
+                previous.id.is_null() | previous_finished).order_by(
+                    Jobs.id).limit(free)
+        for job in jobs:
+            self._start(job)
+
+    def _start(self, job):
+        job.status = 'running'
+        job.started_at = datetime.datetime.now()
+        job.save()
+        self.running.add(job.job_id)
+        logging.info('Starting job {} : {}'.format(job.job_id, job.task))
+
+        def done(result):
+            self.io_loop.add_callback(self._finish, job.job_id, None)
+
+        def failed(error):
+            message = '{}'.format(error) or error.__class__.__name__
+            self.io_loop.add_callback(self._finish, job.job_id, message)
+
+        self.pool.apply_async(
+            run_job, (job.job_id, ), callback=done, error_callback=failed)
+
+    def _finish(self, job_id, error):
+        self.running.discard(job_id)
+        Jobs.update(
+            status='failed' if error else 'succeeded',
+            error=error,
+            finished_at=datetime.datetime.now()).where(
+                Jobs.job_id == job_id).execute()
+        self.poll()
+
+
+local_executor = LocalExecutor()
+
+
+@click.command('bench-tasks')
+@click.option('--count', default=100, help='Number of tasks to run')
+@click.option('--timeout', default=30, help='Seconds to wait for a task')
+def bench_tasks(count, timeout):
+    """Measures the enqueue to start latency of the task backend.
+
+    Tasks are enqueued one at a time with the backend selected by the
+    ORIGAMI_TASK_BACKEND environment variable and report when they started.
+    The celery backend needs a worker consuming the default queue, the
+    local backend a running API server.
+
+    .. code-block:: bash
+
+        $ ORIGAMI_TASK_BACKEND=local origamid bench-tasks --count 50
+
+    Args:
+        count (int): Number of tasks to run.
+        timeout (int): Seconds to wait for a task to start.
+    """
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'bench.sock')
+    sock = bind_events_socket(path)
+    latencies = []
+    try:
+        for _ in range(count):
+            tasks.ping.apply_async(
+                args=(time.time(), path), queue=DEFAULT_CELERY_QUEUE)
+            if not select.select([sock], [], [], timeout)[0]:
+                raise click.ClickException(
+                    'No task started within {} seconds, is a worker or the '
+                    'API server running?'.format(timeout))
+            latencies.extend(e['latency'] for e in read_events(sock))
+    finally:
+        sock.close()
+        shutil.rmtree(directory)
+
+    stats = summarize([latency * 1000 for latency in latencies])
+    click.echo('{} backend, {} tasks, enqueue to start latency in ms : mean '
+               '{:.2f}, p50 {:.2f}, p95 {:.2f}, max {:.2f}'.format(
+                   get_task_backend(), stats['count'], stats['mean'],
+                   stats['p50'], stats['p95'], stats['max']))
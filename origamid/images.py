@@ -0,0 +1,160 @@
+import datetime
+import logging
+
+from collections import OrderedDict
+from docker.errors import NotFound, APIError
+
+from .constants import ORIGAMI_IMAGE_RETAIN_PREVIOUS, \
+    ORIGAMI_IMAGE_DISK_BUDGET, ORIGAMI_LABEL_DEMO_ID
+from .database import Demos, DemoImages, ImageCollections
+from .resilience import call_docker
+
+
+def record_demo_image(demo, image_id):
+    """
+    Record that the demo runs the image, the image becomes the most recently
+    used image of the demo.
+
+    Args:
+        demo (Demos): Demo running the image, it must have been saved.
+        image_id: ID of the image.
+    """
+    image, created = DemoImages.get_or_create(
+        demo=demo, image_id=image_id, defaults={'node': demo.node})
+    if not created:
+        image.node = demo.node
+        image.last_used = datetime.datetime.now()
+        image.save()
+
+
+def get_disk_usage(node):
+    """
+    Returns the disk space used by the images and the build cache of the
+    docker engine of a node.
+
+    Args:
+        node (Nodes): Node to get the disk usage of.
+
+    Returns:
+        usage (int): Disk usage in bytes.
+    """
+    df = call_docker(node, 'df', lambda c: c.df())
+    build_cache = sum(b.get('Size', 0) for b in df.get('BuildCache') or [])
+    return df.get('LayersSize', 0) + build_cache
+
+
+def _get_image_candidates(node_name):
+    """
+    Returns the images of the demos on the node which are not in use,
+    split into the ones beyond the retention of their demo and the retained
+    previous images. Both lists are in least recently used order.
+
+    The images are selected by the node they were built on. The current
+    image of a demo running on the node is never a candidate, images which
+    are still used by a container are skipped when removing them. A demo
+    which moved to another node keeps no previous images on the node.
+    """
+    expired, retained = [], []
+    images = DemoImages.select(DemoImages, Demos).join(Demos).where(
+        DemoImages.node == node_name).order_by(DemoImages.last_used.desc())
+    by_demo = OrderedDict()
+    for image in images:
+        by_demo.setdefault(image.demo.id, []).append(image)
+    for demo_images in by_demo.values():
+        demo = demo_images[0].demo
+        if demo.node != node_name:
+            expired.extend(demo_images)
+            continue
+        previous = [i for i in demo_images if i.image_id != demo.image_id]
+        retained.extend(previous[:ORIGAMI_IMAGE_RETAIN_PREVIOUS])
+        expired.extend(previous[ORIGAMI_IMAGE_RETAIN_PREVIOUS:])
+
+    def lru(images):
+        return sorted(images, key=lambda i: i.last_used)
+
+    return lru(expired), lru(retained)
+
+
+def _remove_image(node, image):
+    """
+    Remove a demo image from the docker engine and from `DemoImages`.
+
+    Returns:
+        (bool): False if the image could not be removed, for example because
+            a container still uses it.
+    """
+    try:
+        if image.size is None:
+            image.size = call_docker(
+                node, 'inspect',
+                lambda c: c.images.get(image.image_id)).attrs.get('Size')
+        call_docker(node, 'remove', lambda c: c.images.remove(image.image_id))
+    except NotFound:
+        pass
+    except APIError as e:
+        logging.warn('Image {} of demo {} cannot be removed : {}'.format(
+            image.image_id, image.demo.demo_id, e))
+        return False
+
+    logging.info('Removed image {} of demo {}'.format(image.image_id,
+                                                      image.demo.demo_id))
+    image.delete_instance()
+    return True
+
+
+def collect_images(node, budget=ORIGAMI_IMAGE_DISK_BUDGET):
+    """
+    Garbage collect the demo images and the build cache of a node.
+
+    * Images of a demo beyond its current image and the
+        ORIGAMI_IMAGE_RETAIN_PREVIOUS previous ones are removed.
+    * Dangling images left behind by builds are pruned, the images of the
+        demos are labelled and are kept out of the prune.
+    * While the disk usage is above the budget the retained previous images
+        are removed in least recently used order, then the build cache is
+        pruned.
+
+    Args:
+        node (Nodes): Node to collect the images of.
+        budget (int): Disk space in bytes images and build cache may use.
+
+    Returns:
+        collection (ImageCollections): Report of the run.
+    """
+    # Fail fast if the docker engine of the node is unavailable.
+    call_docker(node, 'info', lambda c: c.ping())
+    usage_before = get_disk_usage(node)
+    logging.info('Collecting images on node {}, disk usage {} bytes'.format(
+        node.name, usage_before))
+
+    expired, retained = _get_image_candidates(node.name)
+    removed = len([i for i in expired if _remove_image(node, i)])
+    # The demo images are built without a tag, they are all dangling once
+    # no container runs them. The labelled ones are collected above, only
+    # the intermediate images of the builds are pruned.
+    call_docker(node, 'prune', lambda c: c.images.prune(filters={
+        'dangling': True,
+        'label!': ORIGAMI_LABEL_DEMO_ID
+    }))
+
+    usage = get_disk_usage(node)
+    for image in retained:
+        if usage <= budget:
+            break
+        if _remove_image(node, image):
+            removed += 1
+            usage -= image.size or 0
+
+    if usage > budget:
+        logging.info('Disk usage above budget, pruning build cache')
+        call_docker(node, 'prune', lambda c: c.api.prune_builds())
+
+    usage_after = get_disk_usage(node)
+    collection = ImageCollections.create(
+        node=node.name,
+        images_removed=removed,
+        bytes_reclaimed=max(0, usage_before - usage_after),
+        disk_usage=usage_after)
+    logging.info('Removed {} images on node {}, reclaimed {} bytes'.format(
+        removed, node.name, collection.bytes_reclaimed))
+    return collection
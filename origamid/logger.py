@@ -1,8 +1,23 @@
 from .utils.file import get_log_path
-from .constants import LOGS_FILE_MODE_REQ, DEFAULT_LOG_FILE
-
+from .retention import RotatingFileHandler
+from .constants import DEFAULT_LOG_FILE, \
+    LOG_QUEUE_SIZE, LOG_RATE_LIMIT, LOG_RATE_LIMIT_INTERVAL, LOG_LEVELS, \
+    LOG_LEVELS_ENV
+
+import atexit
+import datetime
+import json
+import os
 import sys
+import threading
+import time
 import logging
+import logging.handlers
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 
 # ANSI Color codes
 # Don't put these in constants.py let them be here only, I don't think we will
@@ -14,14 +29,123 @@ TERMINAL_COLOR_RED = '\033[91m'
 TERMINAL_COLOR_END = '\033[0m'
 
 
+# The OrigamiLogger whose pipeline is attached to the root logger.
+_active = {'logger': None}
+
+
+def get_logger_levels():
+    """
+    Returns the levels of the loggers from LOG_LEVELS and the
+    ORIGAMI_LOG_LEVELS environment variable, a comma separated list of
+    name=LEVEL pairs.
+
+    Returns:
+        levels (dict): Level name keyed by logger name.
+    """
+    levels = dict(LOG_LEVELS)
+    for pair in os.environ.get(LOG_LEVELS_ENV, '').split(','):
+        name, _, level = pair.partition('=')
+        if name.strip() and level.strip():
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Limits the records logged from each call site to `rate` records per
+    `interval` seconds. Once the interval is over the next record of the
+    call site tells how many records were suppressed. Errors are never
+    suppressed.
+
+    Attributes:
+        suppressed: Total number of suppressed records.
+    """
+
+    def __init__(self, rate=LOG_RATE_LIMIT, interval=LOG_RATE_LIMIT_INTERVAL):
+        super(RateLimitFilter, self).__init__()
+        self.rate = rate
+        self.interval = interval
+        self.suppressed = 0
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= logging.ERROR:
+            return True
+        key = (record.name, record.pathname, record.lineno)
+        now = time.time()
+        with self._lock:
+            start, count, suppressed = self._windows.get(key, (now, 0, 0))
+            if now - start >= self.interval:
+                if suppressed:
+                    record.msg = '{} ({} similar messages suppressed)'.format(
+                        record.msg, suppressed)
+                start, count, suppressed = now, 0, 0
+            count += 1
+            if count > self.rate:
+                suppressed += 1
+                self.suppressed += 1
+            self._windows[key] = (start, count, suppressed)
+        return count <= self.rate
+
+
+class AsyncQueueHandler(logging.handlers.QueueHandler):
+    """
+    Puts the records on the queue of the logging pipeline, the calling
+    thread never writes a log itself. Records are dropped and counted when
+    the queue is full. The pipeline is restarted in a forked process, the
+    thread writing the records is not copied by a fork.
+
+    Attributes:
+        dropped: Number of records dropped because the queue was full.
+    """
+
+    def __init__(self, pipeline):
+        super(AsyncQueueHandler, self).__init__(pipeline.queue)
+        self.pipeline = pipeline
+        self.dropped = 0
+
+    def prepare(self, record):
+        # The message and the traceback are rendered on the calling thread,
+        # the arguments may change before the record is written. The record
+        # is copied, other handlers of the logger get it unchanged.
+        record = logging.makeLogRecord(record.__dict__)
+        record.message = record.getMessage()
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(
+                record.exc_info)
+        record.msg = record.message
+        record.args = None
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def emit(self, record):
+        if self.pipeline.pid != os.getpid():
+            self.pipeline.restart()
+        super(AsyncQueueHandler, self).emit(record)
+
+
 class OrigamiLogger(object):
     """
     Custom class for setting up logging for CV_Origami.
 
+    The root logger only has a queue handler, the file and console handlers
+    are run by a `logging.handlers.QueueListener` on a background thread so
+    logging never does I/O on the calling thread. Each logging call site is
+    rate limited by a `RateLimitFilter` and the level of noisy loggers is
+    set from `get_logger_levels`.
+
     Attributes:
         log_level: Root logger log level
         file_log_level: File logger log level
         console_log_level: Console logger log level
+        handlers: Handlers the records are written to by the listener.
     """
     log_level = logging.DEBUG
     file_log_level = logging.INFO
@@ -59,9 +183,22 @@ class OrigamiLogger(object):
             file_log_level: Level for file logger.
             console_log_level: Log level for console logger.
         """
+        if _active['logger'] is not None:
+            _active['logger'].stop()
+        _active['logger'] = self
+
+        self.handlers = []
+        self.listener = None
+        self.pid = None
+        self.queue = None
+        self.rate_limit = RateLimitFilter()
+        self.restart()
+
         logger = logging.getLogger()
         logger.setLevel(self.log_level)
-        logger.handlers = []
+        logger.handlers = [self.queue_handler]
+        for name, level in get_logger_levels().items():
+            self.set_level(name, level)
 
         if console_log_level:
             self.console_log_level = console_log_level
@@ -73,6 +210,52 @@ class OrigamiLogger(object):
             self.file_log_level = file_log_level
             self.enable_file_logging()
 
+    def restart(self):
+        """
+        Start the listener writing the records of the queue to the handlers,
+        a running listener is stopped first.
+        """
+        if self.listener is not None and self.pid == os.getpid():
+            self.listener.stop()
+        self.pid = os.getpid()
+        self.queue = queue.Queue(LOG_QUEUE_SIZE)
+        if getattr(self, 'queue_handler', None) is None:
+            self.queue_handler = AsyncQueueHandler(self)
+            self.queue_handler.addFilter(self.rate_limit)
+        self.queue_handler.queue = self.queue
+        self.listener = logging.handlers.QueueListener(
+            self.queue, *self.handlers, respect_handler_level=True)
+        self.listener.start()
+
+    def stop(self):
+        """
+        Write the queued records and stop the listener.
+        """
+        if self.listener is not None and self.pid == os.getpid():
+            self.listener.stop()
+        self.listener = None
+
+    def _set_handlers(self, handlers):
+        self.handlers = handlers
+        self.restart()
+
+    def set_level(self, name, level):
+        """
+        Set the level of a logger, for example to silence a library.
+
+        Args:
+            name (str): Name of the logger.
+            level (int, str): Level of the logger, for example WARNING.
+        """
+        logging.getLogger(name).setLevel(level)
+
+    def _get_json_formatter(self):
+        """
+        Returns a formatter writing each record as a JSON object on one line,
+        see `JsonFormatter`.
+        """
+        return JsonFormatter()
+
     def _get_verbose_console_formatter(self):
         """
         A more verbose console formatter, the format of the message is
@@ -144,17 +327,10 @@ log
         not to bloat the console. If a more verbose console log is needed send \
         the ``verbose`` parameter as ``True``
 
-        For this to work properly with custom formatter \
-        `CustomConsoleFormatter` \
-        like in the case of verbose=False file_handlers should be before \
-        console_handlerssince FileHandler inherits from StreamHandler which \
-        conflicts the log message format in FileLogger.
-
         Args:
             verbose (bool): Set verbosity for console formatting
             level (logging.Level): Max log level for the logger.
         """
-        logger = logging.getLogger()
         if not level:
             level = self.console_log_level
 
@@ -166,13 +342,13 @@ log
         console_handler.setFormatter(formatter)
 
         logger_handlers = []
-        for handler in logger.handlers:
+        for handler in self.handlers:
             if isinstance(handler, logging.FileHandler):
                 logger_handlers.append(handler)
 
         logger_handlers.append(console_handler)
 
-        logger.handlers = logger_handlers
+        self._set_handlers(logger_handlers)
 
     def disable_console_logging(self):
         """
@@ -181,45 +357,88 @@ log
         console loggers this necesserily removes all ConsoleHandlers disabling \
         any console logging.
         """
-        logger = logging.getLogger()
-        for handler in logging.handlers:
-            # We cannot check for logging.StreamHandler here as FileHandler
-            # inherits StreamHandler so all handlers will be removed.
-            if not isinstance(handler, logging.FileHandler):
-                logger.removeHandler(handler)
+        # We cannot check for logging.StreamHandler here as FileHandler
+        # inherits StreamHandler so all handlers will be removed.
+        self._set_handlers([
+            h for h in self.handlers if isinstance(h, logging.FileHandler)
+        ])
 
-    def enable_file_logging(self, level=None):
+    def enable_file_logging(self, level=None, structured=True):
         """
-        File logging are quite verbose by default, if you want to change the \
-        format of the log change the formatter in ``_get_file_formatter()``
+        File logging are quite verbose by default, records are written as
+        JSON objects, one per line, unless ``structured`` is False. If you
+        want to change the format of the log change the formatter in
+        ``_get_json_formatter()`` or ``_get_file_formatter()``
+
+        The log is appended to and rotated by size and age, see
+        `retention.RotatingFileHandler`.
 
         Args:
             level (logging.Level): Max log level for the logger.
+            structured (bool): Write the records as JSON.
         """
-        logger = logging.getLogger()
         if not level:
             level = self.file_log_level
 
-        file_handler = logging.FileHandler(
-            get_log_path(DEFAULT_LOG_FILE), mode=LOGS_FILE_MODE_REQ)
+        file_handler = RotatingFileHandler(get_log_path(DEFAULT_LOG_FILE))
         file_handler.setLevel(level)
-        file_handler.setFormatter(self._get_file_formatter())
+        if structured:
+            file_handler.setFormatter(self._get_json_formatter())
+        else:
+            file_handler.setFormatter(self._get_file_formatter())
 
         logger_handlers = [file_handler]
-        for handler in logger.handlers:
+        for handler in self.handlers:
             if not isinstance(handler, logging.FileHandler):
                 logger_handlers.append(handler)
 
-        logger.handlers = logger_handlers
+        self._set_handlers(logger_handlers)
 
     def disable_file_logging(self):
         """
-        Removes all the non FileHandlers from our logger handlers
+        Removes all the FileHandlers from our logger handlers
         """
-        logger = logging.getLogger()
-        for handler in logger.handlers:
-            if isinstance(handler, logging.FileHandler):
-                logger.removeHandler(handler)
+        self._set_handlers([
+            h for h in self.handlers if not isinstance(h, logging.FileHandler)
+        ])
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats a record as a JSON object on one line, for example
+
+    .. code-block:: bash
+
+        {"time": "2018-06-15T11:22:02.118092", "level": "INFO", "logger": \
+"root", "file": "tasks.py", "line": 512, "process": 4242, "thread": \
+"MainThread", "message": "Demo started"}
+
+    Fields passed with the ``extra`` argument of the logging call are added
+    to the object, the traceback of an exception is in ``exc_info``.
+    """
+    # Attributes every record has, anything else was passed with extra.
+    reserved = set(logging.makeLogRecord({}).__dict__) | set(['message'])
+
+    def format(self, record):
+        entry = {
+            'time': datetime.datetime.fromtimestamp(
+                record.created).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'file': record.filename,
+            'line': record.lineno,
+            'process': record.process,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc_info'] = record.exc_text
+        for key, value in record.__dict__.items():
+            if key not in self.reserved:
+                entry[key] = value
+        return json.dumps(entry, default=str)
 
 
 class CustomConsoleFormatter(logging.Formatter):
@@ -249,17 +468,25 @@ class CustomConsoleFormatter(logging.Formatter):
             result (str): Formatted string according to log level.
         """
 
-        # Replace the original message with one customized by logging level
+        # Call the original formatter class to do the grunt work, the
+        # record is shared with the other handlers so it is not modified.
+        result = super(CustomConsoleFormatter, self).format(record)
+
+        # Customize the message by logging level
         if record.levelno == logging.DEBUG:
-            record.msg = self.debug_fmt.format(record.msg)
+            result = self.debug_fmt.format(result)
         elif record.levelno == logging.INFO:
-            record.msg = self.info_fmt.format(record.msg)
+            result = self.info_fmt.format(result)
         elif record.levelno == logging.ERROR:
-            record.msg = self.error_fmt.format(record.msg)
+            result = self.error_fmt.format(result)
         elif record.levelno == logging.WARN:
-            record.msg = self.warn_fmt.format(record.msg)
-
-        # Call the original formatter class to do the grunt work
-        result = super(CustomConsoleFormatter, self).format(record)
+            result = self.warn_fmt.format(result)
 
         return result
+
+
+@atexit.register
+def _stop_logging():
+    # Write the records still queued when the process exits.
+    if _active['logger'] is not None:
+        _active['logger'].stop()
@@ -3,11 +3,12 @@ import logging
 
 from .constants import WELCOME_TEXT
 from .api import run_server
+from .bench import bench, bench_compare
+from .executor import bench_tasks
+from .nodes import node
+from .reconcile import rebuild_state_command
 from .logger import OrigamiLogger
 
-logger = OrigamiLogger(
-    file_log_level=logging.DEBUG, console_log_level=logging.DEBUG)
-
 
 @click.group(invoke_without_command=True)
 @click.pass_context
@@ -18,6 +19,16 @@ def main(ctx):
     """
     if not ctx.invoked_subcommand:
         click.echo(WELCOME_TEXT)
+        return
+    # The log file is only written by the commands, importing the module
+    # does not create it in the working directory.
+    OrigamiLogger(
+        file_log_level=logging.DEBUG, console_log_level=logging.DEBUG)
 
 
 main.add_command(run_server)
+main.add_command(node)
+main.add_command(bench_tasks)
+main.add_command(bench)
+main.add_command(bench_compare)
+main.add_command(rebuild_state_command)
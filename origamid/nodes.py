@@ -0,0 +1,133 @@
+import click
+import logging
+
+from .constants import DEFAULT_NODE_NAME, DEFAULT_CELERY_QUEUE
+from .database import Nodes, bootstrap_db
+from .exceptions import InvalidDemoBundleException
+from .utils.resources import parse_cpus, parse_memory
+
+# Node used when no node has been registered, it points to the local docker
+# engine and the default celery queue.
+LOCAL_NODE = Nodes(
+    name=DEFAULT_NODE_NAME, base_url=None, queue=DEFAULT_CELERY_QUEUE)
+
+
+def get_nodes(active_only=True):
+    """
+    Returns the registered nodes, or the local node if no node is
+    registered.
+
+    Args:
+        active_only (bool): Only return nodes which are not disabled.
+
+    Returns:
+        nodes (list): List of `Nodes`.
+    """
+    query = Nodes.select().order_by(Nodes.name)
+    if active_only:
+        query = query.where(Nodes.status == 'active')
+    nodes = list(query)
+    if not nodes and not Nodes.select().exists():
+        nodes = [LOCAL_NODE]
+    return nodes
+
+
+def get_node(name):
+    """
+    Returns the node with the provided name.
+
+    The local node is returned for the default node name as long as it has
+    not been registered explicitly, this keeps demos deployed before any
+    node was registered working.
+
+    Args:
+        name (str): Name of the node.
+
+    Returns:
+        node (Nodes, None): The node or None if no such node is registered.
+    """
+    node = Nodes.get_or_none(Nodes.name == name)
+    if node is None and (not name or name == DEFAULT_NODE_NAME):
+        node = LOCAL_NODE
+    return node
+
+
+@click.group()
+def node():
+    """
+    Manage the docker engines demos are deployed on.
+    """
+    bootstrap_db()
+
+
+@node.command('add')
+@click.argument('name')
+@click.argument('base_url')
+@click.option('--queue', default=None, help='Celery queue of the node worker')
+@click.option('--cpus', default=None, help='CPUs available to demos')
+@click.option('--memory', default=None, help='Memory available to demos')
+def add_node(name, base_url, queue, cpus, memory):
+    """
+    Register a docker engine reachable at BASE_URL as node NAME.
+
+    Each node should have a celery worker running next to it which consumes
+    the node queue, by default the queue has the same name as the node.
+
+    The capacity available to demos defaults to the CPUs and memory reported
+    by the docker engine, use `--cpus` and `--memory` (for example 48g) to
+    keep some of it for the host.
+
+    .. code-block:: bash
+
+        $ origamid node add gpu-1 tcp://10.0.0.2:2375
+        $ celery -A origamid worker -Q gpu-1 -l info
+    """
+    queue = queue or name
+    try:
+        cpus = parse_cpus(cpus) if cpus else None
+        memory = parse_memory(memory) if memory else None
+    except InvalidDemoBundleException as e:
+        raise click.BadParameter(str(e))
+
+    node, created = Nodes.get_or_create(
+        name=name,
+        defaults={
+            'base_url': base_url,
+            'queue': queue,
+            'cpus': cpus,
+            'memory': memory
+        })
+    if not created:
+        node.base_url = base_url
+        node.queue = queue
+        node.cpus = cpus
+        node.memory = memory
+        node.status = 'active'
+        node.save()
+    logging.info('Node {} registered at {} with queue {}'.format(
+        name, base_url, queue))
+
+
+@node.command('remove')
+@click.argument('name')
+def remove_node(name):
+    """
+    Disable the node NAME, demos running on it are kept but no new demos
+    are placed on it.
+    """
+    updated = Nodes.update(status='disabled').where(
+        Nodes.name == name).execute()
+    if not updated:
+        logging.warn('No node registered with name {}'.format(name))
+    else:
+        logging.info('Node {} disabled'.format(name))
+
+
+@node.command('list')
+def list_nodes():
+    """
+    List the registered nodes.
+    """
+    for n in get_nodes(active_only=False):
+        click.echo('{}\t{}\t{}\t{}'.format(n.name, n.base_url or 'local',
+                                           n.queue, n.status))
@@ -0,0 +1,213 @@
+import datetime
+import logging
+import uuid
+
+from contextlib import contextmanager
+
+from .database import Operations
+from .tracing import get_current_span
+
+OPERATION_DEPLOY = 'deploy'
+OPERATION_REMOVE = 'remove'
+
+
+def create_operation(kind, demo_id, node=None, queue=None, enqueued_at=None,
+                     resources=None, replicas=None):
+    """
+    Record an operation on a demo which is about to be enqueued, it is
+    linked to the current trace. The resources of a deploy are reserved on
+    its node until it is finished, see `placement.get_allocated_resources`.
+
+    Args:
+        kind (str): Either deploy or remove.
+        demo_id (str): ID of the demo the operation is for.
+        node (str, None): Name of the node the operation runs on.
+        queue (str, None): Celery queue the operation is sent to.
+        enqueued_at (datetime, None): When the operation was enqueued, now by
+            default.
+        resources (dict, None): Resources requested by a deploy.
+        replicas (int, None): Number of replicas requested by a deploy.
+
+    Returns:
+        operation (Operations): The pending operation.
+    """
+    current = get_current_span()
+    resources = resources or {}
+    return Operations.create(
+        operation_id=uuid.uuid4().hex,
+        kind=kind,
+        demo_id=demo_id,
+        node=node,
+        queue=queue,
+        enqueued_at=enqueued_at or datetime.datetime.now(),
+        trace_id=current.trace_id if current else None,
+        cpu_request=resources.get('cpu_request'),
+        memory_request=resources.get('memory_request'),
+        replicas=replicas)
+
+
+class OperationTracker(object):
+    """
+    Updates the record of an operation while a task runs it. All the methods
+    are no-ops for a task which was not sent with an operation ID.
+    """
+
+    def __init__(self, operation_id=None):
+        self.operation = None
+        self.error = None
+        if operation_id:
+            self.operation = Operations.get_or_none(
+                Operations.operation_id == operation_id)
+            if self.operation is None:
+                logging.warn(
+                    'Operation {} does not exist'.format(operation_id))
+
+    def _save(self, **fields):
+        if self.operation is None:
+            return
+        for key, value in fields.items():
+            setattr(self.operation, key, value)
+        self.operation.save()
+
+    def start(self):
+        self._save(status='running', stage='started',
+                   started_at=datetime.datetime.now())
+
+    def stage(self, stage):
+        """
+        Record the stage the operation is in, for example building.
+        """
+        logging.info('Operation stage : {}'.format(stage))
+        self._save(stage=stage)
+
+    def fail(self, message):
+        """
+        Mark the operation as failed, it is finished by `track_operation`.
+        """
+        self.error = message
+
+    def finish(self):
+        self._save(
+            status='failed' if self.error else 'succeeded',
+            stage='done',
+            message=self.error,
+            finished_at=datetime.datetime.now())
+
+
+@contextmanager
+def track_operation(operation_id=None):
+    """
+    Track the operation run by a task, the operation is running inside the
+    block and finished when the block exits. An exception raised in the
+    block fails the operation and is raised again.
+
+    .. code-block:: python
+
+        with track_operation(operation_id) as operation:
+            operation.stage('building')
+            ...
+
+    Args:
+        operation_id (str, None): ID of the operation sent with the task.
+    """
+    tracker = OperationTracker(operation_id)
+    tracker.start()
+    try:
+        yield tracker
+    except Exception as e:
+        tracker.fail('{}'.format(e) or e.__class__.__name__)
+        raise
+    finally:
+        tracker.finish()
+
+
+def _percentile(values, percent):
+    """
+    Nearest rank percentile of a sorted list of values.
+    """
+    if not values:
+        return None
+    rank = max(0, int(round(percent / 100.0 * len(values))) - 1)
+    return values[min(rank, len(values) - 1)]
+
+
+def summarize(values, percents=(50, 95)):
+    """
+    Returns the count, mean, percentiles, the median and 95th percentile by
+    default, and maximum of values.
+    """
+    values = sorted(values)
+    summary = {
+        'count': len(values),
+        'mean': sum(values) / len(values) if values else None,
+        'max': values[-1] if values else None,
+    }
+    for percent in percents:
+        summary['p{}'.format(percent)] = _percentile(values, percent)
+    return summary
+
+
+def get_operation_stats(kind=None, window=3600):
+    """
+    Returns statistics of the operations enqueued in the last `window`
+    seconds.
+
+    * queue_latency: Seconds operations waited in the queue before a worker
+        started them.
+    * duration: Seconds workers spent running the finished operations.
+    * throughput: Operations finished per minute over the window.
+
+    Args:
+        kind (str, None): Only account operations of this kind.
+        window (int): Window in seconds, the throughput is 0 for an empty
+            window.
+
+    Returns:
+        stats (dict): Operation counts by status and the statistics above.
+    """
+    since = datetime.datetime.now() - datetime.timedelta(seconds=window)
+    query = Operations.select().where(Operations.enqueued_at >= since)
+    if kind:
+        query = query.where(Operations.kind == kind)
+
+    counts = dict((s, 0)
+                  for s in ('pending', 'running', 'succeeded', 'failed'))
+    latencies, durations = [], []
+    for operation in query:
+        counts[operation.status] = counts.get(operation.status, 0) + 1
+        if operation.started_at:
+            latency = operation.started_at - operation.enqueued_at
+            latencies.append(latency.total_seconds())
+        if operation.started_at and operation.finished_at:
+            duration = operation.finished_at - operation.started_at
+            durations.append(duration.total_seconds())
+
+    finished = counts['succeeded'] + counts['failed']
+    return {
+        'kind': kind,
+        'window': window,
+        'counts': counts,
+        'queue_latency': summarize(latencies),
+        'duration': summarize(durations),
+        'throughput': finished / (window / 60.0) if window > 0 else 0.0,
+    }
+
+
+def operation_to_dict(operation):
+    def isoformat(value):
+        return value.isoformat() if value else None
+
+    return {
+        'operation_id': operation.operation_id,
+        'kind': operation.kind,
+        'demo_id': operation.demo_id,
+        'node': operation.node,
+        'queue': operation.queue,
+        'status': operation.status,
+        'stage': operation.stage,
+        'message': operation.message,
+        'enqueued_at': isoformat(operation.enqueued_at),
+        'started_at': isoformat(operation.started_at),
+        'finished_at': isoformat(operation.finished_at),
+        'trace_id': operation.trace_id,
+    }
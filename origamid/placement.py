@@ -0,0 +1,312 @@
+import logging
+
+from concurrent.futures import ThreadPoolExecutor
+
+from .constants import PLACEMENT_LEAST_LOADED, PLACEMENT_FREE_MEMORY, \
+    PLACEMENT_BIN_PACK, DEFAULT_PLACEMENT_POLICY, \
+    DEMO_DEFAULT_CPU_RESERVATION, DEMO_DEFAULT_MEMORY_RESERVATION
+from .database import Demos, Operations
+from .exceptions import OrigamiDockerConnectionError, OrigamiCapacityException
+from .nodes import get_nodes, get_node
+from .operations import OPERATION_DEPLOY
+from .resilience import call_docker
+
+
+class NodeCapacity(object):
+    """
+    Capacity of a node and the part of it which is allocated to demos.
+
+    Attributes:
+        node: The node, an instance of `Nodes`.
+        info: Output of docker info for the node.
+        cpus: CPUs of the node available to demos.
+        memory: Memory in bytes of the node available to demos.
+        allocated_cpus: CPUs reserved by the demos on the node.
+        allocated_memory: Memory in bytes reserved by the demos on the node.
+    """
+
+    def __init__(self, node, info, allocated):
+        self.node = node
+        self.info = info
+        self.cpus = node.cpus or info.get('NCPU', 0)
+        self.memory = node.memory or info.get('MemTotal', 0)
+        self.allocated_cpus, self.allocated_memory = allocated
+
+    @property
+    def free_cpus(self):
+        return self.cpus - self.allocated_cpus
+
+    @property
+    def free_memory(self):
+        return self.memory - self.allocated_memory
+
+    def fits(self, demand):
+        """
+        Returns True if the (cpus, memory) demand fits in the free capacity.
+        """
+        cpus, memory = demand
+        return cpus <= self.free_cpus and memory <= self.free_memory
+
+    def to_dict(self):
+        return {
+            'node': self.node.name,
+            'cpus': self.cpus,
+            'memory': self.memory,
+            'allocated_cpus': self.allocated_cpus,
+            'allocated_memory': self.allocated_memory,
+        }
+
+
+def get_node_info(node):
+    """
+    Returns the docker engine information for the node, or None if the
+    docker engine of the node cannot be reached.
+
+    Args:
+        node (Nodes): Node to get the information of.
+
+    Returns:
+        info (dict, None): Output of docker info for the node.
+    """
+    try:
+        return call_docker(node, 'info', lambda c: c.info())
+    except Exception as e:
+        logging.warn('Docker engine of node {} is not reachable : {}'.format(
+            node.name, e))
+        return None
+
+
+def get_demand(resources, replicas):
+    """
+    Returns the (cpus, memory) reserved by a demo with the provided
+    resources and replica count. Demos which do not declare a request
+    reserve DEMO_DEFAULT_CPU_RESERVATION and DEMO_DEFAULT_MEMORY_RESERVATION
+    per replica.
+
+    Args:
+        resources (dict, Demos): Resources with the cpu_request and
+            memory_request keys or a demo.
+        replicas (int): Number of replicas of the demo.
+
+    Returns:
+        demand (tuple): CPUs and memory in bytes.
+    """
+    if isinstance(resources, Demos):
+        resources = {
+            'cpu_request': resources.cpu_request,
+            'memory_request': resources.memory_request
+        }
+    resources = resources or {}
+    cpus = resources.get('cpu_request') or DEMO_DEFAULT_CPU_RESERVATION
+    memory = resources.get('memory_request') or DEMO_DEFAULT_MEMORY_RESERVATION
+    return cpus * (replicas or 1), memory * (replicas or 1)
+
+
+def get_allocated_resources(exclude_demo_id=None):
+    """
+    Returns the resources reserved by the demos on each of the nodes. Demos
+    which have containers are accounted, as well as the deploys which are
+    pending or running on a node, a deploy reserves its resources from the
+    moment it is placed so that concurrent placements do not overcommit a
+    node. A demo which is redeployed is accounted for both its current
+    containers and its deploy, both run until the switch.
+
+    Args:
+        exclude_demo_id (str, None): Demo to leave out, used when the demo is
+            going to be redeployed.
+
+    Returns:
+        allocated (dict): (cpus, memory) tuples keyed by node name.
+    """
+    demos = {demo.demo_id: demo for demo in Demos.select()}
+    reservations = [(demo.demo_id, demo.node, get_demand(demo, demo.replicas))
+                    for demo in demos.values() if demo.container_id]
+
+    deploys = Operations.select().where(
+        Operations.kind == OPERATION_DEPLOY,
+        Operations.status << ('pending', 'running'),
+        Operations.node.is_null(False))
+    for deploy in deploys:
+        demo = demos.get(deploy.demo_id)
+        resources = {
+            'cpu_request': deploy.cpu_request,
+            'memory_request': deploy.memory_request
+        }
+        replicas = deploy.replicas or (demo.replicas if demo else 1)
+        reservations.append(
+            (deploy.demo_id, deploy.node, get_demand(resources, replicas)))
+
+    allocated = {}
+    for demo_id, node, (cpus, memory) in reservations:
+        if demo_id == exclude_demo_id:
+            continue
+        node_cpus, node_memory = allocated.get(node, (0, 0))
+        allocated[node] = (node_cpus + cpus, node_memory + memory)
+    return allocated
+
+
+def get_node_capacities(nodes=None, exclude_demo_id=None):
+    """
+    Returns the capacity of each of the nodes whose docker engine can be
+    reached, the engines are queried in parallel.
+
+    Args:
+        nodes (list, None): Nodes to get the capacity of, all the active nodes
+            are considered if not provided.
+        exclude_demo_id (str, None): Demo whose reservation is not counted.
+
+    Returns:
+        capacities (list): `NodeCapacity` of the reachable nodes.
+    """
+    if nodes is None:
+        nodes = get_nodes()
+    if not nodes:
+        return []
+
+    with ThreadPoolExecutor(max_workers=len(nodes)) as executor:
+        infos = list(executor.map(get_node_info, nodes))
+
+    allocated = get_allocated_resources(exclude_demo_id)
+    return [
+        NodeCapacity(node, info, allocated.get(node.name, (0, 0)))
+        for node, info in zip(nodes, infos) if info is not None
+    ]
+
+
+def _least_loaded(candidates, demand):
+    """
+    The node with the least number of running containers.
+    """
+    return min(candidates, key=lambda c: c.info.get('ContainersRunning', 0))
+
+
+def _free_memory(candidates, demand):
+    """
+    The node with the most memory which is not reserved by demos.
+    """
+    return max(candidates, key=lambda c: c.free_memory)
+
+
+def _bin_pack(candidates, demand):
+    """
+    Best fit bin packing, the node which is left with the least free
+    capacity after placing the demo. This keeps large nodes free for large
+    demos.
+    """
+    cpus, memory = demand
+
+    def remaining(capacity):
+        free_cpus = (capacity.free_cpus - cpus) / float(capacity.cpus or 1)
+        free_memory = (capacity.free_memory - memory) / float(
+            capacity.memory or 1)
+        return free_cpus + free_memory
+
+    return min(candidates, key=remaining)
+
+
+PLACEMENT_POLICIES = {
+    PLACEMENT_LEAST_LOADED: _least_loaded,
+    PLACEMENT_FREE_MEMORY: _free_memory,
+    PLACEMENT_BIN_PACK: _bin_pack,
+}
+
+
+def choose_node(policy=DEFAULT_PLACEMENT_POLICY,
+                nodes=None,
+                resources=None,
+                replicas=1,
+                exclude_demo_id=None):
+    """
+    Choose the node to deploy a demo on using the provided placement
+    policy, it can be one of
+
+    * bin_pack: The node with the least free capacity which fits the demo.
+    * least_loaded: The node running the least number of containers.
+    * free_memory: The node with the most memory not reserved by demos.
+
+    Only nodes with enough free CPUs and memory for the requests of all the
+    replicas of the demo are considered. Nodes whose docker engine cannot be
+    reached are skipped.
+
+    Args:
+        policy (str): Placement policy to use.
+        nodes (list, None): Nodes to choose from, all the active nodes are
+            considered if not provided.
+        resources (dict, None): Resources requested by the demo.
+        replicas (int): Number of replicas of the demo.
+        exclude_demo_id (str, None): Demo whose current reservation is not
+            counted, this is the demo being placed if it is redeployed.
+
+    Returns:
+        node (Nodes): The chosen node.
+
+    Raises:
+        OrigamiDockerConnectionError: None of the nodes can be reached.
+        OrigamiCapacityException: None of the nodes has enough free capacity.
+    """
+    capacities = get_node_capacities(nodes, exclude_demo_id)
+    if not capacities:
+        raise OrigamiDockerConnectionError(
+            'Docker engine of none of the nodes can be reached')
+
+    demand = get_demand(resources, replicas)
+    candidates = [c for c in capacities if c.fits(demand)]
+    if not candidates:
+        raise OrigamiCapacityException(
+            'No node has {:.2f} CPUs and {} MiB of memory free'.format(
+                demand[0], demand[1] // (1024 * 1024)))
+
+    node = PLACEMENT_POLICIES.get(policy, _bin_pack)(candidates, demand).node
+    logging.info('Placing demo on node {} using {} policy'.format(
+        node.name, policy))
+    return node
+
+
+def place_demo(demo_id,
+               node_name=None,
+               policy=DEFAULT_PLACEMENT_POLICY,
+               resources=None,
+               replicas=None):
+    """
+    Returns the node a demo should be deployed on. A demo which is already
+    deployed stays on its node as long as the node is active and has enough
+    capacity, this keeps the image build cache of the demo warm.
+
+    Args:
+        demo_id (str): ID of the demo.
+        node_name (str, None): Name of the node requested for the demo.
+        policy (str): Placement policy used to choose a new node.
+        resources (dict, None): Resources requested by the demo.
+        replicas (int, None): Number of replicas of the demo, the current
+            replica count of the demo is used if not provided.
+
+    Returns:
+        node (Nodes): Node to deploy the demo on.
+
+    Raises:
+        OrigamiDockerConnectionError: The requested node is not registered or
+            none of the nodes can be reached.
+        OrigamiCapacityException: No node has enough free capacity.
+    """
+    demo = Demos.get_or_none(Demos.demo_id == demo_id)
+    if not replicas:
+        replicas = demo.replicas if demo else 1
+
+    nodes = None
+    if node_name:
+        node = get_node(node_name)
+        if node is None:
+            raise OrigamiDockerConnectionError(
+                'Node {} is not registered'.format(node_name))
+        nodes = [node]
+    elif demo and demo.node:
+        node = get_node(demo.node)
+        if node and node.status == 'active':
+            try:
+                return choose_node(policy, [node], resources, replicas,
+                                   demo_id)
+            except (OrigamiDockerConnectionError, OrigamiCapacityException):
+                logging.warn('Demo {} cannot stay on node {}'.format(
+                    demo_id, node.name))
+
+    return choose_node(policy, nodes, resources, replicas, demo_id)
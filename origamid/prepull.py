@@ -0,0 +1,198 @@
+import datetime
+import logging
+import os
+import threading
+import time
+import zipfile
+
+from concurrent.futures import ThreadPoolExecutor
+from docker.errors import APIError, NotFound
+from docker.utils import parse_repository_tag
+
+from .constants import DOCKERFILE_FILE, PREPULL_CONCURRENCY, \
+    PREPULL_WAIT_TIMEOUT, PREPULL_POLL_INTERVAL
+from .database import ImagePulls
+from .exceptions import OrigamiDockerConnectionError
+from .resilience import call_docker
+from .utils.dockerfile import get_base_images
+
+# Statuses of a pull after which the node has the image.
+PULL_HITS = ('pulled', 'present')
+
+
+def normalize_image(image):
+    """
+    Returns the reference of an image with its tag, latest by default.
+    """
+    repository, tag = parse_repository_tag(image)
+    if not tag:
+        return '{}:latest'.format(repository)
+    return image
+
+
+def get_dockerfile_images(path):
+    """
+    Returns the base images of the Dockerfile of a bundle zip or of a demo
+    directory.
+
+    Args:
+        path (str): Path of the bundle zip or of the demo directory.
+
+    Returns:
+        images (list): Normalized image references.
+    """
+    try:
+        if os.path.isdir(path):
+            with open(os.path.join(path, DOCKERFILE_FILE), 'r') as fp:
+                contents = fp.read()
+        else:
+            with zipfile.ZipFile(path) as bundle:
+                contents = bundle.read(DOCKERFILE_FILE).decode('utf-8')
+    except (IOError, OSError, KeyError, UnicodeDecodeError,
+            zipfile.BadZipfile):
+        return []
+    return [normalize_image(image) for image in get_base_images(contents)]
+
+
+def _get_last_pull(node_name, image):
+    return ImagePulls.select().where(ImagePulls.node == node_name).where(
+        ImagePulls.image == image).order_by(ImagePulls.id.desc()).first()
+
+
+def pull_image(node, image):
+    """
+    Pull an image on a node unless the node already has it. A pull of the
+    same image on the same node already in progress, possibly in another
+    process, is not started again.
+
+    Args:
+        node (Nodes): Node to pull the image on.
+        image (str): Normalized reference of the image.
+
+    Returns:
+        pull (ImagePulls): The pull.
+    """
+    last = _get_last_pull(node.name, image)
+    expiry = datetime.timedelta(seconds=PREPULL_WAIT_TIMEOUT)
+    if last and last.status == 'pulling' and \
+            last.requested_at > datetime.datetime.now() - expiry:
+        return last
+
+    pull = ImagePulls.create(node=node.name, image=image)
+    repository, tag = parse_repository_tag(image)
+    try:
+        try:
+            call_docker(node, 'inspect', lambda c: c.api.inspect_image(image))
+            pull.status = 'present'
+        except NotFound:
+            logging.info('Pulling base image {} on node {}'.format(
+                image, node.name))
+            output = call_docker(
+                node, 'pull', lambda c: c.api.pull(
+                    repository, tag=tag, stream=True, decode=True))
+            for entry in output:
+                if 'error' in entry:
+                    raise APIError(entry['error'])
+            pull.status = 'pulled'
+    except (APIError, OrigamiDockerConnectionError) as e:
+        logging.warn('Cannot pull base image {} on node {} : {}'.format(
+            image, node.name, e))
+        pull.status = 'failed'
+        pull.error = '{}'.format(e)
+    pull.finished_at = datetime.datetime.now()
+    pull.save()
+    return pull
+
+
+class ImagePuller(object):
+    """
+    Pulls the base images of the demos in the background in the API server,
+    so the layers are on the node by the time the demo is built. Requests
+    to pull an image which is being pulled on the same node are ignored.
+    """
+
+    def __init__(self, workers=PREPULL_CONCURRENCY):
+        self.workers = workers
+        self._executor = None
+        self._pulls = {}
+        self._lock = threading.Lock()
+
+    def prefetch(self, node, images):
+        """
+        Start pulling images on a node.
+
+        Args:
+            node (Nodes): Node to pull the images on.
+            images (list): Normalized references of the images.
+
+        Returns:
+            futures (list): Futures of the pulls which were started.
+        """
+        futures = []
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.workers)
+            for image in images:
+                key = (node.name, image)
+                future = self._pulls.get(key)
+                if future is not None and not future.done():
+                    continue
+                future = self._executor.submit(pull_image, node, image)
+                self._pulls[key] = future
+                futures.append(future)
+        return futures
+
+
+image_puller = ImagePuller()
+
+
+def wait_for_base_images(node, images, timeout=PREPULL_WAIT_TIMEOUT):
+    """
+    Wait for the pulls in progress of the base images of a demo before it is
+    built and account whether each image was pre-pulled.
+
+    Args:
+        node (Nodes): Node the demo is built on.
+        images (list): Normalized references of the base images.
+        timeout (float): Seconds to wait for the pulls of all the images.
+
+    Returns:
+        outcomes (dict): True for the images the node has, False for the
+            ones the build pulls itself, keyed by image.
+    """
+    deadline = time.time() + timeout
+    outcomes = {}
+    for image in images:
+        started = time.time()
+        pull = _get_last_pull(node.name, image)
+        while pull is not None and pull.status == 'pulling' and \
+                time.time() < deadline:
+            time.sleep(PREPULL_POLL_INTERVAL)
+            pull = ImagePulls.get_by_id(pull.id)
+
+        if pull is None:
+            pull = ImagePulls.create(
+                node=node.name, image=image, status='missed',
+                finished_at=datetime.datetime.now())
+        waited = time.time() - started
+        ImagePulls.update(
+            builds=ImagePulls.builds + 1,
+            wait=ImagePulls.wait + waited).where(
+                ImagePulls.id == pull.id).execute()
+        outcomes[image] = pull.status in PULL_HITS
+        logging.info('Base image {} {} after {:.2f}s'.format(
+            image, 'pre-pulled' if outcomes[image] else 'not pre-pulled',
+            waited))
+    return outcomes
+
+
+def get_prepull_stats():
+    """
+    Returns the number of builds whose base images were pre-pulled (hits)
+    or not (misses) and the total time builds waited for pulls.
+    """
+    stats = {'hits': 0, 'misses': 0, 'wait': 0.0}
+    for pull in ImagePulls.select().where(ImagePulls.builds > 0):
+        stats['hits' if pull.status in PULL_HITS else 'misses'] += pull.builds
+        stats['wait'] += pull.wait
+    return stats
@@ -0,0 +1,131 @@
+import math
+import threading
+import time
+
+from collections import OrderedDict
+
+from .constants import RATE_LIMIT_RATE, RATE_LIMIT_BURST, \
+    RATE_LIMIT_EXPENSIVE_RATE, RATE_LIMIT_EXPENSIVE_BURST, \
+    RATE_LIMIT_MAX_BUCKETS, RATE_LIMIT_MAX_UPLOADS
+
+# Routes which trigger builds or removals of containers, they share the low
+# budget of RATE_LIMIT_EXPENSIVE_RATE requests per second.
+EXPENSIVE_ROUTES = (
+    '/deploy_trigger/<demo_id>',
+    '/deploy_trigger/<demo_id>/delta',
+    '/demo/remove/<demo_id>',
+    '/bulk/deploy',
+    '/bulk/remove',
+)
+# Routes which are never limited, the monitoring of the daemon must keep
+# working while a client is limited.
+EXEMPT_ROUTES = ('/health', '/metrics')
+
+
+class RateLimiter(object):
+    """
+    Token buckets of the clients of the API server, kept in memory.
+
+    Each client has a bucket per route, holding at most `burst` tokens and
+    refilled with `rate` tokens per second. A request takes a token, it is
+    refused when the bucket is empty, with the number of seconds after which
+    a token is available again. The expensive routes have their own, lower,
+    budget. At most `max_buckets` buckets are kept, the least recently used
+    ones are dropped first, a dropped bucket is full the next time it is
+    used.
+
+    The limiter also caps the number of chunks of bundle uploads a client
+    sends at the same time to `max_uploads`, see `uploads.py`.
+
+    Attributes:
+        limited: Number of requests refused, by route.
+        enabled: Whether requests are limited at all.
+    """
+
+    def __init__(self, rate=RATE_LIMIT_RATE, burst=RATE_LIMIT_BURST,
+                 expensive_rate=RATE_LIMIT_EXPENSIVE_RATE,
+                 expensive_burst=RATE_LIMIT_EXPENSIVE_BURST,
+                 max_buckets=RATE_LIMIT_MAX_BUCKETS,
+                 max_uploads=RATE_LIMIT_MAX_UPLOADS):
+        self.budgets = {
+            False: (float(rate), float(burst)),
+            True: (float(expensive_rate), float(expensive_burst))
+        }
+        self.max_buckets = max_buckets
+        self.max_uploads = max_uploads
+        self.enabled = True
+        self.limited = {}
+        self._buckets = OrderedDict()
+        self._uploads = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, client, route):
+        """
+        Takes a token from the bucket of the client for a route.
+
+        Args:
+            client (str): Address of the client.
+            route (str): Rule of the route, for example /demo/port/<demo_id>
+
+        Returns:
+            retry_after (float): 0 if the request is allowed, the number of
+                seconds until a token is available otherwise.
+        """
+        if not self.enabled or route in EXEMPT_ROUTES:
+            return 0
+        rate, burst = self.budgets[route in EXPENSIVE_ROUTES]
+        key = (client, route)
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            retry_after = 0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                retry_after = (1 - tokens) / rate
+                self.limited[route] = self.limited.get(route, 0) + 1
+            # Reinsert to mark the bucket as most recently used.
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+        return retry_after
+
+    def enter_upload(self, client):
+        """
+        Registers a chunk upload of a client, returns False if the client
+        already sends `max_uploads` chunks.
+        """
+        with self._lock:
+            count = self._uploads.get(client, 0)
+            if self.enabled and count >= self.max_uploads:
+                self.limited['/uploads'] = self.limited.get('/uploads', 0) + 1
+                return False
+            self._uploads[client] = count + 1
+        return True
+
+    def exit_upload(self, client):
+        """
+        Unregisters a chunk upload registered with `enter_upload`.
+        """
+        with self._lock:
+            count = self._uploads.pop(client, 0) - 1
+            if count > 0:
+                self._uploads[client] = count
+
+    def reset(self):
+        with self._lock:
+            self._buckets.clear()
+            self._uploads.clear()
+            self.limited = {}
+
+
+def get_retry_after(seconds):
+    """
+    Returns the value of the Retry-After header of a limited request, a
+    whole number of seconds.
+    """
+    return max(1, int(math.ceil(seconds)))
+
+
+rate_limiter = RateLimiter()
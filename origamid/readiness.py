@@ -0,0 +1,241 @@
+import logging
+import os
+import socket
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from docker.errors import NotFound, APIError
+
+from .constants import DEMO_READINESS_TIMEOUT, \
+    DEMO_READINESS_INITIAL_BACKOFF, DEMO_READINESS_MAX_BACKOFF, \
+    DEMO_READINESS_PROBE_TCP, DEMO_READINESS_PROBE_HTTP, ORIGAMI_ENV_FILE, \
+    ORIGAMI_ENV_READINESS_PROBE, ORIGAMI_ENV_READINESS_PATH, \
+    ORIGAMI_ENV_READINESS_TIMEOUT
+from .exceptions import InvalidDemoBundleException
+from .utils.resources import read_origami_env_file
+
+try:
+    from http.client import HTTPConnection, HTTPException
+    from urllib.parse import urlparse
+except ImportError:
+    from httplib import HTTPConnection, HTTPException
+    from urlparse import urlparse
+
+
+class ReadinessProbe(object):
+    """
+    How the readiness of the containers of a demo is checked.
+
+    Attributes:
+        kind: Either tcp or http.
+        path: Path requested by the http probe, any response below 500
+            counts as ready.
+        timeout: Seconds the containers are given to become ready.
+    """
+
+    def __init__(self,
+                 kind=DEMO_READINESS_PROBE_TCP,
+                 path='/',
+                 timeout=DEMO_READINESS_TIMEOUT):
+        self.kind = kind
+        self.path = path
+        self.timeout = timeout
+
+    def check(self, host, port):
+        """
+        Run the probe once against host:port.
+
+        Returns:
+            (bool): True if the demo is serving.
+        """
+        if self.kind == DEMO_READINESS_PROBE_HTTP:
+            return check_http(host, port, self.path)
+        return check_tcp(host, port)
+
+
+def get_readiness_probe(demo_dir):
+    """
+    Returns the readiness probe of a demo, by default the port of the demo
+    is checked for TCP connections. Demos can configure the probe in the
+    origami environment file of the bundle.
+
+    .. code-block:: bash
+
+        ORIGAMI_READINESS_PROBE=http
+        ORIGAMI_READINESS_PATH=/health
+        ORIGAMI_READINESS_TIMEOUT=300
+
+    Args:
+        demo_dir (str): Path to the extracted demo directory.
+
+    Returns:
+        probe (ReadinessProbe): The readiness probe.
+
+    Raises:
+        InvalidDemoBundleException: The probe configuration is not valid.
+    """
+    env = read_origami_env_file(os.path.join(demo_dir, ORIGAMI_ENV_FILE))
+    kind = env.get(ORIGAMI_ENV_READINESS_PROBE, DEMO_READINESS_PROBE_TCP)
+    if kind not in (DEMO_READINESS_PROBE_TCP, DEMO_READINESS_PROBE_HTTP):
+        raise InvalidDemoBundleException(
+            'Readiness probe {} is not valid'.format(kind))
+
+    path = env.get(ORIGAMI_ENV_READINESS_PATH, '/')
+    if not path.startswith('/'):
+        raise InvalidDemoBundleException(
+            'Readiness path {} is not valid'.format(path))
+
+    try:
+        timeout = float(
+            env.get(ORIGAMI_ENV_READINESS_TIMEOUT, DEMO_READINESS_TIMEOUT))
+    except ValueError:
+        timeout = 0
+    if timeout <= 0:
+        raise InvalidDemoBundleException('Readiness timeout {} is not valid'.
+                                         format(timeout))
+
+    return ReadinessProbe(kind, path, timeout)
+
+
+def get_node_host(node):
+    """
+    Returns the host the published ports of the containers of a node can
+    be reached on.
+
+    Args:
+        node (Nodes): Node running the containers.
+
+    Returns:
+        host (str): Hostname or IP address of the node.
+    """
+    if node.base_url:
+        url = urlparse(node.base_url)
+        if url.scheme in ('tcp', 'http', 'https') and url.hostname:
+            return url.hostname
+    return '127.0.0.1'
+
+
+def check_tcp(host, port, timeout=1.0):
+    """
+    Check if a demo accepts connections on host:port.
+
+    The docker proxy accepts connections on a published port even when the
+    demo is not listening yet and closes them right away, so a connection
+    which is closed before the timeout is not counted as ready. A demo which
+    is listening waits for the request instead.
+
+    Args:
+        host (str): Host the port is published on.
+        port (int): Published port of the demo.
+        timeout (float): Seconds to wait for the connection.
+
+    Returns:
+        (bool): True if the demo is serving on the port.
+    """
+    try:
+        sock = socket.create_connection((host, port), timeout=timeout)
+    except (socket.error, socket.timeout):
+        return False
+    try:
+        sock.settimeout(timeout / 4.0)
+        return sock.recv(1) != b''
+    except socket.timeout:
+        return True
+    except socket.error:
+        return False
+    finally:
+        sock.close()
+
+
+def check_http(host, port, path='/', timeout=2.0):
+    """
+    Check if a demo answers HTTP requests on host:port.
+
+    Args:
+        host (str): Host the port is published on.
+        port (int): Published port of the demo.
+        path (str): Path to request.
+        timeout (float): Seconds to wait for the response.
+
+    Returns:
+        (bool): True if the demo responded with a status below 500.
+    """
+    connection = HTTPConnection(host, port, timeout=timeout)
+    try:
+        connection.request('GET', path)
+        return connection.getresponse().status < 500
+    except (socket.error, socket.timeout, HTTPException):
+        return False
+    finally:
+        connection.close()
+
+
+def _is_alive(container):
+    """
+    Returns False if the container has exited or has been removed.
+    """
+    try:
+        container.reload()
+    except NotFound:
+        return False
+    except APIError:
+        return True
+    return container.status not in ('exited', 'dead', 'removing')
+
+
+def wait_for_port(host, port, probe=None, container=None):
+    """
+    Wait until the demo published on host:port is serving. The probe is
+    retried with an exponential backoff until it succeeds, the probe
+    timeout is reached or the container of the demo dies.
+
+    Args:
+        host (str): Host the port is published on.
+        port (int): Published port of the demo.
+        probe (ReadinessProbe, None): Probe to run, TCP by default.
+        container (Container, None): Container publishing the port.
+
+    Returns:
+        (bool): True if the demo became ready before the timeout.
+    """
+    probe = probe or ReadinessProbe()
+    deadline = time.time() + probe.timeout
+    backoff = DEMO_READINESS_INITIAL_BACKOFF
+    while True:
+        if probe.check(host, port):
+            return True
+        if container is not None and not _is_alive(container):
+            logging.warn('Container {} on port {} died before becoming '
+                         'ready'.format(container.id, port))
+            return False
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            break
+        time.sleep(min(backoff, remaining))
+        backoff = min(backoff * 2, DEMO_READINESS_MAX_BACKOFF)
+
+    logging.warn('Demo on {}:{} not ready after {} seconds'.format(
+        host, port, probe.timeout))
+    return False
+
+
+def wait_until_ready(host, ports, probe=None, containers=None):
+    """
+    Wait until the demos published on all the ports are serving, the ports
+    are probed in parallel.
+
+    Args:
+        host (str): Host the ports are published on.
+        ports (list): Published ports of the replicas of a demo.
+        probe (ReadinessProbe, None): Probe to run, TCP by default.
+        containers (list, None): Container publishing each of the ports.
+
+    Returns:
+        (bool): True if all the replicas became ready before the timeout.
+    """
+    containers = containers or [None] * len(ports)
+    with ThreadPoolExecutor(max_workers=len(ports)) as executor:
+        ready = list(
+            executor.map(lambda p, c: wait_for_port(host, p, probe, c), ports,
+                         containers))
+    return all(ready)
@@ -0,0 +1,436 @@
+import click
+import datetime
+import json
+import logging
+import uuid
+
+from docker.errors import APIError
+from peewee import IntegrityError, prefetch
+
+from .constants import ORIGAMI_LABEL_DEMO_ID, ORIGAMI_LABEL_LOG_ID, \
+    ORIGAMI_LABEL_BUNDLE_DIGEST, ORIGAMI_LABEL_GENERATION, \
+    ORIGAMI_LABEL_REPLICA, ORIGAMI_LABEL_REPLICAS, ORIGAMI_LABEL_PORT, \
+    ORIGAMI_LABEL_RESOURCES, ORIGAMI_ENV_RESOURCE_KEYS, RECONCILE_STALE_AFTER
+from .database import db, Demos, DemoInstances, Logs, Operations
+from .exceptions import OrigamiDockerConnectionError
+from .images import record_demo_image
+from .nodes import get_node, get_nodes
+from .resilience import call_docker
+
+# Statuses which are kept while the container is up, the container status
+# would otherwise overwrite the result of the readiness probe.
+DEMO_PROBED_STATUSES = ('starting', 'ready', 'deploying', 'redeploying')
+
+# Statuses of a demo while it is deployed, the demo is only reconciled
+# once no operation on it is in progress anymore.
+DEMO_DEPLOY_STATUSES = ('deploying', 'redeploying', 'starting')
+
+
+def get_demo_status(current, container_status):
+    """
+    Returns the status of a demo or instance given the status of its
+    container, a probed status is kept as long as the container is running.
+    """
+    if container_status == 'running' and current in DEMO_PROBED_STATUSES:
+        return current
+    return container_status
+
+
+def get_demo_labels(demo, digest=None):
+    """
+    Returns the labels of the images of a demo.
+
+    Args:
+        demo (Demos): The demo.
+        digest (str, None): Digest of the manifest of the bundle of the
+            demo, see `manifest.get_manifest_digest`.
+    """
+    labels = {
+        ORIGAMI_LABEL_DEMO_ID: demo.demo_id,
+        ORIGAMI_LABEL_LOG_ID: demo.log_id
+    }
+    if digest:
+        labels[ORIGAMI_LABEL_BUNDLE_DIGEST] = digest
+    return labels
+
+
+def get_container_labels(demo, generation, replica, port, digest=None):
+    """
+    Returns the labels of a container of a demo, they hold what is needed
+    to rebuild the demo, see `rebuild_node_state`.
+
+    Args:
+        demo (Demos): The demo.
+        generation (str): Generation of the deploy.
+        replica (int): Index of the replica run in the container.
+        port (int): Host port of the container.
+        digest (str, None): Digest of the manifest of the bundle of the
+            demo.
+    """
+    resources = {
+        key: getattr(demo, key)
+        for key in ORIGAMI_ENV_RESOURCE_KEYS if getattr(demo, key) is not None
+    }
+    labels = get_demo_labels(demo, digest)
+    labels.update({
+        ORIGAMI_LABEL_GENERATION: generation,
+        ORIGAMI_LABEL_REPLICA: '{}'.format(replica),
+        ORIGAMI_LABEL_REPLICAS: '{}'.format(demo.replicas),
+        ORIGAMI_LABEL_PORT: '{}'.format(port),
+        ORIGAMI_LABEL_RESOURCES: json.dumps(resources, sort_keys=True)
+    })
+    return labels
+
+
+def _get_label(container, key, default=None):
+    return (container.get('Labels') or {}).get(key, default)
+
+
+def list_demo_containers(node, container_ids=None, demo_id=None):
+    """
+    Returns the containers of the demos on a node, stopped ones included,
+    with a single call to docker.
+
+    Args:
+        node (Nodes): Node to list the containers of.
+        container_ids (list, None): IDs of the containers to list instead of
+            the containers labelled with the ID of their demo, containers
+            run by older versions of origamid are not labelled.
+        demo_id (str, None): Only list the containers of this demo.
+
+    Returns:
+        containers (dict): Containers in the format of the docker API keyed
+            by ID.
+    """
+    if container_ids:
+        filters = {'id': container_ids}
+    elif demo_id:
+        filters = {'label': '{}={}'.format(ORIGAMI_LABEL_DEMO_ID, demo_id)}
+    else:
+        filters = {'label': ORIGAMI_LABEL_DEMO_ID}
+    containers = call_docker(node, 'list', lambda c: c.api.containers(
+        all=True, filters=filters))
+    return {container['Id']: container for container in containers}
+
+
+def find_demo_containers(node, demo_id, container_ids=()):
+    """
+    Returns the containers of a demo, found by their labels. The recorded
+    containers of the demo which are not labelled are looked up by ID with
+    a second call.
+
+    Args:
+        node (Nodes): Node of the demo.
+        demo_id (str): ID of the demo.
+        container_ids (list): IDs of the containers recorded for the demo.
+
+    Returns:
+        containers (dict): Containers in the format of the docker API keyed
+            by ID.
+    """
+    containers = list_demo_containers(node, demo_id=demo_id)
+    missing = [cid for cid in container_ids if cid not in containers]
+    if missing:
+        containers.update(list_demo_containers(node, missing))
+    return containers
+
+
+def get_demo_container_ids(demo, instances):
+    """
+    Returns the IDs of the containers recorded for a demo, the container of
+    the demo first.
+    """
+    container_ids = [i.container_id for i in instances if i.container_id]
+    if demo.container_id and demo.container_id not in container_ids:
+        container_ids.insert(0, demo.container_id)
+    return container_ids
+
+
+def _get_referenced_containers(node):
+    """
+    Returns the IDs of the containers recorded for the demos on a node.
+    """
+    instances = DemoInstances.select(DemoInstances.container_id).join(
+        Demos).where(Demos.node == node.name).tuples()
+    demos = Demos.select(Demos.container_id).where(
+        Demos.node == node.name).tuples()
+    return set(row[0] for row in list(instances) + list(demos) if row[0])
+
+
+def _get_operations_in_progress(now):
+    """
+    Returns the IDs of the demos with an operation in progress and the
+    operations which are pending or running for longer than
+    RECONCILE_STALE_AFTER, their worker died or their task was lost.
+    """
+    stale = now - datetime.timedelta(seconds=RECONCILE_STALE_AFTER)
+    busy, interrupted = set(), []
+    for operation in Operations.select().where(
+            Operations.status.in_(['pending', 'running'])):
+        since = operation.started_at or operation.enqueued_at
+        if since < stale:
+            interrupted.append(operation)
+        else:
+            busy.add(operation.demo_id)
+    return busy, interrupted
+
+
+def _reconcile_demo(demo, instances, containers, report):
+    """
+    Correct the status and containers of a demo given the containers of
+    its node, see `reconcile_node`.
+    """
+    for instance in instances:
+        container = containers.get(instance.container_id)
+        if container is None:
+            instance.delete_instance()
+            report['instances'] += 1
+            continue
+        status = get_demo_status(instance.status, container['State'])
+        if status != instance.status:
+            instance.status = status
+            instance.save(only=[DemoInstances.status])
+
+    status, container_id = demo.status, demo.container_id
+    if status in DEMO_DEPLOY_STATUSES:
+        # The deploy was interrupted before the switch, the demo is served
+        # by its previous containers if it has any.
+        status = 'ready' if status == 'redeploying' and container_id \
+            else 'error'
+        Logs.create(demo=demo, message='Deploy of demo {} was interrupted, '
+                    'found by reconciliation'.format(demo.demo_id))
+    if container_id:
+        container = containers.get(container_id)
+        if container is None:
+            container_id, status = None, 'empty'
+        else:
+            status = get_demo_status(status, container['State'])
+
+    if (status, container_id) != (demo.status, demo.container_id):
+        logging.info('Reconciled demo {} from {} to {}'.format(
+            demo.demo_id, demo.status, status))
+        demo.status = status
+        demo.container_id = container_id
+        demo.save(only=[Demos.status, Demos.container_id])
+        report['demos'].append(demo.demo_id)
+
+
+def reconcile_node(node):
+    """
+    Reconcile the demos of a node with the containers which actually run on
+    it, after a crash, a container removed by hand or a worker which died
+    in the middle of a deploy.
+
+    The containers are listed with one call to docker and compared with the
+    demos of the node read in one transaction, in which all the corrections
+    are written.
+
+    * Instances whose container does not exist anymore are removed and the
+        status of the others follows the status of their container.
+    * A demo whose first container does not exist anymore is empty.
+    * A demo left deploying by an interrupted deploy is back to ready if its
+        previous containers are still there, in error otherwise.
+    * Operations pending or running for more than RECONCILE_STALE_AFTER
+        seconds are failed.
+    * Labelled containers which are not recorded for any demo are orphans,
+        they are returned to be removed.
+
+    Demos with an operation in progress are left alone, the containers of
+    a deploy are only recorded once they are ready.
+
+    Args:
+        node (Nodes): Node to reconcile.
+
+    Returns:
+        report (dict): IDs of the corrected demos, number of removed
+            instances, number of failed operations and IDs of the orphan
+            containers.
+
+    Raises:
+        APIError: Error while communicating to Docker API.
+        OrigamiDockerConnectionError: The docker engine cannot be reached.
+    """
+    containers = list_demo_containers(node)
+    checked = _get_referenced_containers(node)
+    missing = [cid for cid in checked if cid not in containers]
+    if missing:
+        # Only the containers run before they were labelled are listed.
+        containers.update(list_demo_containers(node, missing))
+
+    report = {'demos': [], 'instances': 0, 'operations': 0, 'orphans': []}
+    now = datetime.datetime.now()
+    with db.atomic():
+        busy, interrupted = _get_operations_in_progress(now)
+        for operation in interrupted:
+            operation.status = 'failed'
+            operation.message = 'Interrupted, found by reconciliation'
+            operation.finished_at = now
+            operation.save()
+        report['operations'] = len(interrupted)
+
+        demos = prefetch(
+            Demos.select().where(Demos.node == node.name), DemoInstances)
+        referenced = set()
+        for demo in demos:
+            instances = list(demo.instances)
+            container_ids = get_demo_container_ids(demo, instances)
+            referenced.update(container_ids)
+            # A demo changed since its containers were checked is reconciled
+            # on the next run.
+            changed = any(cid not in checked for cid in container_ids)
+            if demo.demo_id in busy or changed:
+                continue
+            _reconcile_demo(demo, instances, containers, report)
+
+    for container_id, container in containers.items():
+        labels = container.get('Labels') or {}
+        if container_id not in referenced and \
+                labels.get(ORIGAMI_LABEL_DEMO_ID) not in busy:
+            report['orphans'].append(container_id)
+    return report
+
+
+def _get_port(container):
+    port = _get_label(container, ORIGAMI_LABEL_PORT)
+    if port:
+        return int(port)
+    # Ports are only listed for running containers.
+    for binding in container.get('Ports') or []:
+        if binding.get('PublicPort'):
+            return binding['PublicPort']
+    return None
+
+
+def _rebuild_demo(node, demo_id, containers):
+    """
+    Create a demo and its instances from its containers, ordered by replica.
+    """
+    first = containers[0]
+    resources = json.loads(_get_label(first, ORIGAMI_LABEL_RESOURCES, '{}'))
+    demo = Demos.create(
+        demo_id=demo_id,
+        log_id=_get_label(first, ORIGAMI_LABEL_LOG_ID) or uuid.uuid4().hex,
+        container_id=first['Id'],
+        image_id=first.get('ImageID'),
+        port=_get_port(first),
+        status=first['State'],
+        replicas=int(
+            _get_label(first, ORIGAMI_LABEL_REPLICAS, len(containers))),
+        node=node.name,
+        started_at=datetime.datetime.fromtimestamp(first.get('Created', 0)),
+        **resources)
+    for replica, container in enumerate(containers):
+        DemoInstances.create(
+            demo=demo,
+            replica=int(_get_label(container, ORIGAMI_LABEL_REPLICA,
+                                   replica)),
+            container_id=container['Id'],
+            port=_get_port(container),
+            status=container['State'])
+    if demo.image_id:
+        record_demo_image(demo, demo.image_id)
+    return demo
+
+
+def rebuild_node_state(node):
+    """
+    Rebuild the demos of a node from the labels of their containers after
+    the database was lost, with a single call to docker. Only the demos
+    missing from the database are created, each one with the containers of
+    its most recent deploy and their status. The containers of the previous
+    deploys are removed by the next reconciliation, see `reconcile_node`.
+
+    Args:
+        node (Nodes): Node to rebuild the demos of.
+
+    Returns:
+        demo_ids (list): IDs of the rebuilt demos.
+
+    Raises:
+        APIError: Error while communicating to Docker API.
+        OrigamiDockerConnectionError: The docker engine cannot be reached.
+    """
+    deploys = {}
+    for container in list_demo_containers(node).values():
+        demo_id = _get_label(container, ORIGAMI_LABEL_DEMO_ID)
+        generation = _get_label(container, ORIGAMI_LABEL_GENERATION)
+        deploys.setdefault(demo_id, {}).setdefault(generation,
+                                                   []).append(container)
+
+    existing = set(Demos.select(Demos.demo_id).tuples())
+    rebuilt = []
+    with db.atomic():
+        for demo_id, generations in sorted(deploys.items()):
+            if (demo_id, ) in existing:
+                continue
+            containers = max(
+                generations.values(),
+                key=lambda cs: max(c.get('Created', 0) for c in cs))
+            containers.sort(
+                key=lambda c: int(_get_label(c, ORIGAMI_LABEL_REPLICA, 0)))
+            try:
+                with db.atomic():
+                    _rebuild_demo(node, demo_id, containers)
+            except IntegrityError as e:
+                logging.error('Cannot rebuild demo {} : {}'.format(
+                    demo_id, e))
+                continue
+            rebuilt.append(demo_id)
+    logging.info('Rebuilt {} demo(s) of node {}'.format(
+        len(rebuilt), node.name))
+    return rebuilt
+
+
+def rebuild_state(nodes=None):
+    """
+    Rebuild the demos of the nodes, see `rebuild_node_state`. Nodes which
+    cannot be reached are skipped.
+
+    Args:
+        nodes (list, None): Nodes to rebuild, all the active nodes by
+            default.
+
+    Returns:
+        rebuilt (dict): IDs of the rebuilt demos keyed by node name.
+    """
+    rebuilt = {}
+    for node in nodes or get_nodes():
+        try:
+            rebuilt[node.name] = rebuild_node_state(node)
+        except (APIError, OrigamiDockerConnectionError) as e:
+            logging.error('Cannot rebuild the demos of node {} : {}'.format(
+                node.name, e))
+    return rebuilt
+
+
+@click.command('rebuild-state')
+@click.option(
+    '--node',
+    'node_names',
+    multiple=True,
+    help='Node to rebuild the demos of, all the nodes by default')
+def rebuild_state_command(node_names):
+    """Rebuilds the demos from the containers of the nodes.
+
+    The demos missing from the database are created again from the labels
+    of their containers, after origami.db was lost or corrupted. The API
+    server does it on startup when it creates a new database, nodes other
+    than the local one must be registered again first.
+
+    .. code-block:: bash
+
+        $ origamid node add gpu-1 tcp://10.0.0.2:2375
+        $ origamid rebuild-state --node gpu-1
+    """
+    from .database import bootstrap_db
+    bootstrap_db()
+    nodes = []
+    for name in node_names:
+        node = get_node(name)
+        if node is None:
+            raise click.ClickException('Node {} is not registered'.format(
+                name))
+        nodes.append(node)
+    for name, demo_ids in rebuild_state(nodes).items():
+        click.echo('{} : {} demo(s) rebuilt {}'.format(
+            name, len(demo_ids), ', '.join(demo_ids)))
@@ -0,0 +1,291 @@
+import logging
+import os
+import random
+import re
+import threading
+import time
+
+from collections import defaultdict
+from docker.errors import APIError, NotFound
+from requests.exceptions import ConnectionError, Timeout
+
+from .constants import DOCKER_RETRY_ATTEMPTS, DOCKER_RETRY_BASE_DELAY, \
+    DOCKER_RETRY_MAX_DELAY, DOCKER_BREAKER_FAILURE_THRESHOLD, \
+    DOCKER_BREAKER_RESET_TIMEOUT, DOCKER_ENDPOINT_TIMEOUTS, \
+    DOCKER_BREAKER_REPORT_GRACE
+from .docker import get_docker_client
+from .events import publish_event
+from .exceptions import OrigamiDockerConnectionError, \
+    OrigamiDockerUnavailableError
+
+BREAKER_CLOSED = 'closed'
+BREAKER_OPEN = 'open'
+BREAKER_HALF_OPEN = 'half_open'
+
+# Messages of internal server errors of the docker engine which are worth
+# retrying, the engine returns 500 for genuine errors as well.
+TRANSIENT_ERROR_PATTERN = re.compile(
+    r'timeout|timed out|try again|temporarily|too many|resource busy|'
+    r'connection reset|i/o', re.I)
+
+
+def is_transient_error(error):
+    """
+    Classify an error of a docker call, transient errors are retried and
+    count as failures of the docker engine for its circuit breaker.
+
+    * Connection errors and timeouts are transient.
+    * 429, 502, 503 and 504 responses are transient, 500 responses only if
+        their message looks like an overload.
+    * Every other error, for example a missing container, a name conflict or
+        an invalid request, is a genuine error of the call.
+
+    Args:
+        error (Exception): Error raised by the call.
+
+    Returns:
+        (bool): True if the error is transient.
+    """
+    if isinstance(error, (ConnectionError, Timeout)):
+        return True
+    if isinstance(error, NotFound) or not isinstance(error, APIError):
+        return False
+    status = error.status_code
+    if status in (429, 502, 503, 504):
+        return True
+    return status == 500 and bool(
+        TRANSIENT_ERROR_PATTERN.search('{}'.format(error.explanation or '')))
+
+
+class CircuitBreaker(object):
+    """
+    Circuit breaker of the docker engine of a node.
+
+    The breaker is closed while the engine is healthy. After
+    `failure_threshold` consecutive transient failures it opens and calls
+    are refused without reaching the engine. Once `reset_timeout` seconds
+    passed it is half open, a single call is let through to probe the
+    engine and closes the breaker if it succeeds or opens it again.
+
+    State changes are published as breaker events so the API server can
+    report the breakers of the celery workers.
+    """
+
+    def __init__(self,
+                 name,
+                 failure_threshold=DOCKER_BREAKER_FAILURE_THRESHOLD,
+                 reset_timeout=DOCKER_BREAKER_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._state = BREAKER_CLOSED
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self._state == BREAKER_OPEN and \
+                time.time() - self.opened_at >= self.reset_timeout:
+            return BREAKER_HALF_OPEN
+        return self._state
+
+    def _set_state(self, state):
+        logging.warn('Circuit breaker of node {} is now {}'.format(
+            self.name, state))
+        self._state = state
+        publish_event('breaker', **self.to_dict())
+
+    def allow(self):
+        """
+        Returns True if a call may be made, a half open breaker lets one
+        probe call through at a time.
+        """
+        with self._lock:
+            state = self.state
+            if state == BREAKER_CLOSED:
+                return True
+            if state == BREAKER_HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._probing = False
+            if self._state != BREAKER_CLOSED:
+                self._set_state(BREAKER_CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            probing, self._probing = self._probing, False
+            if probing or self.failures >= self.failure_threshold:
+                # A breaker opened again is published with its new retry time.
+                self.opened_at = time.time()
+                self._set_state(BREAKER_OPEN)
+
+    def to_dict(self):
+        retry_at = None
+        if self._state == BREAKER_OPEN:
+            retry_at = self.opened_at + self.reset_timeout
+        return {
+            'node': self.name,
+            'state': self.state,
+            'failures': self.failures,
+            'retry_at': retry_at,
+            'pid': os.getpid(),
+        }
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+# Counters of the docker calls made by this process, keyed by
+# (node, endpoint, outcome) and (node, endpoint).
+call_counts = defaultdict(int)
+retry_counts = defaultdict(int)
+
+
+def get_breaker(node):
+    """
+    Returns the circuit breaker of the docker engine of the node.
+    """
+    with _breakers_lock:
+        breaker = _breakers.get(node.name)
+        if breaker is None:
+            breaker = _breakers[node.name] = CircuitBreaker(node.name)
+    return breaker
+
+
+def get_breakers():
+    """
+    Returns the circuit breakers of this process keyed by node name.
+    """
+    with _breakers_lock:
+        return dict(_breakers)
+
+
+def _backoff(attempt):
+    """
+    Full jitter exponential backoff, a random delay up to the exponential
+    delay of the attempt so retrying workers do not hit the engine in sync.
+    """
+    delay = min(DOCKER_RETRY_MAX_DELAY, DOCKER_RETRY_BASE_DELAY * 2**attempt)
+    return random.uniform(0, delay)
+
+
+def call_docker(node, endpoint, call, retry=True):
+    """
+    Make a call to the docker engine of a node through its circuit breaker.
+
+    The call receives a client whose requests time out after the timeout of
+    the endpoint in DOCKER_ENDPOINT_TIMEOUTS. Transient errors, see
+    `is_transient_error`, are retried up to DOCKER_RETRY_ATTEMPTS times with
+    a jittered exponential backoff unless retry is False, which must be used
+    for calls which are not idempotent like starting a container.
+
+    .. code-block:: python
+
+        container = call_docker(node, 'inspect',
+                                lambda c: c.containers.get(container_id))
+
+    Args:
+        node (Nodes): Node whose docker engine is called.
+        endpoint (str): Kind of call, a key of DOCKER_ENDPOINT_TIMEOUTS.
+        call (callable): Called with the `docker.DockerClient` of the node.
+        retry (bool): Retry the call on transient errors.
+
+    Returns:
+        The return value of the call.
+
+    Raises:
+        OrigamiDockerUnavailableError: The circuit breaker of the node is open.
+        OrigamiDockerConnectionError: The engine could not be reached.
+        APIError: The call failed with a genuine error.
+    """
+    breaker = get_breaker(node)
+    client = get_docker_client(node, DOCKER_ENDPOINT_TIMEOUTS.get(endpoint))
+    attempts = DOCKER_RETRY_ATTEMPTS if retry else 1
+    for attempt in range(attempts):
+        if not breaker.allow():
+            call_counts[(node.name, endpoint, 'rejected')] += 1
+            raise OrigamiDockerUnavailableError(
+                'Docker engine of node {} is unavailable, retry after {} '
+                'seconds'.format(node.name, breaker.reset_timeout))
+        try:
+            result = call(client)
+        except Exception as e:
+            if not is_transient_error(e):
+                # The engine answered, it is healthy.
+                breaker.record_success()
+                call_counts[(node.name, endpoint, 'error')] += 1
+                raise
+            breaker.record_failure()
+            call_counts[(node.name, endpoint, 'transient_error')] += 1
+            if attempt + 1 == attempts:
+                if isinstance(e, APIError):
+                    raise
+                raise OrigamiDockerConnectionError(
+                    'Docker engine of node {} not reachable : {}'.format(
+                        node.name, e))
+            delay = _backoff(attempt)
+            retry_counts[(node.name, endpoint)] += 1
+            logging.warn('Docker {} call on node {} failed : {}, retrying in '
+                         '{:.2f} seconds'.format(endpoint, node.name, e,
+                                                 delay))
+            time.sleep(delay)
+        else:
+            breaker.record_success()
+            call_counts[(node.name, endpoint, 'success')] += 1
+            return result
+
+
+# Order used to report the worst state of the breakers of a node.
+BREAKER_SEVERITY = {BREAKER_CLOSED: 0, BREAKER_HALF_OPEN: 1, BREAKER_OPEN: 2}
+
+
+def get_breaker_states(reported=()):
+    """
+    Returns the state of the docker engine circuit breakers of each node.
+
+    The breakers of this process are merged with the ones reported by the
+    celery workers through breaker events, the worst state wins. A reported
+    open breaker whose retry time passed is half open until the worker
+    reports it again, or closed once DOCKER_BREAKER_REPORT_GRACE seconds
+    passed without a new report.
+
+    Args:
+        reported (iterable): Last breaker event of each worker and node.
+
+    Returns:
+        states (list): State, consecutive failures and retry time of the
+            breakers of each node, ordered by node name.
+    """
+    now = time.time()
+    nodes = {}
+    for breaker in list(get_breakers().values()) + list(reported):
+        if isinstance(breaker, CircuitBreaker):
+            breaker = breaker.to_dict()
+        state = breaker['state']
+        failures = breaker.get('failures', 0)
+        retry_at = breaker.get('retry_at')
+        if state != BREAKER_CLOSED and retry_at and retry_at <= now:
+            state = BREAKER_HALF_OPEN
+            if retry_at + DOCKER_BREAKER_REPORT_GRACE <= now:
+                # The worker did not probe the engine since, it is gone.
+                state, failures = BREAKER_CLOSED, 0
+
+        node = nodes.setdefault(breaker['node'], {
+            'node': breaker['node'],
+            'state': BREAKER_CLOSED,
+            'failures': 0,
+            'retry_at': None,
+        })
+        node['failures'] = max(node['failures'], failures)
+        if BREAKER_SEVERITY[state] > BREAKER_SEVERITY[node['state']]:
+            node['state'] = state
+            node['retry_at'] = retry_at if state == BREAKER_OPEN else None
+    return [nodes[name] for name in sorted(nodes)]
@@ -0,0 +1,301 @@
+import gzip
+import logging
+import logging.handlers
+import os
+import re
+import shutil
+import threading
+import time
+
+from collections import defaultdict
+
+from .constants import LOG_MAX_BYTES, LOG_ROTATE_INTERVAL, \
+    LOG_BACKUP_COUNT, LOG_FILE_MODE, DEPLOY_LOG_ATTEMPTS, \
+    DEPLOY_LOGS_DISK_CAP, LOG_SWEEP_INTERVAL, LOG_SWEEP_BATCH, \
+    ORIGAMI_DEPLOY_LOGS_DIR
+from .utils.file import get_origami_static_dir
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+# Name of a rotated log file, the name of the log followed by the time it
+# was rotated at and the .gz extension once it is compressed.
+ROTATED_LOG_PATTERN = re.compile(
+    r'^(?P<name>.+)\.(?P<stamp>\d{8}-\d{6}-\d{3})(?P<gz>\.gz)?$')
+
+
+def _rotation_stamp():
+    now = time.time()
+    return '{}-{:03d}'.format(
+        time.strftime('%Y%m%d-%H%M%S', time.localtime(now)),
+        int(now * 1000) % 1000)
+
+
+def compress_file(path):
+    """
+    Replace a file with its gzip compressed copy, the copy is written next
+    to the file first so a crash never leaves a truncated archive behind.
+
+    Args:
+        path (str): Path of the file.
+
+    Returns:
+        path (str): Path of the compressed file.
+    """
+    compressed = '{}.gz'.format(path)
+    partial = '{}.tmp'.format(compressed)
+    with open(path, 'rb') as src:
+        with gzip.open(partial, 'wb') as dst:
+            shutil.copyfileobj(src, dst, 64 * 1024)
+    os.rename(partial, compressed)
+    os.remove(path)
+    return compressed
+
+
+def get_rotated_logs(directory):
+    """
+    Returns the rotated log files in a directory grouped by log name.
+
+    Args:
+        directory (str): Directory of the logs.
+
+    Returns:
+        rotated (dict): Lists of (stamp, path, compressed) tuples, oldest
+            first, keyed by log name.
+    """
+    rotated = defaultdict(list)
+    for filename in os.listdir(directory):
+        match = ROTATED_LOG_PATTERN.match(filename)
+        if match:
+            rotated[match.group('name')].append(
+                (match.group('stamp'), os.path.join(directory, filename),
+                 bool(match.group('gz'))))
+    for files in rotated.values():
+        files.sort()
+    return rotated
+
+
+def prune_rotated_logs(path, keep):
+    """
+    Remove the rotated files of a log beyond the `keep` most recent ones.
+
+    Args:
+        path (str): Path of the log.
+        keep (int): Number of rotated files to keep.
+
+    Returns:
+        removed (int): Number of removed files.
+    """
+    directory, name = os.path.split(path)
+    files = get_rotated_logs(directory).get(name, [])
+    expired = files[:-keep] if keep else files
+    for _, rotated, _ in expired:
+        os.remove(rotated)
+    return len(expired)
+
+
+class Compressor(object):
+    """
+    Compresses rotated log files one at a time on a background thread, so
+    rotating a log never waits for its compression. The thread is started
+    on the first submitted file of each process.
+    """
+
+    def __init__(self):
+        self.pid = None
+        self.queue = None
+        self._lock = threading.Lock()
+
+    def submit(self, path, callback=None):
+        """
+        Queue a file for compression.
+
+        Args:
+            path (str): Path of the file.
+            callback (callable, None): Called once the file is compressed.
+        """
+        with self._lock:
+            if self.pid != os.getpid():
+                self.pid = os.getpid()
+                self.queue = queue.Queue()
+                thread = threading.Thread(
+                    target=self._run, args=(self.queue, ),
+                    name='log-compressor')
+                thread.daemon = True
+                thread.start()
+        self.queue.put((path, callback))
+
+    def _run(self, files):
+        while True:
+            path, callback = files.get()
+            try:
+                compress_file(path)
+                if callback:
+                    callback()
+            except (IOError, OSError) as e:
+                logging.error('Cannot compress log {} : {}'.format(path, e))
+
+
+compressor = Compressor()
+
+
+class RotatingFileHandler(logging.handlers.BaseRotatingHandler):
+    """
+    File handler which appends to the log and rotates it once it reaches
+    `max_bytes` or is older than `interval` seconds. Rotated files are
+    renamed with the time of the rotation, compressed in the background by
+    the `Compressor` and only the `backup_count` most recent ones are kept.
+    """
+
+    def __init__(self,
+                 filename,
+                 max_bytes=LOG_MAX_BYTES,
+                 interval=LOG_ROTATE_INTERVAL,
+                 backup_count=LOG_BACKUP_COUNT):
+        logging.handlers.BaseRotatingHandler.__init__(self, filename,
+                                                      LOG_FILE_MODE)
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self.backup_count = backup_count
+        self.rollover_at = time.time() + interval
+
+    def shouldRollover(self, record):
+        if time.time() >= self.rollover_at:
+            return True
+        if self.max_bytes <= 0:
+            return False
+        if self.stream is None:
+            self.stream = self._open()
+        position = self.stream.tell()
+        message = '{}\n'.format(self.format(record))
+        return position > 0 and position + len(message) >= self.max_bytes
+
+    def doRollover(self):
+        if self.stream:
+            self.stream.close()
+            self.stream = None
+
+        if os.path.exists(self.baseFilename):
+            rotated = '{}.{}'.format(self.baseFilename, _rotation_stamp())
+            os.rename(self.baseFilename, rotated)
+            compressor.submit(
+                rotated, lambda: prune_rotated_logs(self.baseFilename,
+                                                    self.backup_count))
+
+        self.stream = self._open()
+        self.rollover_at = time.time() + self.interval
+
+
+def get_deploy_logs_dir():
+    """
+    Returns the directory of the build logs of the demos.
+    """
+    return os.path.join(get_origami_static_dir(), ORIGAMI_DEPLOY_LOGS_DIR)
+
+
+def rotate_deploy_log(logfile):
+    """
+    Move the build log of the previous deploy attempt of a demo aside before
+    a new one is written, it is compressed and pruned by
+    `sweep_deploy_logs`.
+
+    Args:
+        logfile (str): Path of the build log of the demo.
+    """
+    if os.path.exists(logfile) and os.path.getsize(logfile):
+        os.rename(logfile, '{}.{}'.format(logfile, _rotation_stamp()))
+
+
+def sweep_deploy_logs(logs_dir=None,
+                      attempts=DEPLOY_LOG_ATTEMPTS,
+                      disk_cap=DEPLOY_LOGS_DISK_CAP,
+                      batch=LOG_SWEEP_BATCH):
+    """
+    Apply the retention policy to the build logs of the demos.
+
+    * Only the `attempts` most recent previous build logs of each demo are
+        kept.
+    * Up to `batch` of the kept logs are compressed, the rest is left for
+        the next sweep so a sweep is always short.
+    * While the logs use more than `disk_cap` bytes the oldest previous
+        build logs of all the demos are removed. The current build log of a
+        demo is never removed.
+
+    Args:
+        logs_dir (str, None): Directory of the build logs, the static deploy
+            logs directory by default.
+        attempts (int): Previous build logs kept per demo.
+        disk_cap (int): Bytes the build logs may use.
+        batch (int): Maximum number of logs compressed.
+
+    Returns:
+        stats (dict): Number of compressed and removed logs and the bytes
+            used by the logs after the sweep.
+    """
+    logs_dir = logs_dir or get_deploy_logs_dir()
+    compressed, removed = 0, 0
+    kept = []
+    for files in get_rotated_logs(logs_dir).values():
+        expired = files[:-attempts] if attempts else files
+        for _, path, _ in expired:
+            os.remove(path)
+            removed += 1
+        kept.extend(files[len(expired):])
+
+    kept.sort()
+    for index, (stamp, path, is_compressed) in enumerate(kept):
+        if is_compressed:
+            continue
+        if compressed >= batch:
+            break
+        kept[index] = (stamp, compress_file(path), True)
+        compressed += 1
+
+    usage = sum(
+        os.path.getsize(os.path.join(logs_dir, f)) for f in os.listdir(logs_dir)
+        if os.path.isfile(os.path.join(logs_dir, f)))
+    for _, path, _ in kept:
+        if usage <= disk_cap:
+            break
+        usage -= os.path.getsize(path)
+        os.remove(path)
+        removed += 1
+    if usage > disk_cap:
+        logging.warn('Current build logs use {} bytes, more than the disk cap '
+                     'of {} bytes'.format(usage, disk_cap))
+
+    return {'compressed': compressed, 'removed': removed, 'bytes': usage}
+
+
+class LogSweeper(object):
+    """
+    Runs `sweep_deploy_logs` every `interval` seconds on a background
+    thread of the API server.
+    """
+
+    def __init__(self, interval=LOG_SWEEP_INTERVAL):
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='log-sweeper')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                stats = sweep_deploy_logs()
+                if stats['compressed'] or stats['removed']:
+                    logging.info('Swept deploy logs : {}'.format(stats))
+            except (IOError, OSError) as e:
+                logging.error('Error while sweeping deploy logs : {}'.format(e))
+
+
+log_sweeper = LogSweeper()
@@ -0,0 +1,346 @@
+import json
+import logging
+
+from collections import deque
+from tornado import gen
+from tornado.ioloop import IOLoop
+from tornado.iostream import StreamClosedError
+from tornado.locks import Event
+from tornado.queues import Queue, QueueFull
+from tornado.web import Application, FallbackHandler, RequestHandler
+from tornado.websocket import WebSocketHandler, WebSocketClosedError
+
+from .constants import EVENTS_CLIENT_QUEUE_SIZE, EVENTS_KEEPALIVE_INTERVAL, \
+    LOGS_STREAM_CLIENT_BUFFER
+from .cache import demo_cache
+from .database import Demos
+from .events import bind_events_socket, read_events
+from .executor import local_executor
+from .uploads import BundleUploadHandler
+
+
+class Subscriber(object):
+    """
+    A client of the event stream and the demos it subscribed to.
+
+    Attributes:
+        demo_ids: Set of demo IDs, None to receive the events of all demos.
+        event_types: Types of the events the client receives.
+        queue: Bounded queue of events waiting to be sent to the client.
+        overflowed: Set when the queue was full, the client is disconnected.
+    """
+    event_types = ('status', )
+
+    def __init__(self, demo_ids=None, queue_size=EVENTS_CLIENT_QUEUE_SIZE):
+        self.demo_ids = set(demo_ids) if demo_ids else None
+        self.queue = Queue(maxsize=queue_size)
+        self.overflowed = False
+
+    def wants(self, event):
+        if event.get('type') not in self.event_types:
+            return False
+        return self.demo_ids is None or event.get('demo_id') in self.demo_ids
+
+    def put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except QueueFull:
+            self.overflowed = True
+
+
+class LogSubscriber(Subscriber):
+    """
+    A viewer of the build log stream of a demo.
+
+    Lines are kept in a bounded buffer, when the viewer cannot keep up the
+    oldest lines are dropped and counted so the viewer is told how many
+    lines it missed. The build is never slowed down by a viewer and the
+    memory used per viewer is bounded.
+
+    Attributes:
+        lines: Buffered lines waiting to be sent to the viewer.
+        dropped: Number of lines dropped since the last send.
+        end: The log_end event once the build output is complete.
+        ready: Event set when there is something to send.
+    """
+    event_types = ('log', 'log_end')
+
+    def __init__(self, demo_id, buffer_size=LOGS_STREAM_CLIENT_BUFFER):
+        super(LogSubscriber, self).__init__([demo_id])
+        self.lines = deque(maxlen=buffer_size)
+        self.next_seq = None
+        self.dropped = 0
+        self.end = None
+        self.ready = Event()
+
+    def put(self, event):
+        if event['type'] == 'log_end':
+            self.end = event
+        else:
+            # Lines lost between the worker and the API server.
+            if self.next_seq is not None and event['seq'] > self.next_seq:
+                self.dropped += event['seq'] - self.next_seq
+            self.next_seq = event['seq'] + len(event['lines'])
+            for line in event['lines']:
+                if len(self.lines) == self.lines.maxlen:
+                    self.dropped += 1
+                self.lines.append(line)
+        self.ready.set()
+
+    def take(self):
+        """
+        Returns the buffered lines coalesced into one message and clears
+        the buffer.
+        """
+        message = {'lines': list(self.lines), 'dropped': self.dropped}
+        self.lines.clear()
+        self.dropped = 0
+        self.ready.clear()
+        return message
+
+
+class EventBroker(object):
+    """
+    Receives the events published by the celery workers on the events
+    socket and dispatches them to the subscribers of the API server.
+
+    Status events only carry the new status of a demo, the broker keeps the
+    last known status of each demo and turns them into transitions with a
+    from and a to status. Events which do not change the status are not
+    dispatched. Every status event invalidates the cached demo.
+
+    The last breaker event of each worker and node is kept to report the
+    circuit breakers of the workers, see `resilience.get_breaker_states`.
+    Job events wake up the local executor, see `executor`.
+    """
+
+    def __init__(self):
+        self.subscribers = set()
+        self.statuses = {}
+        self.breakers = {}
+        self.socket = None
+
+    def start(self, path=None, io_loop=None):
+        """
+        Bind the events socket and start reading it on the IOLoop.
+        """
+        self.statuses = dict(
+            Demos.select(Demos.demo_id, Demos.status).tuples())
+        self.socket = bind_events_socket(path)
+        io_loop = io_loop or IOLoop.current()
+        io_loop.add_handler(self.socket.fileno(), self._on_readable,
+                            IOLoop.READ)
+        logging.info('Event broker listening on {}'.format(
+            self.socket.getsockname()))
+
+    def _on_readable(self, fd, events):
+        for event in read_events(self.socket):
+            self.dispatch(event)
+
+    def dispatch(self, event):
+        """
+        Dispatch one event to the subscribers interested in it.
+        """
+        if event.get('type') == 'breaker':
+            self.breakers[(event.get('node'), event.get('pid'))] = event
+            return
+
+        if event.get('type') == 'job':
+            local_executor.poll()
+            return
+
+        if event.get('type') == 'status':
+            # A status event is published on every save of a demo.
+            demo_cache.invalidate(event.get('demo_id'))
+            previous = self.statuses.get(event.get('demo_id'))
+            if previous == event.get('status'):
+                return
+            self.statuses[event['demo_id']] = event['status']
+            event = {
+                'type': 'status',
+                'demo_id': event['demo_id'],
+                'from': previous,
+                'to': event['status'],
+                'timestamp': event.get('timestamp'),
+            }
+
+        for subscriber in list(self.subscribers):
+            if subscriber.wants(event):
+                subscriber.put(event)
+
+    def subscribe(self, demo_ids=None, subscriber=None):
+        subscriber = subscriber or Subscriber(demo_ids)
+        self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        self.subscribers.discard(subscriber)
+
+    def snapshot(self, demo_ids=None):
+        """
+        Returns the current status of the demos as transitions from None,
+        sent to a client when it subscribes.
+        """
+        statuses = sorted(self.statuses.items())
+        if demo_ids:
+            statuses = [s for s in statuses if s[0] in demo_ids]
+        return [{
+            'type': 'status',
+            'demo_id': demo_id,
+            'from': None,
+            'to': status
+        } for demo_id, status in statuses]
+
+
+broker = EventBroker()
+
+
+class DemoEventsHandler(RequestHandler):
+    """
+    Server-sent events stream of the status transitions of demos.
+
+    The demos to subscribe to are provided with the `demo_id` query
+    parameter which can be repeated, all the demos are subscribed to if it
+    is not provided. The current status of the demos is sent first, then
+    one event per status transition.
+
+    .. code-block:: bash
+
+        $ curl -N 127.0.0.1:9002/demo/events?demo_id=ffc806
+
+        event: status
+        data: {"type": "status", "demo_id": "ffc806", "from": null, \
+            "to": "ready"}
+
+        event: status
+        data: {"type": "status", "demo_id": "ffc806", "from": "ready", \
+            "to": "redeploying", "timestamp": 1531390863.11}
+    """
+
+    def initialize(self, event_broker=None):
+        self.broker = event_broker or broker
+        self.subscriber = None
+
+    @gen.coroutine
+    def get(self):
+        demo_ids = self.get_query_arguments('demo_id')
+        self.set_header('Content-Type', 'text/event-stream')
+        self.set_header('Cache-Control', 'no-cache')
+        self.set_header('X-Accel-Buffering', 'no')
+
+        self.subscriber = self.broker.subscribe(demo_ids)
+        try:
+            for event in self.broker.snapshot(demo_ids):
+                self.write_event(event)
+            yield self.flush()
+
+            while not self.subscriber.overflowed:
+                deadline = IOLoop.current().time() + EVENTS_KEEPALIVE_INTERVAL
+                try:
+                    event = yield self.subscriber.queue.get(timeout=deadline)
+                    self.write_event(event)
+                except gen.TimeoutError:
+                    self.write(': keep-alive\n\n')
+                yield self.flush()
+
+            logging.warn('Event stream client too slow, disconnecting')
+        except StreamClosedError:
+            pass
+        finally:
+            self.broker.unsubscribe(self.subscriber)
+
+    def write_event(self, event):
+        self.write('event: {}\ndata: {}\n\n'.format(event['type'],
+                                                    json.dumps(event)))
+
+    def on_connection_close(self):
+        if self.subscriber:
+            self.broker.unsubscribe(self.subscriber)
+            # Wake up the handler so it notices the closed connection.
+            self.subscriber.put({'type': 'closed'})
+
+
+class DemoLogsStreamHandler(WebSocketHandler):
+    """
+    WebSocket relaying the build output of a demo to a viewer while the
+    demo is built.
+
+    Each message is a JSON object with the lines produced since the last
+    message and the number of lines which were dropped because the viewer
+    could not keep up. Once the build output is complete a last message
+    with `end` set to the status of the build is sent and the socket is
+    closed. The complete log is available at /static/logs/<demo_id>.
+
+    .. code-block:: javascript
+
+        ws = new WebSocket('ws://127.0.0.1:9002/demo/logs/ffc806/stream');
+        ws.onmessage = (e) => console.log(JSON.parse(e.data));
+
+        {"lines": ["Step 1/5 : FROM python:3.6\\n"], "dropped": 0}
+        {"lines": [], "dropped": 0, "end": "succeeded"}
+    """
+
+    def initialize(self, event_broker=None):
+        self.broker = event_broker or broker
+        self.subscriber = None
+
+    def check_origin(self, origin):
+        # Same as the CORS policy of the flask application.
+        return True
+
+    def open(self, demo_id):
+        self.subscriber = self.broker.subscribe(
+            subscriber=LogSubscriber(demo_id))
+        IOLoop.current().spawn_callback(self.relay)
+
+    @gen.coroutine
+    def relay(self):
+        """
+        Send the buffered lines to the viewer, the next message is only sent
+        once the previous one was written to the connection.
+        """
+        subscriber = self.subscriber
+        try:
+            while subscriber in self.broker.subscribers:
+                yield subscriber.ready.wait()
+                message = subscriber.take()
+                end = subscriber.end
+                if end:
+                    message['end'] = end['status']
+                yield self.write_message(json.dumps(message))
+                if end:
+                    self.close()
+                    break
+        except WebSocketClosedError:
+            pass
+        finally:
+            self.broker.unsubscribe(subscriber)
+
+    def on_message(self, message):
+        pass
+
+    def on_close(self):
+        if self.subscriber:
+            self.broker.unsubscribe(self.subscriber)
+            self.subscriber.ready.set()
+
+
+def make_tornado_app(wsgi_container):
+    """
+    Returns the tornado application of the API server, the streaming
+    endpoints are served by tornado and every other request falls back to
+    the flask application.
+
+    Args:
+        wsgi_container (WSGIContainer): The wrapped flask application.
+
+    Returns:
+        app (tornado.web.Application): The tornado application.
+    """
+    return Application([
+        (r'/demo/events', DemoEventsHandler),
+        (r'/demo/logs/([^/]+)/stream', DemoLogsStreamHandler),
+        (r'/uploads', BundleUploadHandler),
+        (r'/uploads/([^/]+)', BundleUploadHandler),
+        (r'.*', FallbackHandler, dict(fallback=wsgi_container)),
+    ])
@@ -1,61 +1,391 @@
 # For python2 to handle imports properly
 from __future__ import absolute_import, unicode_literals
 
+import datetime
 import json
 import logging
 import os
 import re
+import socket
+import time
 import uuid
 
-from docker import APIClient
+from concurrent.futures import ThreadPoolExecutor
 from docker.errors import NotFound, APIError, BuildError
 
-from .celery import app
+from .celery import app, get_task_backend
 from .constants import ORIGAMI_CONFIG_DIR, ORIGAMI_DEMOS_DIRNAME, \
-    ORIGAMI_WRAPPED_DEMO_PORT, DOCKER_UNIX_SOCKET, ORIGAMI_DEPLOY_LOGS_DIR, \
-    LOGS_FILE_MODE_REQ
-from .database import Demos, get_a_free_port
-from .docker import docker_client
-from .exceptions import OrigamiDockerConnectionError
+    ORIGAMI_WRAPPED_DEMO_PORT, ORIGAMI_DEPLOY_LOGS_DIR, \
+    LOGS_FILE_MODE_REQ, DEFAULT_PLACEMENT_POLICY, TASK_BACKEND_LOCAL, \
+    DEFAULT_CELERY_QUEUE, ORIGAMI_BUNDLE_ZIP
+from .database import db, Demos, DemoInstances, BulkJobItems, Logs, \
+    reserve_ports, release_ports, notify_demo_saved
+from .events import BuildLogPublisher
+from .exceptions import OrigamiDockerConnectionError, \
+    OrigamiCapacityException, InvalidDemoBundleException
+from .images import record_demo_image, collect_images
 from .logger import OrigamiLogger
+from .operations import OPERATION_DEPLOY, OPERATION_REMOVE, \
+    create_operation, track_operation
+from .nodes import get_node, get_nodes
+from .placement import choose_node, place_demo
+from .prepull import get_dockerfile_images, wait_for_base_images
+from .resilience import call_docker
+from .retention import rotate_deploy_log
+from .readiness import get_node_host, get_readiness_probe, \
+    wait_until_ready
+from .reconcile import get_demo_status, get_demo_labels, \
+    get_container_labels, get_demo_container_ids, find_demo_containers, \
+    reconcile_node
+from .tracing import span
+from .utils.context import stream_build_context
 from .utils.file import get_origami_static_dir
+from .utils.manifest import get_manifest_digest, load_manifest
+from .utils.resources import get_demo_resources
+from .utils.validation import validate_demo_bundle_zip, \
+    preprocess_demo_bundle_zip
 
 logger = OrigamiLogger(console_log_level=logging.DEBUG)
 logger.disable_file_logging()
 
 
+def get_demo_node(demo):
+    """
+    Returns the node the demo is deployed on.
+
+    Args:
+        demo (Demos): Demo table object.
+
+    Returns:
+        node (Nodes): Node of the demo.
+
+    Raises:
+        OrigamiDockerConnectionError: The node of the demo is not registered.
+    """
+    node = get_node(demo.node)
+    if node is None:
+        raise OrigamiDockerConnectionError(
+            'Node {} of demo {} is not registered'.format(
+                demo.node, demo.demo_id))
+    return node
+
+
 def update_demo_status(demo):
     """
-    Update current demo status by looking up for the demo container
-    using docker.
+    Update current demo status by looking up for the demo containers
+    using docker, they are found with a single call filtered on their
+    labels. The status of each of the demo instances is updated as
+    well, instances whose container does not exist anymore are removed.
+    The ready status set by the readiness probe is kept while the container
+    is running.
 
     Args:
         demo(Demos): Demo table object.
     """
     logging.info('Updating the status of demo : {}'.format(demo.id))
+    node = get_demo_node(demo)
+    instances = list(demo.instances)
     try:
-        if demo.container_id:
-            container = docker_client.containers.get(demo.container_id)
+        containers = find_demo_containers(
+            node, demo.demo_id, get_demo_container_ids(demo, instances))
+    except APIError as e:
+        raise OrigamiDockerConnectionError(
+            'Error while communicating to to docker API: {}'.format(e))
+
+    # The demo may have been redeployed since it was read, its containers
+    # and ports are switched by the deploy task. Only the status is written
+    # and only while the row still refers to the containers looked up.
+    written = 0
+    for instance in instances:
+        current = (DemoInstances.id == instance.id) & \
+            (DemoInstances.container_id == instance.container_id)
+        container = containers.get(instance.container_id)
+        if container is None:
+            logging.info('No container instance found for replica {} of '
+                         'demo : {}'.format(instance.replica, demo.demo_id))
+            written += DemoInstances.delete().where(current).execute()
+            continue
+        status = get_demo_status(instance.status, container['State'])
+        if instance.status != status:
+            instance.status = status
+            written += DemoInstances.update(status=status).where(
+                current).execute()
+
+    if demo.container_id:
+        current = (Demos.id == demo.id) & \
+            (Demos.container_id == demo.container_id)
+        container = containers.get(demo.container_id)
+        if container is None:
+            logging.info(
+                'No container instance found for demo : {} and id : {}'.format(
+                    demo.demo_id, demo.container_id))
+            updated = Demos.update(container_id=None, status='empty').where(
+                current).execute()
+            if updated:
+                demo.container_id = None
+                demo.status = 'empty'
+        else:
+            status = get_demo_status(demo.status, container['State'])
             logging.info('Updated demo status from {} to {}'.format(
-                demo.status, container.status))
-            demo.status = container.status
-            demo.save()
+                demo.status, status))
+            updated = Demos.update(status=status).where(current).execute()
+            if updated:
+                demo.status = status
+        written += updated
+
+    # The update queries bypass `Demos.save`, the cached demo is invalidated
+    # and the status is published the same way.
+    if written:
+        notify_demo_saved(demo)
+
+
+def _replica_name(demo_id, generation, replica):
+    """
+    Returns the container name for a replica of the demo. Every deploy of
+    a demo uses a new generation so that the new containers can run next to
+    the containers they replace.
+    """
+    return '{}-{}-{}'.format(demo_id, generation, replica)
+
+
+def _remove_container(node, container_id):
+    """
+    Stop and remove the container with the provided ID.
 
+    Args:
+        node (Nodes): Node running the container.
+        container_id: ID of the container to remove.
+
+    Returns:
+        (bool): False if no container with the ID exists.
+
+    Raises:
+        APIError: Error while communicating to Docker API.
+        OrigamiDockerConnectionError: The docker engine cannot be reached.
+    """
+    try:
+        container = call_docker(node, 'inspect',
+                                lambda c: c.containers.get(container_id))
     except NotFound:
-        logging.info(
-            'No container instance found for demo : {} and id : {}'.format(
-                demo.demo_id, demo.container_id))
-        demo.container_id = None
-        demo.status = 'empty'
-        demo.save()
+        logging.info('No container found with id : {}'.format(container_id))
+        return False
 
-    except APIError as e:
-        raise OrigamiDockerConnectionError(
-            'Error while communicating to to docker API: {}'.format(e))
+    logging.info('Container instance with id {} found in {} state'.format(
+        container_id, container.status))
+
+    # Try stopping the container first
+    call_docker(node, 'stop', lambda c: c.api.stop(container_id, timeout=10))
+
+    # Check if the container exist after stopping, if it exist
+    # Remove it
+    try:
+        call_docker(node, 'inspect', lambda c: c.containers.get(container_id))
+        call_docker(node, 'remove',
+                    lambda c: c.api.remove_container(container_id))
+    except NotFound:
+        pass
+
+    return True
+
+
+def get_container_resources(demo):
+    """
+    Returns the keyword arguments to enforce the resources of the demo on
+    its containers. Requests are mapped to relative CPU shares, limits to
+    hard CPU quotas and memory limits. A demo which declares only a memory
+    request is limited to it, swap is never allowed beyond the memory limit.
+
+    Args:
+        demo (Demos): Demo table object.
+
+    Returns:
+        kwargs (dict): Keyword arguments for `containers.run`.
+    """
+    kwargs = {}
+    memory = demo.memory_limit or demo.memory_request
+    if memory:
+        kwargs['mem_limit'] = memory
+        kwargs['memswap_limit'] = memory
+    if demo.cpu_request:
+        kwargs['cpu_shares'] = max(2, int(demo.cpu_request * 1024))
+    if demo.cpu_limit:
+        kwargs['nano_cpus'] = int(demo.cpu_limit * 1e9)
+    if demo.cpuset:
+        kwargs['cpuset_cpus'] = demo.cpuset
+    return kwargs
+
+
+def _run_replicas(node, demo, image_id, ports, generation, digest=None):
+    """
+    Start one container per replica of the demo in parallel. The containers
+    are labelled with the demo, see `reconcile.get_container_labels`.
+
+    If any of the replicas fails to start the ones which were started are
+    removed again. Starting a container is not retried, a retried run could
+    start the replica twice.
+
+    Args:
+        node (Nodes): Node to run the demo on.
+        demo (Demos): Demo to start the replicas for.
+        image_id: ID of the image to run.
+        ports (list): Host port for each of the replicas.
+        generation (str): Generation of the deploy, see `_replica_name`.
+        digest (str, None): Digest of the manifest of the bundle.
+
+    Returns:
+        containers (list): Started containers ordered by replica index.
+
+    Raises:
+        APIError: Error while communicating to Docker API.
+        OrigamiDockerConnectionError: The docker engine cannot be reached.
+    """
+    port_map = '{}/tcp'.format(ORIGAMI_WRAPPED_DEMO_PORT)
+    resources = get_container_resources(demo)
+
+    def run(replica):
+        return call_docker(node, 'run', lambda c: c.containers.run(
+            image_id,
+            detach=True,
+            name=_replica_name(demo.demo_id, generation, replica),
+            labels=get_container_labels(demo, generation, replica,
+                                        ports[replica], digest),
+            ports={port_map: ports[replica]},
+            remove=True,
+            **resources), retry=False)
+
+    with ThreadPoolExecutor(max_workers=len(ports)) as executor:
+        futures = [executor.submit(run, r) for r in range(len(ports))]
+
+    containers = []
+    error = None
+    for future in futures:
+        try:
+            containers.append(future.result())
+        except (APIError, OrigamiDockerConnectionError) as e:
+            error = e
+
+    if error:
+        logging.error('Error while starting replicas, removing {} started '
+                      'replicas'.format(len(containers)))
+        _remove_containers(node, [c.id for c in containers])
+        raise error
+
+    return containers
+
+
+def _remove_containers(node, container_ids):
+    """
+    Remove the containers with the provided IDs, errors are logged and do
+    not stop the removal of the other containers.
+
+    Args:
+        node (Nodes): Node running the containers.
+        container_ids (list): IDs of the containers to remove.
+    """
+    for container_id in container_ids:
+        try:
+            _remove_container(node, container_id)
+        except (APIError, OrigamiDockerConnectionError) as e:
+            logging.error('Error while removing container {} : {}'.format(
+                container_id, e))
+
+
+def _build_demo_image(node, demo, dockerfile_dir, digest=None):
+    """
+    Build the image for the demo and write the build logs to the log file
+    of the demo. Each line of the build output is published as it is
+    produced for the viewers of the build log stream. The image is labelled
+    with the demo, see `reconcile.get_demo_labels`.
+
+    Args:
+        node (Nodes): Node to build the image on.
+        demo (Demos): Demo to build the image for.
+        dockerfile_dir: Directory of the demo, the build context is
+            streamed from the bundle kept in it.
+        digest (str, None): Digest of the manifest of the bundle.
+
+    Returns:
+        image_id: SHA256 ID of the built image.
+
+    Raises:
+        BuildError: The image could not be built.
+        InvalidDemoBundleException: The build context cannot be streamed from
+            the bundle.
+        APIError: Error while communicating to Docker API.
+        OrigamiDockerConnectionError: The docker engine cannot be reached.
+    """
+    # Here we are using low level API bindings provided by docker-py to
+    # interact with docker daemon. This enables us to collect image build
+    # Logs and provide them to user for debugging purposes.
+    logging.info('Trying to build image for demo.')
+    response = []
+    build_status = 'failed'
+    publisher = BuildLogPublisher(demo.demo_id)
+    labels = get_demo_labels(demo, digest)
+    bundle = os.path.join(dockerfile_dir, ORIGAMI_BUNDLE_ZIP)
+    if os.path.exists(bundle):
+        # The build context is streamed from the bundle, a new stream is
+        # created for each attempt of the call.
+        def build(client):
+            return client.api.build(
+                fileobj=stream_build_context(bundle),
+                custom_context=True,
+                labels=labels)
+    else:
+        # Demos extracted before the bundle was kept in the demo directory.
+        def build(client):
+            return client.api.build(path=dockerfile_dir, labels=labels)
+
+    try:
+        output = call_docker(node, 'build', build)
+        for line in output:
+            entry = json.loads(line.decode().strip())
+            publisher.add(entry)
+            response.append(entry)
+        if response and 'error' not in response[-1]:
+            build_status = 'succeeded'
+    finally:
+        publisher.close(build_status)
+
+    # Write build logs to log file, the log of the previous attempt is kept
+    # until the retention policy removes it.
+    logfile = os.path.join(get_origami_static_dir(), ORIGAMI_DEPLOY_LOGS_DIR,
+                           demo.log_id)
+    rotate_deploy_log(logfile)
+    with open(logfile, LOGS_FILE_MODE_REQ) as fp:
+        json.dump(response, fp)
+
+    if build_status != 'succeeded':
+        # The daemon reports a failed step as the last entry of the output.
+        reason = response[-1].get('error') if response else \
+            'The build of the image produced no output'
+        raise BuildError(reason, response)
+
+    final_res = response[-1].get('stream', '').strip()
+    match_obj = re.match(r'Successfully built (.*)', final_res, re.M | re.I)
+    image_id = None
+
+    try:
+        match_obj.group(1)
+        # SHA256 of the built image.
+        image_id = response[-2]['aux']['ID'][7:]
+    except IndexError as e:
+        raise BuildError('{}'.format(e), response)
+    except Exception as e:
+        logging.error(
+            "Error while parsing SHA256 ID of the image : {}".format(e))
+        raise BuildError('{}'.format(e), response)
+
+    # This was without using low level dockerpy client, it did not provide
+    # logs for the build process.
+    # image = docker_client.images.build(path=dockerfile_dir)[0]
+
+    logging.info('Image built : ID: {}'.format(image_id))
+    return image_id
 
 
 @app.task()
-def remove_demo_instance_if_exist(demo_id, status='empty'):
+def remove_demo_instance_if_exist(demo_id, status='empty', operation_id=None):
     """
     Checks if an instance is running for the demo provided with ID
     demo_id, if it exist then remove the container and update the database
@@ -66,6 +396,8 @@ def remove_demo_instance_if_exist(demo_id, status='empty'):
     Args:
         demo_id: ID for the demo from origami server
         status: Status to set the demo in after the container is deleted
+        operation_id: ID of the operation created for the removal, see
+            `operations.create_operation`.
 
     Returns:
         demo (None, Demos): A Demos object or None
@@ -74,42 +406,50 @@ def remove_demo_instance_if_exist(demo_id, status='empty'):
         OrigamiDockerConnectionError: Exception when there is an error
             communicating to Docker API.
     """
+    with track_operation(operation_id) as operation:
+        operation.stage('removing')
+        demo = _remove_demo_instances(demo_id, status)
+        if demo is None:
+            operation.fail('No demo instance found for {}'.format(demo_id))
+        return demo
+
+
+def _remove_demo_instances(demo_id, status):
+    """
+    Remove the containers of the demo, see `remove_demo_instance_if_exist`.
+    """
     logging.info('Checking if the demo instance exist')
     demo = Demos.get_or_none(Demos.demo_id == demo_id)
-    if demo and demo.container_id:
-        # If there exist a demo which is not empty then delete the instance
+    if not demo:
+        return None
+
+    instances = list(demo.instances)
+    container_ids = [i.container_id for i in instances if i.container_id]
+    if demo.container_id and demo.container_id not in container_ids:
+        container_ids.insert(0, demo.container_id)
+
+    if container_ids:
+        # If there exist a demo which is not empty then delete the instances
         try:
-            container = docker_client.containers.get(demo.container_id)
-            logging.info('Demo {} is in {} state'.format(
-                demo_id, container.status))
-
-            logging.info('Container instance with id {} found'.format(
-                demo.container_id))
-
-            # Try stopping the container first
-            logging.info('Removing container instance for demo')
-            container.stop(timeout=10)
-
-            # Check if the container exist after stopping, if it exist
-            # Remove it
-            try:
-                container = docker_client.containers.get(demo.container_id)
-                if container:
-                    container.remove()
-            except NotFound:
-                pass
+            logging.info('Removing {} container instance(s) for demo'.format(
+                len(container_ids)))
+            node = get_demo_node(demo)
+            removed = [_remove_container(node, cid) for cid in container_ids]
+            if not any(removed):
+                logging.info(
+                    'No container instance found for demo : {}'.format(demo_id))
+                return None
 
             logging.info('Container instance removed')
-            demo.status = status
-            demo.container_id = None
-            demo.image_id = None
-            demo.save()
+            with db.atomic():
+                DemoInstances.delete().where(
+                    DemoInstances.demo == demo).execute()
+                demo.status = status
+                demo.container_id = None
+                demo.image_id = None
+                demo.save()
 
             return demo
-        except NotFound:
-            logging.info(
-                'No container instance found for demo : {} and id : {}'.format(
-                    demo_id, demo.container_id))
         except APIError as e:
             demo.status = 'error'
             demo.save()
@@ -118,96 +458,466 @@ def remove_demo_instance_if_exist(demo_id, status='empty'):
     return None
 
 
+def _get_bundle_digest(dockerfile_dir):
+    """
+    Returns the digest of the manifest of the bundle of a demo, None for
+    demos extracted before the bundle was kept in the demo directory.
+    """
+    files = load_manifest(dockerfile_dir)
+    return get_manifest_digest(files) if files is not None else None
+
+
 @app.task()
-def deploy_demo(demo_id, demo_dir):
+def deploy_demo(demo_id,
+                demo_dir,
+                replicas=None,
+                node=None,
+                resources=None,
+                operation_id=None):
     """
-    Checks for the existence of demo container and redploy it if it exist
+    Build and deploy the demo with zero downtime for a demo which is
+    already running.
+
+    The old containers keep serving while the new image is built. The new
+    containers are started next to them on new ports and are probed until
+    the readiness probe of the demo, see `readiness.get_readiness_probe`,
+    succeeds for all of them, a new demo is starting meanwhile. The demo is
+    then switched over to the new containers in one transaction and becomes
+    ready, only then the old containers are removed. If anything fails
+    before the switch the new containers are removed and the old ones stay
+    in place, a demo without old containers is in the error status or in
+    the failed status if it did not become ready.
 
     Args:
         demo_id: Demo ID for the demo to be deployed(this is a unique ID from
             origami database)
-        demo_dir: Absolute path to the demo directory where it was unzipped.
+        demo_dir: Absolute path to the demo directory where it was unzipped,
+            the worker reads the bundle from its own ~/.origami which must be
+            shared with the API server.
+        replicas: Number of container instances to run for the demo, if not
+            provided the previous replica count of the demo is kept.
+        node: Name of the node to deploy the demo on, if not provided the
+            demo stays on its previous node or a node is chosen using the
+            default placement policy.
+        resources: Resource requests and limits of the demo as returned by
+            `get_demo_resources`, if not provided the previous resources of
+            the demo are kept.
+        operation_id: ID of the operation created for the deploy, see
+            `operations.create_operation`.
+
+    Returns:
+        error (str, None): Reason the deploy failed, None if the demo was
+            deployed.
     """
-    logging.info('Starting task to deploy demo with id : {}'.format(demo_id))
-    # Before doing anything get the previously created image if any.
-    try:
-        remove_demo_instance_if_exist(demo_id, 'redeploying')
-    except OrigamiDockerConnectionError as e:
-        logging.error(e)
-        return
+    with track_operation(operation_id) as operation, \
+            span('deploy_demo', demo_id=demo_id) as deploy:
+        error = _deploy_demo(demo_id, replicas, node, resources, operation)
+        if error:
+            deploy.error = error
+            operation.fail(error)
+        return error
+
 
+def _deploy_demo(demo_id, replicas, node, resources, operation):
+    """
+    Deploy the demo, see `deploy_demo`. The stages of the deploy are
+    recorded with the operation tracker.
+    """
+    logging.info('Starting task to deploy demo with id : {}'.format(demo_id))
     demo = Demos.get_or_none(Demos.demo_id == demo_id)
-    if not demo:
+    new_demo = demo is None
+    if new_demo:
         demo_logs_uid = uuid.uuid4().hex
-        demo = Demos(demo_id=demo_id, log_id=demo_logs_uid, status='deploying')
+        demo = Demos.create(
+            demo_id=demo_id, log_id=demo_logs_uid, status='deploying')
+
+    # The containers currently serving the demo and where they run, they are
+    # only replaced once the new containers are ready.
+    old_status = demo.status
+    old_node = demo.node
+    old_containers = [i.container_id for i in demo.instances]
+    if demo.container_id and demo.container_id not in old_containers:
+        old_containers.insert(0, demo.container_id)
+
+    # Until the switch only the status of the demo is written, the rest of
+    # its row keeps describing the old containers.
+    demo.status = 'redeploying' if old_containers else 'deploying'
+    demo.save(only=[Demos.status])
+
+    if replicas:
+        demo.replicas = replicas
+    if resources:
+        for key, value in resources.items():
+            setattr(demo, key, value)
+
+    # Ports reserved for the new containers, released on failure.
+    reserved = []
+
+    def fail(message, status='error'):
+        logging.error(message)
+        if reserved:
+            release_ports(reserved)
+        demo.status = old_status if old_containers else status
+        demo.save(only=[Demos.status])
+        Logs.create(demo=demo, message=message)
+        return message
 
-    # Get the dockerfile from the demo dir from ORIGAMI_CONFIG_HOME
+    try:
+        operation.stage('placing')
+        if node:
+            demo.node = node
+        elif new_demo or not get_node(demo.node):
+            demo.node = choose_node(
+                resources=resources,
+                replicas=demo.replicas,
+                exclude_demo_id=demo_id).name
+        demo_node = get_demo_node(demo)
+    except (OrigamiDockerConnectionError, OrigamiCapacityException) as e:
+        return fail('Cannot place demo {} : {}'.format(demo_id, e))
+
+    # Get the dockerfile from the demo dir from ORIGAMI_CONFIG_HOME. The
+    # bundle is extracted by the API server, or by the worker of a bulk
+    # job, the workers of the nodes must share ~/.origami with them.
     dockerfile_dir = os.path.join(os.environ['HOME'], ORIGAMI_CONFIG_DIR,
                                   ORIGAMI_DEMOS_DIRNAME, demo_id)
+    if not os.path.isdir(dockerfile_dir):
+        return fail(
+            'Bundle of demo {} not found in {} on worker host {}, the '
+            'workers must share {} with the API server'.format(
+                demo_id, dockerfile_dir, socket.gethostname(),
+                os.path.dirname(os.path.dirname(dockerfile_dir))))
+
+    operation.stage('building')
     try:
-        # Here we are using low level API bindings provided by docker-py to
-        # interact with docker daemon. This enables us to collect image build
-        # Logs and provide them to user for debugging purposes.
-        logging.info('Trying to build image for demo.')
-        cli = APIClient(base_url=DOCKER_UNIX_SOCKET)
-        response = [
-            json.loads(line.decode().strip())
-            for line in cli.build(path=dockerfile_dir)
-        ]
-
-        # Write build logs to log file.
-        logfile = os.path.join(get_origami_static_dir(),
-                               ORIGAMI_DEPLOY_LOGS_DIR, demo.log_id)
-        with open(logfile, LOGS_FILE_MODE_REQ) as fp:
-            json.dump(response, fp)
-
-        final_res = response[-1]['stream'].strip()
-        match_obj = re.match(r'Successfully built (.*)', final_res, re.M | re.I)
-        image_id = None
+        probe = get_readiness_probe(dockerfile_dir)
+    except InvalidDemoBundleException as e:
+        return fail('Invalid readiness probe for {} : {}'.format(demo_id, e))
 
-        try:
-            match_obj.group(1)
-            # SHA256 of the built image.
-            image_id = response[-2]['aux']['ID'][7:]
-        except IndexError as e:
-            raise BuildError(e)
-        except Exception as e:
-            logging.error(
-                "Error while parsing SHA256 ID of the image : {}".format(e))
-            raise BuildError(e)
-
-        # This was without using low level dockerpy client, it did not provide
-        # logs for the build process.
-        # image = docker_client.images.build(path=dockerfile_dir)[0]
-
-        logging.info('Image built : ID: {}'.format(image_id))
+    containers = []
+    try:
+        with span('pull_wait'):
+            wait_for_base_images(demo_node,
+                                 get_dockerfile_images(dockerfile_dir))
+        digest = _get_bundle_digest(dockerfile_dir)
+        with span('build', node=demo_node.name) as build:
+            image_id = _build_demo_image(demo_node, demo, dockerfile_dir,
+                                         digest)
+            build.set(image_id=image_id)
+
+        # The ports of the old containers are still in use, the new
+        # containers always get new ports. They are reserved until the
+        # switch so that concurrent deploys do not get the same ports.
+        ports = reserve_ports(demo.replicas, demo_id)
+        if ports is None:
+            raise APIError('No free port left to run the demo replicas')
+        reserved.extend(ports)
+        logging.info('Ports for demo replicas are {}'.format(ports))
+
+        operation.stage('starting')
+        generation = uuid.uuid4().hex[:8]
+        started_at = datetime.datetime.now()
+        with span('run', replicas=demo.replicas):
+            containers = _run_replicas(demo_node, demo, image_id, ports,
+                                       generation, digest)
+        logging.info('Demo started with container id(s) : {}'.format(
+            ', '.join(c.id for c in containers)))
+
+    except InvalidDemoBundleException as e:
+        # The manifest or a path of the bundle is not valid, the build
+        # context cannot be streamed.
+        return fail('Invalid bundle for {} : {}'.format(demo_id, e))
+    except BuildError as e:
+        return fail('Error while building image for {} : {}'.format(
+            demo_id, e))
+    except (APIError, OrigamiDockerConnectionError) as e:
+        _remove_containers(demo_node, [c.id for c in containers])
+        return fail('Error while communicating to to docker API: {}'.format(e))
+
+    if not old_containers:
+        demo.status = 'starting'
+        demo.save(only=[Demos.status])
+
+    with span('readiness'):
+        ready = wait_until_ready(
+            get_node_host(demo_node), ports, probe, containers)
+    if not ready:
+        _remove_containers(demo_node, [c.id for c in containers])
+        return fail(
+            'Containers of demo {} did not become ready within {} '
+            'seconds'.format(demo_id, probe.timeout), 'failed')
+    ready_at = datetime.datetime.now()
+    logging.info('Demo {} ready in {:.2f} seconds'.format(
+        demo_id, (ready_at - started_at).total_seconds()))
+
+    # Switch the demo over to the new containers.
+    operation.stage('switching')
+    with span('switch'), db.atomic():
+        DemoInstances.delete().where(DemoInstances.demo == demo).execute()
         demo.image_id = image_id
+        demo.port = ports[0]
+        demo.container_id = containers[0].id
+        demo.status = 'ready'
+        demo.started_at = started_at
+        demo.ready_at = ready_at
+        demo.time_to_ready = (ready_at - started_at).total_seconds()
+        demo.save()
+        for replica, container in enumerate(containers):
+            DemoInstances.create(
+                demo=demo,
+                replica=replica,
+                container_id=container.id,
+                port=ports[replica],
+                status='ready')
+        release_ports(ports)
+        record_demo_image(demo, image_id)
+    logging.info('Demo {} switched to the new containers'.format(demo_id))
+
+    if old_containers:
+        operation.stage('removing_old_containers')
+        old_demo_node = get_node(old_node)
+        if old_demo_node:
+            with span('remove_old', containers=len(old_containers)):
+                _remove_containers(old_demo_node, old_containers)
+        else:
+            logging.error('Cannot remove the old containers, node {} is not '
+                          'registered'.format(old_node))
+
+    # Previous images of the demo are collected by another worker, off the
+    # deploy path.
+    garbage_collect_images.apply_async(
+        args=(demo.node, ), queue=demo_node.queue)
 
-        # Run a new container instance for the demo.
-        if not demo.port:
-            port = get_a_free_port()
-            logging.info('New port for demo is {}'.format(port))
-            demo.port = port
 
-        port_map = '{}/tcp'.format(ORIGAMI_WRAPPED_DEMO_PORT)
-        cont = docker_client.containers.run(
-            image_id,
-            detach=True,
-            name=demo_id,
-            ports={port_map: demo.port},
-            remove=True)
+@app.task()
+def garbage_collect_images(node_name=None):
+    """
+    Remove the images of the demos which are not needed anymore and prune
+    the build cache to keep the disk usage of the node within
+    ORIGAMI_IMAGE_DISK_BUDGET. See `images.collect_images`.
 
-        logging.info('Demo deployed with container id : {}'.format(cont.id))
-        demo.container_id = cont.id
-        demo.status = 'running'
+    Args:
+        node_name: Name of the node to collect the images of, all the nodes
+            are collected if not provided.
 
-    except BuildError as e:
-        logging.error('Error while building image for {} : {}'.format(
-            demo_id, e))
-        demo.status = 'error'
-    except APIError as e:
-        logging.error(
-            'Error while communicating to to docker API: {}'.format(e))
-        demo.status = 'error'
+    Returns:
+        reclaimed (dict): Bytes reclaimed keyed by node name.
+    """
+    nodes = [get_node(node_name)] if node_name else get_nodes()
+    reclaimed = {}
+    for node in nodes:
+        if node is None:
+            continue
+        try:
+            reclaimed[node.name] = collect_images(node).bytes_reclaimed
+        except (APIError, OrigamiDockerConnectionError) as e:
+            logging.error('Error while collecting images on node {} : {}'.
+                          format(node.name, e))
+    return reclaimed
+
+
+@app.task()
+def reconcile_demos(node_name=None):
+    """
+    Reconcile the demos with the containers running on the nodes and remove
+    the orphan containers, see `reconcile.reconcile_node`. The task is run
+    every RECONCILE_INTERVAL seconds by celery beat, or by the API server
+    with the local task backend.
+
+    Args:
+        node_name: Name of the node to reconcile, all the nodes are
+            reconciled if not provided.
+
+    Returns:
+        reports (dict): Reconciliation report keyed by node name.
+    """
+    nodes = [get_node(node_name)] if node_name else get_nodes()
+    reports = {}
+    for node in nodes:
+        if node is None:
+            continue
+        try:
+            report = reconcile_node(node)
+        except (APIError, OrigamiDockerConnectionError) as e:
+            logging.error('Cannot reconcile the demos of node {} : {}'.format(
+                node.name, e))
+            continue
+        if report['orphans']:
+            logging.info('Removing {} orphan container(s) on node {}'.format(
+                len(report['orphans']), node.name))
+            _remove_containers(node, report['orphans'])
+        reports[node.name] = report
+    return reports
+
+
+@app.task()
+def ping(enqueued_at, reply_to):
+    """
+    Report how long the task waited between being enqueued and started to
+    the datagram socket reply_to, used by `origamid bench-tasks` to compare
+    the task backends.
+
+    Args:
+        enqueued_at (float): Timestamp the task was enqueued at.
+        reply_to (str): Path of the socket to report to.
+
+    Returns:
+        latency (float): Seconds the task waited.
+    """
+    latency = time.time() - enqueued_at
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    try:
+        sock.sendto(json.dumps({'latency': latency}).encode('utf-8'), reply_to)
+    finally:
+        sock.close()
+    return latency
+
+
+def _start_bulk_item(item_id):
+    """
+    Mark an item of a bulk job as running.
+
+    Returns:
+        item (BulkJobItems, None): The item, None if it does not exist.
+    """
+    item = BulkJobItems.get_or_none(BulkJobItems.id == item_id)
+    if item is None:
+        logging.error('Bulk job item {} does not exist'.format(item_id))
+        return None
+
+    item.status = 'running'
+    item.timestamp = datetime.datetime.now()
+    item.save()
+    return item
+
+
+def _finish_bulk_item(item, error):
+    """
+    Record the outcome of an item of a bulk job, `error` is the reason the
+    item failed or None.
+    """
+    item.status = 'failed' if error else 'succeeded'
+    item.message = error
+    item.timestamp = datetime.datetime.now()
+    item.save()
+
+
+def _call_bulk_item(item, call):
+    """
+    Returns the return value of `call` and None, or None and the error
+    raised by `call`. Errors are never raised, the next demo in the chain
+    of the job must still run.
+    """
+    try:
+        return call(item), None
+    except Exception as e:
+        logging.exception('Bulk job item {} for demo {} failed'.format(
+            item.id, item.demo_id))
+        return None, '{}'.format(e)
+
+
+def _run_bulk_item(item_id, run):
+    """
+    Run one demo of a bulk job and record its outcome in `BulkJobItems`.
+
+    Args:
+        item_id: ID of the `BulkJobItems` row.
+        run (callable): Called with the item, returns the reason the item
+            failed or None.
+    """
+    item = _start_bulk_item(item_id)
+    if item is None:
+        return
+    error, raised = _call_bulk_item(item, run)
+    _finish_bulk_item(item, error or raised)
+
+
+@app.task(bind=True)
+def bulk_deploy_demo(self, item_id):
+    """
+    Deploy one demo of a bulk deploy job. The bundle is validated and
+    preprocessed here instead of in the API request, then the demo is
+    placed like with /deploy_trigger.
+
+    The deploy itself runs in `bulk_deploy_placed_demo` on the queue of the
+    node the demo is placed on. With celery this task is replaced by it, the
+    next demo of the lane starts once the deploy is done. The local executor
+    runs the tasks of every queue in the API server, the deploy runs here.
+
+    Args:
+        item_id: ID of the `BulkJobItems` row of the demo.
+    """
+
+    def place(item):
+        validate_demo_bundle_zip(item.bundle_path)
+        demo_dir = preprocess_demo_bundle_zip(item.bundle_path, item.demo_id)
+        resources = get_demo_resources(demo_dir)
+        get_readiness_probe(demo_dir)
+        policy = item.placement or DEFAULT_PLACEMENT_POLICY
+        node = place_demo(item.demo_id, item.node, policy, resources,
+                          item.replicas)
+        operation = create_operation(OPERATION_DEPLOY, item.demo_id,
+                                     node.name, node.queue,
+                                     item.job.timestamp, resources,
+                                     item.replicas)
+        return bulk_deploy_placed_demo.si(
+            item.id, demo_dir, node.name, resources,
+            operation.operation_id).set(queue=node.queue)
+
+    item = _start_bulk_item(item_id)
+    if item is None:
+        return
+    deploy, error = _call_bulk_item(item, place)
+    if error:
+        _finish_bulk_item(item, error)
+    elif get_task_backend() == TASK_BACKEND_LOCAL:
+        deploy()
+    else:
+        self.replace(deploy)
+
+
+@app.task()
+def bulk_deploy_placed_demo(item_id, demo_dir, node, resources,
+                            operation_id):
+    """
+    Deploy a demo of a bulk deploy job on the node it was placed on by
+    `bulk_deploy_demo` and record its outcome.
+
+    Args:
+        item_id: ID of the `BulkJobItems` row of the demo.
+        demo_dir: Absolute path to the demo directory where it was unzipped.
+        node: Name of the node the demo is placed on.
+        resources: Resource requests and limits of the demo.
+        operation_id: ID of the operation created for the deploy.
+    """
+    item = BulkJobItems.get_or_none(BulkJobItems.id == item_id)
+    if item is None:
+        logging.error('Bulk job item {} does not exist'.format(item_id))
+        return
+    error, raised = _call_bulk_item(
+        item, lambda item: deploy_demo(item.demo_id, demo_dir, item.replicas,
+                                       node, resources, operation_id))
+    _finish_bulk_item(item, error or raised)
+
+
+@app.task()
+def bulk_remove_demo(item_id):
+    """
+    Remove the containers of one demo of a bulk remove job.
+
+    Args:
+        item_id: ID of the `BulkJobItems` row of the demo.
+    """
 
-    demo.save()
+    def run(item):
+        # The removal runs here on the default queue, it is tracked like the
+        # removals of /demo/remove.
+        demo = Demos.get_or_none(Demos.demo_id == item.demo_id)
+        operation = create_operation(
+            OPERATION_REMOVE, item.demo_id, demo.node if demo else None,
+            DEFAULT_CELERY_QUEUE, item.job.timestamp)
+        if not remove_demo_instance_if_exist(
+                item.demo_id, operation_id=operation.operation_id):
+            logging.info('No demo instance found for {}'.format(item.demo_id))
+        return None
+
+    _run_bulk_item(item_id, run)
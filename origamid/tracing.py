@@ -0,0 +1,272 @@
+import json
+import logging
+import threading
+import time
+import uuid
+
+from contextlib import contextmanager
+
+from celery.signals import task_prerun, task_postrun
+from peewee import fn
+
+from .constants import TRACE_HEADER, TRACE_MAX_SPANS
+from .database import db, Spans
+
+_local = threading.local()
+
+
+class Span(object):
+    """
+    A timed step of a trace, see `span`.
+    """
+
+    def __init__(self, name, trace_id, parent_id=None, attributes=None,
+                 start=None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.attributes = dict(attributes or {})
+        self.start = start or time.time()
+        self.duration = None
+        self.error = None
+
+    def set(self, **attributes):
+        """
+        Add attributes to the span, for example the ID of the built image.
+        """
+        self.attributes.update(attributes)
+
+    def end(self):
+        self.duration = time.time() - self.start
+
+
+def _get_stack():
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+        _local.finished = []
+        _local.remote = None
+    return _local.stack
+
+
+def get_current_span():
+    """
+    Returns the innermost span of the current thread, None outside of a
+    trace.
+    """
+    stack = _get_stack()
+    return stack[-1] if stack else None
+
+
+def get_trace_headers():
+    """
+    Returns the trace context to send along with a task so its spans join
+    the current trace, an empty dict outside of a trace.
+    """
+    current = get_current_span()
+    if current is None:
+        return {}
+    return {
+        TRACE_HEADER: {
+            'trace_id': current.trace_id,
+            'parent_id': current.span_id,
+            'sent_at': time.time()
+        }
+    }
+
+
+def set_remote_context(headers):
+    """
+    Continue the trace of the headers sent with a task, the next root span
+    of the thread joins that trace. A span covering the time the task
+    waited in its queue is recorded.
+
+    Args:
+        headers (dict, None): Headers of the task.
+    """
+    _get_stack()
+    context = (headers or {}).get(TRACE_HEADER)
+    _local.remote = context
+    if context and context.get('sent_at'):
+        queued = Span('queue', context['trace_id'], context['parent_id'],
+                      start=context['sent_at'])
+        queued.end()
+        _local.finished.append(queued)
+
+
+def clear_remote_context():
+    _get_stack()
+    _local.remote = None
+    _flush()
+
+
+@contextmanager
+def span(name, **attributes):
+    """
+    Record a span around the block. The span is a child of the current span
+    of the thread, or of the remote context of the task being run, otherwise
+    it starts a new trace. Spans are written to the database once the root
+    span of the thread ends. An exception raised in the block is recorded on
+    the span and raised again.
+
+    .. code-block:: python
+
+        with span('build', demo_id=demo_id) as build:
+            image_id = ...
+            build.set(image_id=image_id)
+
+    Args:
+        name (str): Name of the step.
+        attributes: Attributes of the span.
+
+    Yields:
+        span (Span): The span.
+    """
+    stack = _get_stack()
+    if stack:
+        trace_id, parent_id = stack[-1].trace_id, stack[-1].span_id
+    elif _local.remote:
+        trace_id = _local.remote['trace_id']
+        parent_id = _local.remote['parent_id']
+    else:
+        trace_id, parent_id = uuid.uuid4().hex, None
+
+    current = Span(name, trace_id, parent_id, attributes)
+    stack.append(current)
+    try:
+        yield current
+    except Exception as e:
+        current.error = '{}'.format(e) or e.__class__.__name__
+        raise
+    finally:
+        current.end()
+        stack.pop()
+        _local.finished.append(current)
+        if not stack:
+            _flush()
+
+
+def _flush():
+    """
+    Write the finished spans of the thread to the database and drop the
+    oldest spans beyond TRACE_MAX_SPANS.
+    """
+    finished, _local.finished = _local.finished, []
+    if not finished:
+        return
+    try:
+        with db.atomic():
+            Spans.insert_many([{
+                'trace_id': s.trace_id,
+                'span_id': s.span_id,
+                'parent_id': s.parent_id,
+                'name': s.name,
+                'start': s.start,
+                'duration': s.duration,
+                'error': s.error,
+                'attributes': json.dumps(s.attributes, default=str)
+            } for s in finished]).execute()
+            last = Spans.select(Spans.id).order_by(Spans.id.desc()).first()
+            Spans.delete().where(
+                Spans.id <= last.id - TRACE_MAX_SPANS).execute()
+    except Exception as e:
+        # Tracing never fails the traced operation.
+        logging.error('Cannot record spans : {}'.format(e))
+
+
+def span_to_dict(record):
+    return {
+        'span_id': record.span_id,
+        'parent_id': record.parent_id,
+        'name': record.name,
+        'start': record.start,
+        'duration': record.duration,
+        'error': record.error,
+        'attributes': json.loads(record.attributes)
+    }
+
+
+def get_trace(trace_id):
+    """
+    Returns the spans of a trace ordered by start time, along with the
+    total duration of the trace and its slowest step.
+
+    Args:
+        trace_id (str): ID of the trace.
+
+    Returns:
+        trace (dict, None): The trace, None if it has no span.
+    """
+    spans = [
+        span_to_dict(s)
+        for s in Spans.select().where(Spans.trace_id == trace_id).order_by(
+            Spans.start)
+    ]
+    if not spans:
+        return None
+    start = min(s['start'] for s in spans)
+    end = max(s['start'] + s['duration'] for s in spans)
+    # The slowest step is the slowest span without children.
+    parents = set(s['parent_id'] for s in spans)
+    leaves = [s for s in spans if s['span_id'] not in parents]
+    slowest = max(leaves, key=lambda s: s['duration'])
+    return {
+        'trace_id': trace_id,
+        'start': start,
+        'duration': end - start,
+        'slowest': slowest['name'],
+        'spans': spans
+    }
+
+
+def get_slowest_traces(name=None, limit=20):
+    """
+    Returns the slowest recorded traces, from the start of their first span
+    to the end of their last span.
+
+    Args:
+        name (str, None): Only the traces whose root span has this name.
+        limit (int): Maximum number of traces.
+
+    Returns:
+        traces (list): ID, root span name, start, duration and number of
+            spans of the traces, slowest first.
+    """
+    roots = Spans.select(Spans.trace_id).where(Spans.parent_id.is_null())
+    if name:
+        roots = roots.where(Spans.name == name)
+
+    duration = fn.MAX(Spans.start + Spans.duration) - fn.MIN(Spans.start)
+    traces = list(
+        Spans.select(
+            Spans.trace_id,
+            fn.MIN(Spans.start).alias('trace_start'),
+            duration.alias('trace_duration'),
+            fn.COUNT(Spans.id).alias('span_count')).where(
+                Spans.trace_id.in_(roots)).group_by(Spans.trace_id).order_by(
+                    duration.desc()).limit(limit))
+    names = dict(
+        Spans.select(Spans.trace_id, Spans.name).where(
+            Spans.parent_id.is_null()).where(
+                Spans.trace_id.in_([t.trace_id for t in traces])).tuples())
+    return [{
+        'trace_id': trace.trace_id,
+        'name': names.get(trace.trace_id),
+        'start': trace.trace_start,
+        'duration': trace.trace_duration,
+        'spans': trace.span_count
+    } for trace in traces]
+
+
+@task_prerun.connect
+def _on_task_prerun(task=None, **kwargs):
+    request = task.request
+    headers = {TRACE_HEADER: getattr(request, TRACE_HEADER, None)}
+    if headers[TRACE_HEADER] is None:
+        headers = request.headers or {}
+    set_remote_context(headers)
+
+
+@task_postrun.connect
+def _on_task_postrun(**kwargs):
+    clear_remote_context()
@@ -0,0 +1,322 @@
+import datetime
+import hashlib
+import logging
+import os
+import re
+import uuid
+import zipfile
+
+from tornado.web import RequestHandler, stream_request_body
+
+from .constants import ORIGAMI_CONFIG_DIR, ORIGAMI_UPLOADS_DIRNAME, \
+    BUNDLE_ZIP_MAX_COMPRESSED_SIZE, UPLOAD_MAX_CHUNK, UPLOAD_EXPIRY, \
+    BUILD_CONTEXT_CHUNK_SIZE
+from .database import Uploads
+from .exceptions import InvalidDemoBundleException
+from .ratelimit import rate_limiter
+
+CONTENT_RANGE_PATTERN = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+
+# Checksum of the bytes received so far of the uploads in progress, along
+# with the offset it was computed up to.
+_hashers = {}
+# Uploads a chunk is currently being written to.
+_active = set()
+
+
+def get_uploads_dir():
+    """
+    Returns the directory of the uploaded bundles, $HOME/.origami/uploads
+    """
+    dirpath = os.path.join(os.environ['HOME'], ORIGAMI_CONFIG_DIR,
+                           ORIGAMI_UPLOADS_DIRNAME)
+    if not os.path.isdir(dirpath):
+        os.makedirs(dirpath, mode=0o755)
+    return dirpath
+
+
+def get_upload_path(upload_id, complete=True):
+    """
+    Returns the path of an uploaded bundle, or of the part of it received
+    so far if the upload is not complete.
+    """
+    return os.path.join(get_uploads_dir(), '{}.{}'.format(
+        upload_id, 'zip' if complete else 'part'))
+
+
+def get_upload_offset(upload):
+    """
+    Returns the number of bytes of the bundle received so far, the next
+    chunk of the upload must start at this offset.
+    """
+    if upload.status == 'complete':
+        return upload.size
+    path = get_upload_path(upload.upload_id, False)
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+def upload_to_dict(upload):
+    return {
+        'upload_id': upload.upload_id,
+        'size': upload.size,
+        'offset': get_upload_offset(upload),
+        'sha256': upload.sha256,
+        'status': upload.status,
+        'error': upload.error
+    }
+
+
+def expire_uploads(expiry=UPLOAD_EXPIRY):
+    """
+    Remove the uploads which were not completed within `expiry` seconds.
+
+    Returns:
+        expired (int): Number of removed uploads.
+    """
+    deadline = datetime.datetime.now() - datetime.timedelta(seconds=expiry)
+    expired = Uploads.select().where(Uploads.status != 'complete').where(
+        Uploads.created_at < deadline)
+    count = 0
+    for upload in expired:
+        path = get_upload_path(upload.upload_id, False)
+        if os.path.exists(path):
+            os.remove(path)
+        _hashers.pop(upload.upload_id, None)
+        upload.delete_instance()
+        count += 1
+    return count
+
+
+def create_upload(size, sha256=None):
+    """
+    Create an upload for a bundle of `size` bytes, the bundle is then sent
+    in one or more chunks.
+
+    Args:
+        size (int): Size in bytes of the bundle.
+        sha256 (str, None): Checksum the uploaded bundle must match.
+
+    Returns:
+        upload (Uploads): The created upload.
+
+    Raises:
+        InvalidDemoBundleException: The bundle is larger than allowed.
+    """
+    if not 0 < size <= BUNDLE_ZIP_MAX_COMPRESSED_SIZE:
+        raise InvalidDemoBundleException(
+            'The size of a bundle must be between 1 and {} bytes'.format(
+                BUNDLE_ZIP_MAX_COMPRESSED_SIZE))
+    expire_uploads()
+    upload = Uploads.create(
+        upload_id=uuid.uuid4().hex,
+        size=size,
+        sha256=sha256.lower() if sha256 else None)
+    open(get_upload_path(upload.upload_id, False), 'wb').close()
+    return upload
+
+
+def get_uploaded_bundle(upload_id):
+    """
+    Returns the path of the bundle of a complete upload.
+
+    Raises:
+        InvalidDemoBundleException: The upload does not exist or is not
+            complete.
+    """
+    upload = Uploads.get_or_none(Uploads.upload_id == upload_id)
+    if upload is None or upload.status != 'complete':
+        raise InvalidDemoBundleException(
+            'No complete upload with ID {}'.format(upload_id))
+    return get_upload_path(upload_id)
+
+
+def _get_hasher(upload_id, offset):
+    """
+    Returns the checksum state of the bytes of an upload up to `offset`, it
+    is computed again from the received part if the server restarted or a
+    chunk was interrupted.
+    """
+    entry = _hashers.get(upload_id)
+    if entry is None or entry[0] != offset:
+        hasher = hashlib.sha256()
+        with open(get_upload_path(upload_id, False), 'rb') as fp:
+            while True:
+                chunk = fp.read(BUILD_CONTEXT_CHUNK_SIZE)
+                if not chunk:
+                    break
+                hasher.update(chunk)
+        entry = _hashers[upload_id] = [offset, hasher]
+    return entry
+
+
+def complete_upload(upload, sha256):
+    """
+    Verify a fully received bundle and make it available for deploys.
+
+    Args:
+        upload (Uploads): The upload.
+        sha256 (str): Checksum of the received bundle.
+
+    Raises:
+        InvalidDemoBundleException: The checksum does not match the one
+            provided by the client or the bundle is not a zip.
+    """
+    _hashers.pop(upload.upload_id, None)
+    path = get_upload_path(upload.upload_id, False)
+    try:
+        if upload.sha256 and upload.sha256 != sha256:
+            raise InvalidDemoBundleException(
+                'Checksum mismatch, expected {} received {}'.format(
+                    upload.sha256, sha256))
+        if not zipfile.is_zipfile(path):
+            raise InvalidDemoBundleException('The bundle is not a zip')
+    except InvalidDemoBundleException as e:
+        os.remove(path)
+        upload.status = 'failed'
+        upload.error = '{}'.format(e)
+        upload.save()
+        raise
+
+    os.rename(path, get_upload_path(upload.upload_id))
+    upload.sha256 = sha256
+    upload.status = 'complete'
+    upload.completed_at = datetime.datetime.now()
+    upload.save()
+
+
+@stream_request_body
+class BundleUploadHandler(RequestHandler):
+    """
+    Upload of demo bundles to the API server, for origami servers which do
+    not share a filesystem with the daemon.
+
+    An upload is created with the size and optionally the sha256 of the
+    bundle, then the bundle is sent in one or more chunks with PUT requests
+    with a `Content-Range` header. Chunks are written to the disk as they
+    are received and the bundle is hashed on the fly. A chunk must start
+    where the previous one ended, an interrupted upload is resumed from the
+    `offset` reported by GET. Once complete the `upload_id` can be passed
+    to `/deploy_trigger` instead of a `bundle_path`. A client sends at most
+    RATE_LIMIT_MAX_UPLOADS chunks at the same time.
+
+    .. code-block:: bash
+
+        $ curl -X POST '127.0.0.1:9002/uploads?size=7340032&sha256=9f86d0...'
+
+        {"upload_id": "0c5a1e...", "size": 7340032, "offset": 0, ...}
+
+        $ curl -X PUT 127.0.0.1:9002/uploads/0c5a1e... \\
+            -H 'Content-Range: bytes 0-7340031/7340032' \\
+            --data-binary @bundle.zip
+
+        {"upload_id": "0c5a1e...", "offset": 7340032, "status": "complete"}
+
+        $ curl -X POST 127.0.0.1:9002/deploy_trigger/ffc806 \\
+            --data 'upload_id=0c5a1e...'
+    """
+
+    def initialize(self):
+        self.upload = None
+        self.file = None
+        self.hasher = None
+        self.client = None
+
+    def reply(self, status, body):
+        self.set_status(status)
+        self.finish(body)
+
+    def prepare(self):
+        if self.request.method != 'PUT':
+            return
+        upload_id = self.path_args[0] if self.path_args else None
+        self.upload = Uploads.get_or_none(Uploads.upload_id == upload_id)
+        if self.upload is None:
+            return self.reply(404, {'error': 'No upload {}'.format(upload_id)})
+        if self.upload.status != 'pending':
+            return self.reply(409, upload_to_dict(self.upload))
+        if upload_id in _active:
+            return self.reply(409, {'error': 'A chunk is being uploaded'})
+        if not rate_limiter.enter_upload(self.request.remote_ip):
+            self.set_header('Retry-After', '1')
+            return self.reply(429, {'error': 'Too many chunks are being '
+                                             'uploaded'})
+        self.client = self.request.remote_ip
+
+        match = CONTENT_RANGE_PATTERN.match(
+            self.request.headers.get('Content-Range', ''))
+        if not match:
+            return self.reply(400, {
+                'error': 'A Content-Range header is required, for example '
+                         'bytes 0-1023/{}'.format(self.upload.size)})
+        start, end, total = (int(x) for x in match.groups())
+        length = end - start + 1
+        offset = get_upload_offset(self.upload)
+        if total != self.upload.size or end >= total or length <= 0:
+            return self.reply(400, {'error': 'Invalid Content-Range'})
+        if length > UPLOAD_MAX_CHUNK:
+            return self.reply(413, {
+                'error': 'Chunks are limited to {} bytes'.format(
+                    UPLOAD_MAX_CHUNK)})
+        if start != offset:
+            # The client resumes from the offset in the response.
+            return self.reply(409, upload_to_dict(self.upload))
+
+        # Bodies larger than the range are refused by tornado while they
+        # are read.
+        self.request.connection.set_max_body_size(length)
+        _active.add(upload_id)
+        self.hasher = _get_hasher(upload_id, offset)
+        self.file = open(get_upload_path(upload_id, False), 'ab')
+
+    def data_received(self, chunk):
+        if self.file:
+            self.file.write(chunk)
+            self.hasher[1].update(chunk)
+            self.hasher[0] += len(chunk)
+
+    def post(self):
+        try:
+            size = int(self.get_argument('size'))
+            upload = create_upload(size, self.get_argument('sha256', None))
+        except ValueError:
+            return self.reply(400, {'error': 'Invalid size'})
+        except InvalidDemoBundleException as e:
+            return self.reply(413, {'error': '{}'.format(e)})
+        logging.info('Created upload {} of {} bytes'.format(
+            upload.upload_id, size))
+        self.set_header('Location', '/uploads/{}'.format(upload.upload_id))
+        self.reply(201, upload_to_dict(upload))
+
+    def get(self, upload_id):
+        upload = Uploads.get_or_none(Uploads.upload_id == upload_id)
+        if upload is None:
+            return self.reply(404, {'error': 'No upload {}'.format(upload_id)})
+        self.reply(200, upload_to_dict(upload))
+
+    def put(self, upload_id):
+        self._close()
+        if self.hasher[0] < self.upload.size:
+            return self.reply(202, upload_to_dict(self.upload))
+
+        try:
+            complete_upload(self.upload, self.hasher[1].hexdigest())
+        except InvalidDemoBundleException as e:
+            logging.warn('Upload {} failed : {}'.format(upload_id, e))
+            return self.reply(400, upload_to_dict(self.upload))
+        logging.info('Upload {} complete'.format(upload_id))
+        self.reply(200, upload_to_dict(self.upload))
+
+    def _close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+            _active.discard(self.upload.upload_id)
+        if self.client:
+            rate_limiter.exit_upload(self.client)
+            self.client = None
+
+    def on_connection_close(self):
+        self._close()
+
+    def on_finish(self):
+        self._close()
@@ -0,0 +1,162 @@
+import os
+import posixpath
+import shutil
+import stat
+import tarfile
+import time
+import zipfile
+
+from docker.utils.fnmatch import fnmatch
+
+from ..constants import DOCKERFILE_FILE, DOCKERIGNORE_FILE, \
+    ORIGAMI_BUNDLE_ZIP, BUILD_CONTEXT_CHUNK_SIZE
+from ..exceptions import InvalidDemoBundleException
+
+
+def get_dockerignore_patterns(bundle):
+    """
+    Returns the patterns of the .dockerignore file at the root of a demo
+    bundle, comments and empty lines are skipped.
+
+    Args:
+        bundle (zipfile.ZipFile): The demo bundle.
+
+    Returns:
+        patterns (list): Cleaned patterns in the order of the file.
+    """
+    try:
+        contents = bundle.read(DOCKERIGNORE_FILE).decode('utf-8')
+    except KeyError:
+        return []
+
+    patterns = []
+    for line in contents.splitlines():
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        negate = line.startswith('!')
+        pattern = posixpath.normpath(line.lstrip('!').strip()).lstrip('/')
+        patterns.append('!' + pattern if negate else pattern)
+    return patterns
+
+
+def is_excluded(path, patterns):
+    """
+    Returns True if a path of the build context is excluded by the patterns
+    of a .dockerignore file. Like docker the last matching pattern wins, a
+    pattern starting with ! includes the paths it matches again and a
+    pattern matching a directory matches everything in it.
+
+    Args:
+        path (str): Path relative to the root of the build context.
+        patterns (list): Patterns from `get_dockerignore_patterns`.
+
+    Returns:
+        (bool): True if the path is not sent to docker.
+    """
+    parts = path.split('/')
+    parents = ['/'.join(parts[:i + 1]) for i in range(len(parts))]
+    excluded = False
+    for pattern in patterns:
+        negate = pattern.startswith('!')
+        pattern = pattern.lstrip('!')
+        if any(fnmatch(parent, pattern) for parent in parents):
+            excluded = not negate
+    return excluded
+
+
+def _get_tarinfo(info, name):
+    """
+    Returns the tar header of a member of the bundle, the permissions of
+    files zipped on unix are kept.
+    """
+    tarinfo = tarfile.TarInfo(name)
+    tarinfo.mtime = time.mktime(info.date_time + (0, 0, -1))
+    mode = info.external_attr >> 16
+    if stat.S_ISLNK(mode):
+        tarinfo.type = tarfile.SYMTYPE
+    elif info.filename.endswith('/'):
+        tarinfo.type = tarfile.DIRTYPE
+    else:
+        tarinfo.size = info.file_size
+    tarinfo.mode = stat.S_IMODE(mode) or (
+        0o755 if tarinfo.type == tarfile.DIRTYPE else 0o644)
+    return tarinfo
+
+
+def stream_build_context(bundle_path, chunk_size=BUILD_CONTEXT_CHUNK_SIZE):
+    """
+    Yields the docker build context of a demo bundle as a tar stream which
+    is converted from the zip on the fly, the bundle is never extracted to
+    the disk and at most one chunk of it is held in memory. Paths excluded by
+    the .dockerignore file of the bundle are skipped, the Dockerfile and the
+    .dockerignore file are always sent like docker does.
+
+    .. code-block:: python
+
+        client.api.build(fileobj=stream_build_context(bundle_path),
+                         custom_context=True)
+
+    Args:
+        bundle_path (str): Path of the demo bundle zip.
+        chunk_size (int): Size in bytes of the chunks read from the zip.
+
+    Yields:
+        chunk (bytes): Next part of the tar stream.
+
+    Raises:
+        InvalidDemoBundleException: A path of the bundle leaves the build
+            context.
+    """
+    with zipfile.ZipFile(bundle_path) as bundle:
+        patterns = get_dockerignore_patterns(bundle)
+        for info in bundle.infolist():
+            name = posixpath.normpath(info.filename)
+            if name.startswith(('/', '../')) or name == '..':
+                raise InvalidDemoBundleException(
+                    'Invalid path in bundle : {}'.format(info.filename))
+            if name not in (DOCKERFILE_FILE, DOCKERIGNORE_FILE) and \
+                    is_excluded(name, patterns):
+                continue
+
+            tarinfo = _get_tarinfo(info, name)
+            if tarinfo.issym():
+                tarinfo.linkname = bundle.read(info).decode('utf-8')
+            yield tarinfo.tobuf(tarfile.PAX_FORMAT)
+            if not tarinfo.isreg():
+                continue
+
+            with bundle.open(info) as member:
+                while True:
+                    chunk = member.read(chunk_size)
+                    if not chunk:
+                        break
+                    yield chunk
+            remainder = tarinfo.size % tarfile.BLOCKSIZE
+            if remainder:
+                yield tarfile.NUL * (tarfile.BLOCKSIZE - remainder)
+
+    # End of archive marker.
+    yield tarfile.NUL * (tarfile.BLOCKSIZE * 2)
+
+
+def stage_bundle(bundle_path, demo_dir):
+    """
+    Keep the demo bundle in the demo directory to build the demo from it
+    later. The bundle is hard linked if possible and copied otherwise.
+
+    Args:
+        bundle_path (str): Path of the demo bundle zip.
+        demo_dir (str): Directory of the demo.
+
+    Returns:
+        path (str): Path of the staged bundle.
+    """
+    staged = os.path.join(demo_dir, ORIGAMI_BUNDLE_ZIP)
+    if os.path.exists(staged):
+        os.remove(staged)
+    try:
+        os.link(bundle_path, staged)
+    except OSError:
+        shutil.copyfile(bundle_path, staged)
+    return staged
@@ -0,0 +1,265 @@
+import json
+import re
+import six
+
+from ..constants import ORIGAMI_WRAPPED_DEMO_PORT
+from ..exceptions import InvalidDemoBundleException
+
+INSTRUCTIONS = {
+    'ADD', 'ARG', 'CMD', 'COPY', 'ENTRYPOINT', 'ENV', 'EXPOSE', 'FROM',
+    'HEALTHCHECK', 'LABEL', 'MAINTAINER', 'ONBUILD', 'RUN', 'SHELL',
+    'STOPSIGNAL', 'USER', 'VOLUME', 'WORKDIR'
+}
+
+# Parser directives, only allowed before any other line of the Dockerfile.
+DIRECTIVE_PATTERN = re.compile(r'^#\s*(escape|syntax)\s*=\s*(\S+)\s*$', re.I)
+
+# FROM [--platform=<platform>] <image>[:<tag>|@<digest>] [AS <name>]
+IMAGE_PATTERN = re.compile(
+    r'^([a-z0-9]+([._-][a-z0-9]+)*(:\d+)?/)?'
+    r'[a-z0-9]+([._-]+[a-z0-9]+)*(/[a-z0-9]+([._-]+[a-z0-9]+)*)*'
+    r'(:[\w][\w.-]{0,127})?(@[a-z0-9]+:[a-f0-9]{32,})?$')
+STAGE_NAME_PATTERN = re.compile(r'^[a-zA-Z][a-zA-Z0-9_.-]*$')
+
+EXPOSE_PATTERN = re.compile(r'^(\d+)(-\d+)?(/(tcp|udp))?$', re.I)
+
+# Explicit ports in the command of a demo, such as --port 8000,
+# --bind 0.0.0.0:8000 or port=8000. Options which only end with port, such
+# as --redis-port=6379 or --db_port=5432, are other services.
+COMMAND_PORT_PATTERN = re.compile(
+    r'(?:(?<![\w-])--port[= ]|(?<![\w-])port\s*=\s*|'
+    r'(?:0\.0\.0\.0|\[::\]|\*):)(\d{2,5})\b')
+
+PIP_INSTALL_PATTERN = re.compile(r'\bpip[0-9.]*\s+install\b')
+
+# Reference to a build argument, $NAME or ${NAME}.
+ARG_PATTERN = re.compile(r'\$(?:\{(\w+)\}|(\w+))')
+
+
+def parse_dockerfile(contents):
+    """
+    Split a Dockerfile into its instructions. Comments and empty lines are
+    skipped, lines ending with the escape character are joined with the
+    next line.
+
+    Args:
+        contents (str): Contents of the Dockerfile.
+
+    Returns:
+        instructions (list): (line number, instruction, arguments) tuples,
+            the instruction is upper cased.
+
+    Raises:
+        InvalidDemoBundleException: A line of the Dockerfile is not an
+            instruction.
+    """
+    escape = '\\'
+    instructions = []
+    pending, start = None, None
+    directives = True
+    for lineno, line in enumerate(contents.splitlines(), 1):
+        if directives:
+            match = DIRECTIVE_PATTERN.match(line)
+            if match:
+                if match.group(1).lower() == 'escape':
+                    escape = match.group(2)
+                continue
+            directives = False
+
+        stripped = line.strip()
+        if not stripped or stripped.startswith('#'):
+            continue
+
+        if pending is None:
+            pending, start = '', lineno
+        if stripped.endswith(escape):
+            pending += stripped[:-len(escape)] + ' '
+            continue
+        pending += stripped
+
+        parts = pending.split(None, 1)
+        instruction = parts[0].upper()
+        if instruction not in INSTRUCTIONS:
+            raise InvalidDemoBundleException(
+                'Dockerfile line {}: unknown instruction {}'.format(
+                    start, parts[0]))
+        if len(parts) < 2:
+            raise InvalidDemoBundleException(
+                'Dockerfile line {}: {} requires arguments'.format(
+                    start, instruction))
+        instructions.append((start, instruction, parts[1].strip()))
+        pending = None
+
+    if pending is not None:
+        raise InvalidDemoBundleException(
+            'Dockerfile line {}: unterminated line continuation'.format(start))
+    return instructions
+
+
+def _check_from(lineno, args):
+    words = [w for w in args.split() if not w.startswith('--platform=')]
+    if len(words) == 3 and words[1].upper() == 'AS':
+        if not STAGE_NAME_PATTERN.match(words[2]):
+            raise InvalidDemoBundleException(
+                'Dockerfile line {}: invalid stage name {}'.format(
+                    lineno, words[2]))
+    elif len(words) != 1:
+        raise InvalidDemoBundleException(
+            'Dockerfile line {}: FROM expects an image and an optional '
+            'AS <name>'.format(lineno))
+    # Images from build arguments are only known at build time.
+    if '$' not in words[0] and not IMAGE_PATTERN.match(words[0]):
+        raise InvalidDemoBundleException(
+            'Dockerfile line {}: invalid image {}'.format(lineno, words[0]))
+
+
+def _parse_command(lineno, instruction, args):
+    """
+    Returns the command of a CMD or ENTRYPOINT instruction as a string.
+    """
+    if not args.startswith('['):
+        return args
+    try:
+        command = json.loads(args)
+    except ValueError:
+        command = None
+    if not isinstance(command, list) or \
+            not all(isinstance(arg, six.string_types) for arg in command):
+        raise InvalidDemoBundleException(
+            'Dockerfile line {}: {} must be a JSON array of strings'.format(
+                lineno, instruction))
+    return ' '.join(command)
+
+
+def validate_dockerfile_contents(contents, port=ORIGAMI_WRAPPED_DEMO_PORT):
+    """
+    Statically validate a Dockerfile before the demo is built, the checks
+    only look at the text of the Dockerfile so they run in milliseconds.
+
+    Errors, which fail the deploy:
+
+    * Unknown instructions and instructions without arguments.
+    * The first instruction other than ARG is not a valid FROM.
+    * CMD or ENTRYPOINT in JSON form which is not an array of strings.
+    * EXPOSE with an invalid port.
+    * The command of the demo serves on an explicit port other than `port`.
+
+    Warnings, which are returned:
+
+    * The final stage exposes ports but not `port`.
+    * The final stage has more than one CMD or ENTRYPOINT.
+    * The whole build context is copied before `pip install`, which
+        invalidates the cached layer of the requirements on every change.
+
+    Args:
+        contents (str): Contents of the Dockerfile.
+        port (int): Port the demo must serve on in its container.
+
+    Returns:
+        warnings (list): Messages about the issues which do not fail the
+            deploy.
+
+    Raises:
+        InvalidDemoBundleException: The Dockerfile is not valid.
+    """
+    instructions = parse_dockerfile(contents)
+    first = next((i for i in instructions if i[1] != 'ARG'), None)
+    if first is None or first[1] != 'FROM':
+        raise InvalidDemoBundleException(
+            'Dockerfile must start with a FROM instruction')
+
+    warnings = []
+    exposed, commands, ports = [], {'CMD': 0, 'ENTRYPOINT': 0}, {}
+    copied_context = None
+    for lineno, instruction, args in instructions:
+        if instruction == 'FROM':
+            _check_from(lineno, args)
+            exposed, commands, ports = [], {'CMD': 0, 'ENTRYPOINT': 0}, {}
+            copied_context = None
+
+        elif instruction == 'EXPOSE':
+            for word in args.split():
+                match = EXPOSE_PATTERN.match(word)
+                if match:
+                    exposed.append(int(match.group(1)))
+                elif '$' not in word:
+                    raise InvalidDemoBundleException(
+                        'Dockerfile line {}: invalid port {}'.format(
+                            lineno, word))
+
+        elif instruction in commands:
+            commands[instruction] += 1
+            command = ' {}'.format(_parse_command(lineno, instruction, args))
+            ports[instruction] = [
+                (lineno, int(match.group(1)))
+                for match in COMMAND_PORT_PATTERN.finditer(command)
+            ]
+
+        elif instruction in ('COPY', 'ADD'):
+            sources = [w for w in args.split() if not w.startswith('--')][:-1]
+            if any(source in ('.', './', '*') for source in sources):
+                copied_context = copied_context or lineno
+
+        elif instruction == 'RUN' and copied_context and \
+                PIP_INSTALL_PATTERN.search(args):
+            warnings.append(
+                'Dockerfile line {}: the build context is copied on line {} '
+                'before pip install, any change to the bundle reinstalls the '
+                'requirements. Copy requirements.txt and install it '
+                'first'.format(lineno, copied_context))
+            copied_context = None
+
+    # Only the last command of the final stage runs in the demo container.
+    for lineno, serves in sum(ports.values(), []):
+        if serves != port:
+            raise InvalidDemoBundleException(
+                'Dockerfile line {}: the demo serves on port {} but must '
+                'serve on port {}'.format(lineno, serves, port))
+    if exposed and port not in exposed:
+        warnings.append('Dockerfile exposes {} but the demo is served on port '
+                        '{}'.format(', '.join(str(p) for p in exposed), port))
+    for instruction, count in commands.items():
+        if count > 1:
+            warnings.append(
+                'Dockerfile has {} {} instructions in its final stage, only '
+                'the last one is used'.format(count, instruction))
+    return warnings
+
+
+def get_base_images(contents):
+    """
+    Returns the images the stages of a Dockerfile are built from. Build
+    arguments declared before the first FROM are replaced with their default
+    value, stages built from a previous stage, scratch and images which
+    depend on arguments without a default are skipped.
+
+    Args:
+        contents (str): Contents of the Dockerfile.
+
+    Returns:
+        images (list): Image references in the order of the Dockerfile, an
+            empty list if the Dockerfile cannot be parsed.
+    """
+    try:
+        instructions = parse_dockerfile(contents)
+    except InvalidDemoBundleException:
+        return []
+
+    args, stages, images = {}, set(), []
+    for _, instruction, value in instructions:
+        if instruction == 'ARG' and not stages and not images:
+            name, equals, default = value.partition('=')
+            if equals:
+                args[name.strip()] = default.strip().strip('"\'')
+        elif instruction == 'FROM':
+            words = [w for w in value.split() if not w.startswith('--')]
+            image = ARG_PATTERN.sub(
+                lambda m: args.get(m.group(1) or m.group(2), m.group(0)),
+                words[0])
+            if len(words) == 3:
+                stages.add(words[2].lower())
+            if '$' in image or image.lower() in stages or \
+                    image == 'scratch' or image in images:
+                continue
+            images.append(image)
+    return images
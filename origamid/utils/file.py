@@ -51,7 +51,7 @@ def get_log_path(log_file):
         return None
 
 
-def extract_zip_to_dir(zip_path, extract_path):
+def extract_zip_to_dir(zip_path, extract_path, members=None):
     """
     Extracts a ZIP file to the desired location, make sure that before any call
     to this function the paths zip_path and extract_path must be verified.
@@ -59,9 +59,14 @@ def extract_zip_to_dir(zip_path, extract_path):
     Args:
         zip_path: absolute path of the zip file
         extract_path: absolute path to where the zip is to be extracted.
+        members (list, None): Only extract these members of the zip if they
+            are present, all the members are extracted by default.
     """
     zip_ref = zipfile.ZipFile(zip_path, 'r')
-    zip_ref.extractall(extract_path)
+    if members is not None:
+        names = set(zip_ref.namelist())
+        members = [m for m in members if m in names]
+    zip_ref.extractall(extract_path, members)
     zip_ref.close()
 
 
@@ -0,0 +1,217 @@
+import hashlib
+import json
+import os
+import posixpath
+import struct
+import zipfile
+
+from ..constants import ORIGAMI_BUNDLE_ZIP, ORIGAMI_MANIFEST_FILE, \
+    BUILD_CONTEXT_CHUNK_SIZE
+from ..exceptions import InvalidDemoBundleException
+
+
+def _hash_member(bundle, info):
+    digest = hashlib.sha256()
+    with bundle.open(info) as member:
+        while True:
+            chunk = member.read(BUILD_CONTEXT_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _copy_member(source, info, target):
+    """
+    Copy a member of a zip to another zip without recompressing it, keeping
+    its compression, permissions and modification time. The local header is
+    written again and the compressed bytes are copied as they are, the same
+    way `ZipFile.write` lays out a member, so copying a member costs a read
+    and a write of its compressed size only.
+    """
+    if info.flag_bits & 0x01:
+        raise InvalidDemoBundleException(
+            'Encrypted files are not supported : {}'.format(info.filename))
+
+    # Skip the local header of the member, the name and extra field lengths
+    # are its last two fields.
+    source.fp.seek(info.header_offset)
+    header = struct.unpack(zipfile.structFileHeader,
+                           source.fp.read(zipfile.sizeFileHeader))
+    source.fp.seek(header[-2] + header[-1], os.SEEK_CUR)
+
+    copy = zipfile.ZipInfo(info.filename, info.date_time)
+    copy.compress_type = info.compress_type
+    copy.external_attr = info.external_attr
+    copy.create_system = info.create_system
+    # The sizes are known up front, no data descriptor follows the data.
+    copy.flag_bits = info.flag_bits & ~0x08
+    copy.CRC = info.CRC
+    copy.compress_size = info.compress_size
+    copy.file_size = info.file_size
+
+    target.fp.seek(target.start_dir)
+    copy.header_offset = target.fp.tell()
+    target.fp.write(copy.FileHeader())
+    remaining = info.compress_size
+    while remaining:
+        chunk = source.fp.read(min(remaining, BUILD_CONTEXT_CHUNK_SIZE))
+        if not chunk:
+            raise InvalidDemoBundleException(
+                'Truncated file in bundle : {}'.format(info.filename))
+        target.fp.write(chunk)
+        remaining -= len(chunk)
+    target.start_dir = target.fp.tell()
+    target.filelist.append(copy)
+    target.NameToInfo[copy.filename] = copy
+    target._didModify = True
+
+
+def _get_member_name(info):
+    name = posixpath.normpath(info.filename)
+    if name.startswith(('/', '../')) or name == '..':
+        raise InvalidDemoBundleException(
+            'Invalid path in bundle : {}'.format(info.filename))
+    return name
+
+
+def hash_bundle(bundle_path):
+    """
+    Returns the manifest entries of the files of a bundle zip.
+
+    Args:
+        bundle_path (str): Path of the bundle zip.
+
+    Returns:
+        files (dict): Size and sha256 of each file keyed by its path.
+    """
+    files = {}
+    with zipfile.ZipFile(bundle_path) as bundle:
+        for info in bundle.infolist():
+            if info.filename.endswith('/'):
+                continue
+            files[_get_member_name(info)] = {
+                'size': info.file_size,
+                'sha256': _hash_member(bundle, info)
+            }
+    return files
+
+
+def get_manifest_digest(files):
+    """
+    Returns the sha256 of a manifest, it changes whenever a file of the
+    bundle is added, removed or modified.
+    """
+    contents = json.dumps(files, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(contents.encode('utf-8')).hexdigest()
+
+
+def save_manifest(demo_dir, files):
+    """
+    Write the manifest of the bundle of a demo to its demo directory.
+
+    Args:
+        demo_dir (str): Directory of the demo.
+        files (dict): Manifest entries from `hash_bundle`.
+    """
+    path = os.path.join(demo_dir, ORIGAMI_MANIFEST_FILE)
+    with open('{}.tmp'.format(path), 'w') as fp:
+        json.dump(files, fp, sort_keys=True)
+    os.rename('{}.tmp'.format(path), path)
+
+
+def load_manifest(demo_dir):
+    """
+    Returns the manifest of the bundle of a demo. The manifest of a bundle
+    staged before manifests were kept is computed and saved.
+
+    Args:
+        demo_dir (str): Directory of the demo.
+
+    Returns:
+        files (dict, None): Manifest entries keyed by path, None if the demo
+            has no staged bundle.
+    """
+    path = os.path.join(demo_dir, ORIGAMI_MANIFEST_FILE)
+    if os.path.exists(path):
+        with open(path, 'r') as fp:
+            return json.load(fp)
+
+    bundle_path = os.path.join(demo_dir, ORIGAMI_BUNDLE_ZIP)
+    if not os.path.exists(bundle_path):
+        return None
+    files = hash_bundle(bundle_path)
+    save_manifest(demo_dir, files)
+    return files
+
+
+def merge_delta_bundle(demo_dir, delta_path, deleted=(), validate=None):
+    """
+    Patch the bundle staged in a demo directory with a delta bundle. The
+    files of the delta replace or are added to the files of the bundle and
+    the `deleted` paths are removed from it. Only the files of the delta are
+    hashed, the manifest entries of the other files are kept.
+
+    The patched bundle is written next to the staged one and replaces it in
+    a single rename, a failed merge leaves the staged bundle untouched. No
+    file is recompressed, the compressed bytes of the files are copied to
+    the patched bundle as they are.
+
+    Args:
+        demo_dir (str): Directory of the demo.
+        delta_path (str): Path of the zip with the changed files.
+        deleted (list): Paths of the files removed from the bundle.
+        validate (callable, None): Called with the path of the patched
+            bundle before it replaces the staged one.
+
+    Returns:
+        files (dict): Manifest of the patched bundle.
+
+    Raises:
+        InvalidDemoBundleException: The demo has no staged bundle or the
+            delta has an invalid path.
+    """
+    files = load_manifest(demo_dir)
+    if files is None:
+        raise InvalidDemoBundleException(
+            'No bundle to patch, deploy the full bundle first')
+
+    bundle_path = os.path.join(demo_dir, ORIGAMI_BUNDLE_ZIP)
+    partial = '{}.tmp'.format(bundle_path)
+    deleted = set(posixpath.normpath(path) for path in deleted)
+    try:
+        with zipfile.ZipFile(delta_path) as delta, \
+                zipfile.ZipFile(bundle_path) as bundle, \
+                zipfile.ZipFile(partial, 'w') as patched:
+            changed = {}
+            for info in delta.infolist():
+                if not info.filename.endswith('/'):
+                    changed[_get_member_name(info)] = info
+
+            for source, members in ((bundle, bundle.infolist()),
+                                    (delta, list(changed.values()))):
+                for info in members:
+                    name = _get_member_name(info)
+                    if name in deleted or \
+                            (source is bundle and name in changed):
+                        continue
+                    _copy_member(source, info, patched)
+
+            for name in deleted:
+                files.pop(name, None)
+            for name, info in changed.items():
+                if name not in deleted:
+                    files[name] = {
+                        'size': info.file_size,
+                        'sha256': _hash_member(delta, info)
+                    }
+        if validate:
+            validate(partial)
+    except Exception:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+
+    os.rename(partial, bundle_path)
+    save_manifest(demo_dir, files)
+    return files
@@ -0,0 +1,143 @@
+import os
+import re
+
+from ..constants import ORIGAMI_ENV_FILE, ORIGAMI_ENV_RESOURCE_KEYS
+from ..exceptions import InvalidDemoBundleException
+
+MEMORY_UNITS = {
+    '': 1,
+    'b': 1,
+    'k': 1024,
+    'm': 1024**2,
+    'g': 1024**3,
+    't': 1024**4,
+}
+
+
+def parse_memory(value):
+    """
+    Parse a memory size in the docker format, a number followed by an
+    optional unit b, k, m, g or t. For example `512m` or `2g`.
+
+    Args:
+        value (str, int): Memory size to parse.
+
+    Returns:
+        memory (int): Memory size in bytes.
+
+    Raises:
+        InvalidDemoBundleException: The memory size is not valid.
+    """
+    match = re.match(r'^\s*([0-9]+(?:\.[0-9]+)?)\s*([bkmgt]?)i?b?\s*$',
+                     str(value), re.I)
+    if not match or float(match.group(1)) <= 0:
+        raise InvalidDemoBundleException(
+            'Memory size {} is not valid'.format(value))
+    return int(float(match.group(1)) * MEMORY_UNITS[match.group(2).lower()])
+
+
+def parse_cpus(value):
+    """
+    Parse a number of CPUs, fractions of a CPU are allowed. For example `0.5`.
+
+    Args:
+        value (str, float): Number of CPUs to parse.
+
+    Returns:
+        cpus (float): Number of CPUs.
+
+    Raises:
+        InvalidDemoBundleException: The number of CPUs is not valid.
+    """
+    try:
+        cpus = float(value)
+    except (TypeError, ValueError):
+        cpus = 0
+    if cpus <= 0:
+        raise InvalidDemoBundleException(
+            'CPU count {} is not valid'.format(value))
+    return cpus
+
+
+def read_origami_env_file(file_path):
+    """
+    Returns the variables defined in an origami environment file, the file
+    must have been validated using `validate_origami_env_file`.
+
+    Args:
+        file_path (str): Absolute file path for the environment file.
+
+    Returns:
+        variables (dict): Environment variables defined in the file.
+    """
+    variables = {}
+    if not os.path.isfile(file_path):
+        return variables
+    with open(file_path, 'r') as file:
+        for line in file.read().split('\n'):
+            line = line.strip()
+            if line:
+                key, value = line.split('=')
+                variables[key.strip()] = value.strip()
+    return variables
+
+
+def get_demo_resources(demo_dir, overrides=None):
+    """
+    Returns the resources requested by a demo. Resources are declared in the
+    origami environment file of the bundle with the keys below, the same
+    resources provided as deploy parameters take precedence.
+
+    * ORIGAMI_CPU_REQUEST / cpu_request: CPUs reserved for each replica.
+    * ORIGAMI_MEMORY_REQUEST / memory_request: Memory reserved for each
+        replica.
+    * ORIGAMI_CPU_LIMIT / cpu_limit: Maximum CPUs used by each replica.
+    * ORIGAMI_MEMORY_LIMIT / memory_limit: Maximum memory used by each
+        replica.
+    * ORIGAMI_CPUSET / cpuset: CPUs the replicas are allowed to run on, for
+        example 0-3 or 1,3.
+
+    Args:
+        demo_dir (str): Path to the extracted demo directory.
+        overrides (dict, None): Resources provided as deploy parameters.
+
+    Returns:
+        resources (dict): Resources of the demo, keys which are not declared
+            are set to None.
+
+    Raises:
+        InvalidDemoBundleException: The declared resources are not valid.
+    """
+    env = read_origami_env_file(os.path.join(demo_dir, ORIGAMI_ENV_FILE))
+    declared = {}
+    for key, env_key in ORIGAMI_ENV_RESOURCE_KEYS.items():
+        value = (overrides or {}).get(key) or env.get(env_key)
+        declared[key] = value if value not in ('', None) else None
+
+    resources = {
+        'cpu_request': None,
+        'memory_request': None,
+        'cpu_limit': None,
+        'memory_limit': None,
+        'cpuset': declared['cpuset'],
+    }
+    for key in ('cpu_request', 'cpu_limit'):
+        if declared[key] is not None:
+            resources[key] = parse_cpus(declared[key])
+    for key in ('memory_request', 'memory_limit'):
+        if declared[key] is not None:
+            resources[key] = parse_memory(declared[key])
+
+    if resources['cpuset'] and not re.match(r'^[0-9]+([,-][0-9]+)*$',
+                                            resources['cpuset']):
+        raise InvalidDemoBundleException('CPU set {} is not valid'.format(
+            resources['cpuset']))
+
+    for kind in ('cpu', 'memory'):
+        request = resources['{}_request'.format(kind)]
+        limit = resources['{}_limit'.format(kind)]
+        if request and limit and limit < request:
+            raise InvalidDemoBundleException(
+                'The {} limit must not be lower than the request'.format(kind))
+
+    return resources
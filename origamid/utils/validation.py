@@ -8,11 +8,16 @@ import logging
 import os
 import zipfile
 
+from .context import stage_bundle
+from .dockerfile import validate_dockerfile_contents
+from .manifest import hash_bundle, save_manifest, load_manifest, \
+    get_manifest_digest, merge_delta_bundle
 from .file import get_model_bundles_base_dir, extract_zip_to_dir, \
     clean_directory
 from ..exceptions import InvalidDemoBundleException, OrigamiConfigException
 from ..constants import REQUIREMENTS_FILE, ENTRYPOINT_PYTHON_MODULE, \
-    DOCKERFILE_FILE, ORIGAMI_ENV_FILE, BUNDLE_ZIP_MAX_COMPRESSED_SIZE, \
+    DOCKERFILE_FILE, DOCKERIGNORE_FILE, ORIGAMI_ENV_FILE, \
+    ORIGAMI_BUNDLE_ZIP, BUNDLE_ZIP_MAX_COMPRESSED_SIZE, \
     BUNDLE_ZIP_MAX_UNCOMPRESSED_SIZE
 
 
@@ -77,13 +82,31 @@ def validate_requirements_file(file_path):
 
 def validate_dockerfile(file_path):
     """
-    This is too expensive it is equivilant to creating an Image from the
-    dockerfile there is no option to lexically validate Dockerfile in docker-py
-    if they add such a feature implement this.
+    Validate the Dockerfile of a demo before its image is built, a broken
+    Dockerfile fails the deploy before the running demo is stopped. The
+    validation is static, see `dockerfile.validate_dockerfile_contents`,
+    and its warnings are logged.
 
-    There is no API endpoint for this as of v1.37 docker engine
+    Args:
+        file_path (str): Absolute path to the Dockerfile.
+
+    Returns:
+        warnings (list): Issues which do not fail the deploy.
+
+    Raises:
+        InvalidDemoBundleException: The Dockerfile is not valid.
     """
-    pass
+    try:
+        with open(file_path, 'r') as fp:
+            contents = fp.read()
+    except (IOError, UnicodeDecodeError) as e:
+        raise InvalidDemoBundleException(
+            'Dockerfile cannot be read : {}'.format(e))
+
+    warnings = validate_dockerfile_contents(contents)
+    for warning in warnings:
+        logging.warn(warning)
+    return warnings
 
 
 def validate_origami_env_file(file_path):
@@ -111,12 +134,52 @@ def validate_origami_env_file(file_path):
             raise InvalidDemoBundleException("origami env file is invalid")
 
 
+def get_demo_dir(demo_id):
+    """
+    Returns the directory of a demo, where its bundle is staged.
+
+    Raises:
+        OrigamiConfigException: An error while setting up origami daemon.
+    """
+    base_dir = get_model_bundles_base_dir()
+    if not base_dir:
+        raise OrigamiConfigException(
+            "Config directory does not have valid permissions")
+    return os.path.join(base_dir, demo_id)
+
+
+def _extract_demo_metadata(demo_dir):
+    """
+    Extract the metadata files at the root of the bundle staged in the demo
+    directory and validate them.
+    """
+    metadata = [
+        DOCKERFILE_FILE, DOCKERIGNORE_FILE, REQUIREMENTS_FILE, ORIGAMI_ENV_FILE
+    ]
+    for name in metadata:
+        if os.path.exists(os.path.join(demo_dir, name)):
+            os.remove(os.path.join(demo_dir, name))
+    extract_zip_to_dir(
+        os.path.join(demo_dir, ORIGAMI_BUNDLE_ZIP), demo_dir, metadata)
+
+    # Validate the required files for the demo bundle
+    # main.py Dockerfile requirements.txt .origami
+    validate_requirements_file(os.path.join(demo_dir, REQUIREMENTS_FILE))
+    validate_dockerfile(os.path.join(demo_dir, DOCKERFILE_FILE))
+    validate_origami_env_file(os.path.join(demo_dir, ORIGAMI_ENV_FILE))
+
+
 def preprocess_demo_bundle_zip(bundle_path, demo_id):
     """
     This function preprocesses the demo bundle zip. It takes the path to
     zip and demo_id of the demo and validates the required files for
     the demo.
 
+    Only the metadata files at the root of the bundle are extracted, the
+    bundle itself is kept in the demo directory and the build context is
+    streamed from it when the image of the demo is built. The manifest of
+    the bundle is saved for delta deploys.
+
     Args:
         bundle_path (str): Path to demo bundle zip
         demo_id (str): Unique demo ID for the given demo.
@@ -127,20 +190,55 @@ def preprocess_demo_bundle_zip(bundle_path, demo_id):
     Raises:
         OrigamiConfigException: An error while setting up origami daemon.
     """
-    base_dir = get_model_bundles_base_dir()
-    if not base_dir:
-        raise OrigamiConfigException(
-            "Config directory does not have valid permissions")
-
-    demo_dir = os.path.join(base_dir, demo_id)
+    demo_dir = get_demo_dir(demo_id)
     clean_directory(demo_dir)
-    extract_zip_to_dir(bundle_path, demo_dir)
+    os.makedirs(demo_dir)
+    stage_bundle(bundle_path, demo_dir)
+    _extract_demo_metadata(demo_dir)
+    save_manifest(demo_dir, hash_bundle(bundle_path))
 
-    # Validate the required files for the demo bundle
-    # main.py Dockerfile requirements.txt .origami
-    validate_requirements_file(os.path.join(demo_dir, REQUIREMENTS_FILE))
-    validate_dockerfile(os.path.join(demo_dir, DOCKERFILE_FILE))
-    validate_origami_env_file(os.path.join(demo_dir, ORIGAMI_ENV_FILE))
+    return demo_dir
+
+
+def preprocess_delta_bundle_zip(delta_path, demo_id, deleted=(),
+                                base_digest=None):
+    """
+    Counterpart of `preprocess_demo_bundle_zip` for delta deploys. The
+    bundle staged for the demo is patched with the changed files of the
+    delta zip and the deleted paths, the patched bundle must still be a
+    valid demo bundle.
+
+    Args:
+        delta_path (str): Path to the zip of the changed files.
+        demo_id (str): Unique demo ID for the given demo.
+        deleted (list): Paths of the files removed from the bundle.
+        base_digest (str, None): Digest of the manifest the delta was made
+            against, the delta is refused if the staged bundle changed
+            since.
+
+    Returns:
+        demo_dir (str): Path to the demo directory on the disk.
+
+    Raises:
+        InvalidDemoBundleException: The delta or the patched bundle is not
+            valid.
+        OrigamiConfigException: An error while setting up origami daemon.
+    """
+    if not check_if_zip_ok(delta_path):
+        raise InvalidDemoBundleException("Delta bundle path is not valid")
+
+    demo_dir = get_demo_dir(demo_id)
+    files = load_manifest(demo_dir)
+    if files is None:
+        raise InvalidDemoBundleException(
+            'No bundle to patch, deploy the full bundle first')
+    if base_digest and base_digest != get_manifest_digest(files):
+        raise InvalidDemoBundleException(
+            'The bundle of the demo changed since the manifest was fetched')
+
+    merge_delta_bundle(demo_dir, delta_path, deleted,
+                       validate=validate_demo_bundle_zip)
+    _extract_demo_metadata(demo_dir)
 
     return demo_dir
 
@@ -0,0 +1,27 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from origamid.constants import ORIGAMI_DB_NAME
+from origamid.database import db, bootstrap_db
+
+
+class DatabaseTestCase(unittest.TestCase):
+    """
+    Test case running against a new database in a temporary directory, the
+    database of the daemon in $HOME/.origami is never touched. Mix it in
+    first with other test cases, for example tornado's AsyncHTTPTestCase.
+    """
+
+    def setUp(self):
+        super(DatabaseTestCase, self).setUp()
+        self.db_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.db_dir, ORIGAMI_DB_NAME)
+        db.init(self.db_path)
+        bootstrap_db()
+
+    def tearDown(self):
+        db.close()
+        shutil.rmtree(self.db_dir)
+        super(DatabaseTestCase, self).tearDown()
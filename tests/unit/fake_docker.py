@@ -0,0 +1,250 @@
+import hashlib
+import json
+import os
+import re
+import socketserver
+import tempfile
+import threading
+import uuid
+
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import parse_qs, urlparse
+
+
+class FakeDockerHandler(BaseHTTPRequestHandler):
+    """
+    Answers the docker engine API routes used by origamid from the state of
+    the `FakeDockerDaemon` serving the request.
+    """
+
+    def _reply(self, status, body):
+        if isinstance(body, str):
+            data, content_type = body.encode(), 'text/plain'
+        else:
+            data, content_type = json.dumps(body).encode(), 'application/json'
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        daemon = self.server.daemon
+        path = re.sub(r'^/v[0-9.]+', '', self.path.split('?')[0])
+        daemon.requests.append(('GET', path))
+        if path == '/info':
+            return self._reply(200, daemon.info)
+        if path == '/version':
+            return self._reply(200, {'ApiVersion': '1.35'})
+        if path == '/_ping':
+            return self._reply(200, 'OK')
+        if path == '/system/df':
+            return self._reply(200, {
+                'LayersSize': sum(daemon.image_sizes.get(i, 0)
+                                  for i in daemon.images),
+                'BuildCache': [{'Size': daemon.build_cache}]
+            })
+        if path == '/containers/json':
+            query = parse_qs(urlparse(self.path).query)
+            filters = json.loads(query.get('filters', ['{}'])[0])
+            return self._reply(200, [
+                c for c in daemon.containers if _matches(c, filters)
+            ])
+        match = re.match(r'^/containers/([^/]+)/json$', path)
+        if match:
+            for container in daemon.containers:
+                if container['Id'] == match.group(1):
+                    return self._reply(200, container)
+        match = re.match(r'^/images/([^/]+)/json$', path)
+        if match and match.group(1) in daemon.images:
+            return self._reply(200, {
+                'Id': match.group(1),
+                'Size': daemon.image_sizes.get(match.group(1), 0)
+            })
+        return self._reply(404, {'message': 'Not found'})
+
+    def _read_body(self):
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            body = b''
+            while True:
+                size = int(self.rfile.readline().split(b';')[0], 16)
+                body += self.rfile.read(size)
+                self.rfile.readline()
+                if not size:
+                    return body
+        return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+    def _stream(self, entries):
+        # Chunked response with one JSON entry per chunk, as the build route.
+        self.protocol_version = 'HTTP/1.1'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        for entry in entries:
+            data = json.dumps(entry).encode() + b'\r\n'
+            self.wfile.write('{:x}\r\n'.format(len(data)).encode())
+            self.wfile.write(data + b'\r\n')
+        self.wfile.write(b'0\r\n\r\n')
+
+    def do_POST(self):
+        daemon = self.server.daemon
+        path = re.sub(r'^/v[0-9.]+', '', self.path.split('?')[0])
+        daemon.requests.append(('POST', path))
+        body = self._read_body()
+        if path == '/build' and daemon.build_error:
+            return self._stream([
+                {'stream': 'Step 1/1 : FROM python:3.6'},
+                {'errorDetail': {'message': daemon.build_error},
+                 'error': daemon.build_error},
+            ])
+        if path == '/build':
+            image_id = hashlib.sha256(body).hexdigest()
+            query = parse_qs(urlparse(self.path).query)
+            daemon.images.append(image_id)
+            daemon.image_labels[image_id] = json.loads(
+                query.get('labels', ['{}'])[0])
+            return self._stream([
+                {'stream': 'Step 1/1 : FROM python:3.6'},
+                {'aux': {'ID': 'sha256:' + image_id}},
+                {'stream': 'Successfully built {}\n'.format(image_id[:12])},
+            ])
+        if path == '/containers/create':
+            config = json.loads(body.decode())
+            query = parse_qs(urlparse(self.path).query)
+            container = {
+                'Id': uuid.uuid4().hex,
+                'Names': ['/' + query.get('name', [''])[0]],
+                'Image': config['Image'],
+                'Labels': config.get('Labels') or {},
+                'HostConfig': config.get('HostConfig') or {},
+                'State': 'created'
+            }
+            daemon.containers.append(container)
+            return self._reply(201, {'Id': container['Id']})
+        if path == '/images/prune':
+            # The images are never tagged, every image which no container
+            # uses is dangling.
+            query = parse_qs(urlparse(self.path).query)
+            filters = json.loads(query.get('filters', ['{}'])[0])
+            used = set(c['Image'] for c in daemon.containers)
+            pruned = [
+                i for i in daemon.images if i not in used
+                if _matches_labels(daemon.image_labels.get(i), filters)
+            ]
+            daemon.images = [i for i in daemon.images if i not in pruned]
+            return self._reply(200, {
+                'ImagesDeleted': [{'Deleted': i} for i in pruned] or None,
+                'SpaceReclaimed': sum(daemon.image_sizes.get(i, 0)
+                                      for i in pruned)
+            })
+        if path == '/build/prune':
+            reclaimed, daemon.build_cache = daemon.build_cache, 0
+            return self._reply(200, {'SpaceReclaimed': reclaimed})
+        match = re.match(r'^/containers/([^/]+)/(start|stop)$', path)
+        if match:
+            for container in daemon.containers:
+                if container['Id'] == match.group(1):
+                    container['State'] = 'running' \
+                        if match.group(2) == 'start' else 'exited'
+            self.send_response(204)
+            self.end_headers()
+            return
+        return self._reply(404, {'message': 'Not found'})
+
+    def do_DELETE(self):
+        daemon = self.server.daemon
+        path = re.sub(r'^/v[0-9.]+', '', self.path.split('?')[0])
+        daemon.requests.append(('DELETE', path))
+        match = re.match(r'^/containers/([^/]+)$', path)
+        if match:
+            daemon.containers = [
+                c for c in daemon.containers if c['Id'] != match.group(1)
+            ]
+            self.send_response(204)
+            self.end_headers()
+            return
+        match = re.match(r'^/images/([^/]+)$', path)
+        if match and match.group(1) in daemon.images:
+            image_id = match.group(1)
+            if any(c['Image'] == image_id for c in daemon.containers):
+                return self._reply(409, {
+                    'message': 'image is being used by a container'})
+            daemon.images.remove(image_id)
+            return self._reply(200, [{'Deleted': image_id}])
+        return self._reply(404, {'message': 'Not found'})
+
+    def log_message(self, *args):
+        pass
+
+
+def _matches(container, filters):
+    """
+    Whether a container matches the id and label filters of a list request.
+    """
+    if 'id' in filters and not any(
+            container['Id'].startswith(i) for i in filters['id']):
+        return False
+    return _matches_labels(container.get('Labels'), filters)
+
+
+def _matches_labels(labels, filters):
+    """
+    Whether labels match the label and label! filters of a request.
+    """
+    labels = labels or {}
+
+    def has(label):
+        key, _, value = label.partition('=')
+        return key in labels and (not value or labels[key] == value)
+
+    return all(has(label) for label in filters.get('label', [])) and \
+        not any(has(label) for label in filters.get('label!', []))
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class FakeDockerDaemon(object):
+    """
+    Minimal docker engine listening on a local unix socket.
+
+    Attributes:
+        info: Response of the info route.
+        containers: List of containers in the docker API format.
+        images: IDs of the images of the engine, built images are added.
+        image_sizes: Sizes in bytes of the images keyed by ID, 0 if missing.
+        image_labels: Labels of the images keyed by ID.
+        build_error: Error the builds fail with, if set.
+        build_cache: Size in bytes of the build cache.
+        requests: List of (method, path) tuples of the served requests.
+    """
+
+    def __init__(self, info=None, containers=None):
+        self.info = info or {}
+        self.containers = containers or []
+        self.images = []
+        self.image_sizes = {}
+        self.image_labels = {}
+        self.build_error = None
+        self.build_cache = 0
+        self.requests = []
+        self._dir = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self._dir, 'docker.sock')
+        self.base_url = 'unix://' + self.socket_path
+        self._server = _UnixServer(self.socket_path, FakeDockerHandler)
+        self._server.daemon = self
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        os.remove(self.socket_path)
+        os.rmdir(self._dir)
@@ -0,0 +1,53 @@
+import unittest
+from collections import namedtuple
+from unittest import mock
+
+from origamid.balancer import RoundRobinBalancer, LeastConnectionsBalancer
+
+Instance = namedtuple('Instance', ['container_id', 'replica'])
+
+
+class TestBalancer(unittest.TestCase):
+    def setUp(self):
+        self.instances = [Instance('c0', 0), Instance('c1', 1)]
+
+    def test_round_robin(self):
+        balancer = RoundRobinBalancer()
+        chosen = [
+            balancer.acquire('demo', self.instances).replica for _ in range(4)
+        ]
+        self.assertEqual(chosen, [0, 1, 0, 1])
+        self.assertIsNone(balancer.acquire('demo', []))
+
+    def test_least_connections(self):
+        balancer = LeastConnectionsBalancer()
+        self.assertEqual(balancer.acquire('demo', self.instances).replica, 0)
+        self.assertEqual(balancer.acquire('demo', self.instances).replica, 1)
+        balancer.release('demo', 'c1')
+        self.assertEqual(balancer.acquire('demo', self.instances).replica, 1)
+        self.assertEqual(balancer.connections('demo', 'c0'), 1)
+        # Leases are kept per demo.
+        self.assertFalse(balancer.release('other', 'c0'))
+        self.assertEqual(balancer.connections('demo', 'c0'), 1)
+
+    def test_leases_expire(self):
+        balancer = LeastConnectionsBalancer(lease_timeout=60)
+        with mock.patch('origamid.balancer.time.time', return_value=1000):
+            balancer.acquire('demo', self.instances)
+            balancer.acquire('demo', self.instances)
+        with mock.patch('origamid.balancer.time.time', return_value=1030):
+            self.assertEqual(
+                balancer.acquire('demo', self.instances).replica, 0)
+        # The leases which were never released expired.
+        with mock.patch('origamid.balancer.time.time', return_value=1070):
+            self.assertEqual(balancer.connections('demo', 'c0'), 1)
+            self.assertEqual(balancer.connections('demo', 'c1'), 0)
+
+    def test_replaced_instances_are_pruned(self):
+        balancer = LeastConnectionsBalancer()
+        balancer.acquire('demo', self.instances)
+        # A redeploy switched the demo to new containers.
+        instances = [Instance('c2', 0), Instance('c3', 1)]
+        self.assertEqual(balancer.acquire('demo', instances).replica, 0)
+        self.assertEqual(balancer.connections('demo', 'c0'), 0)
+        self.assertFalse(balancer.release('demo', 'c0'))
@@ -0,0 +1,59 @@
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+
+from origamid.bench import make_bundle, parse_mix, summarize_samples, \
+    compare_results
+from origamid.constants import DOCKERFILE_FILE
+from origamid.utils.dockerfile import validate_dockerfile_contents
+
+
+class TestBench(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_make_bundle(self):
+        path = os.path.join(self.dir, 'bench0000.zip')
+        make_bundle(path, 4096)
+        self.assertGreater(os.path.getsize(path), 4096)
+        with zipfile.ZipFile(path) as bundle:
+            dockerfile = bundle.read(DOCKERFILE_FILE).decode('utf-8')
+        self.assertEqual(validate_dockerfile_contents(dockerfile), [])
+
+    def test_parse_mix(self):
+        self.assertEqual(parse_mix('deploy=1, status=2.5,logs'), {
+            'deploy': 1.0,
+            'status': 2.5,
+            'logs': 1.0
+        })
+        for mix in ('build=1', 'status=-1', 'status=0'):
+            with self.assertRaises(ValueError):
+                parse_mix(mix)
+
+    def test_compare_results(self):
+        baseline = summarize_samples(
+            [('status', 200, 0.01)] * 99 + [('deploy', 200, 0.5)], 1.0)
+        self.assertEqual(baseline['operations']['status']['count'], 99)
+        self.assertEqual(baseline['total']['latency']['p99'], 10.0)
+
+        # Half the throughput, the deploys are failing and slower.
+        results = summarize_samples(
+            [('status', 200, 0.01)] * 45 + [('deploy', 503, 1.0)] * 5, 1.0)
+        self.assertEqual(results['operations']['deploy']['error_rate'], 1.0)
+        self.assertEqual(results['total']['codes'], {'200': 45, '503': 5})
+
+        regressed = [(row['operation'], row['metric'])
+                     for row in compare_results(baseline, results)
+                     if row['regressed']]
+        self.assertEqual(regressed, [
+            ('total', 'throughput'), ('total', 'p95'),
+            ('total', 'error_rate'), ('deploy', 'p95'),
+            ('deploy', 'error_rate'), ('status', 'throughput')
+        ])
+        self.assertFalse(any(
+            row['regressed'] for row in compare_results(baseline, baseline)))
@@ -0,0 +1,146 @@
+import os
+
+from unittest import mock
+
+from origamid import tasks
+from origamid.bulk import BULK_DEPLOY, BULK_REMOVE, create_bulk_job, \
+    get_bulk_job_status
+from origamid.constants import TASK_BACKEND_ENV, TASK_BACKEND_CELERY, \
+    TASK_BACKEND_LOCAL
+from origamid.database import BulkJobItems, Demos, Nodes, Operations
+from origamid.exceptions import InvalidDemoBundleException
+
+from .db_case import DatabaseTestCase
+
+
+class TestBulkJobs(DatabaseTestCase):
+    def setUp(self):
+        super(TestBulkJobs, self).setUp()
+
+        self.job = create_bulk_job(BULK_DEPLOY, [{
+            'demo_id': 'demo-a',
+            'bundle_path': '/demos/a.zip'
+        }, {
+            'demo_id': 'demo-b',
+            'bundle_path': '/demos/b.zip',
+            'replicas': 2
+        }])
+
+    def set_status(self, demo_id, status, message=None):
+        BulkJobItems.update(status=status, message=message).where(
+            BulkJobItems.job == self.job,
+            BulkJobItems.demo_id == demo_id).execute()
+
+    def test_job_status(self):
+        status = get_bulk_job_status(self.job)
+        self.assertEqual((status['status'], status['total']), ('pending', 2))
+
+        self.set_status('demo-a', 'succeeded')
+        self.assertEqual(get_bulk_job_status(self.job)['status'], 'running')
+
+        self.set_status('demo-b', 'failed', 'Invalid bundle')
+        status = get_bulk_job_status(self.job)
+        self.assertEqual(status['status'], 'finished')
+        self.assertEqual(status['counts']['succeeded'], 1)
+        self.assertEqual(status['items'][1], {
+            'demo_id': 'demo-b',
+            'status': 'failed',
+            'message': 'Invalid bundle'
+        })
+
+
+class TestBulkDeploy(DatabaseTestCase):
+    def setUp(self):
+        super(TestBulkDeploy, self).setUp()
+        job = create_bulk_job(BULK_DEPLOY, [{
+            'demo_id': 'demo-a',
+            'bundle_path': '/demos/a.zip',
+            'replicas': 2
+        }])
+        self.item = job.items.get()
+
+        self.resources = {'cpu_request': 1.0}
+        for name, value in [
+            ('validate_demo_bundle_zip', None),
+            ('preprocess_demo_bundle_zip', '/demos/demo-a'),
+            ('get_demo_resources', self.resources),
+            ('get_readiness_probe', None),
+            ('place_demo', Nodes(name='gpu-1', queue='gpu-1')),
+        ]:
+            patcher = mock.patch('origamid.tasks.' + name,
+                                 return_value=value)
+            setattr(self, name, patcher.start())
+            self.addCleanup(patcher.stop)
+
+    def run_item(self, backend, error=None):
+        with mock.patch.dict(os.environ, {TASK_BACKEND_ENV: backend}), \
+                mock.patch('origamid.tasks.deploy_demo',
+                           return_value=error) as deploy_demo, \
+                mock.patch.object(tasks.bulk_deploy_demo,
+                                  'replace') as replace:
+            tasks.bulk_deploy_demo(self.item.id)
+        return deploy_demo, replace
+
+    def get_item(self):
+        item = BulkJobItems.get(BulkJobItems.id == self.item.id)
+        return item.status, item.message
+
+    def test_deploy_is_sent_to_the_node_queue(self):
+        deploy_demo, replace = self.run_item(TASK_BACKEND_CELERY)
+        deploy_demo.assert_not_called()
+        self.assertEqual(self.get_item(), ('running', None))
+
+        operation = Operations.get()
+        self.assertEqual((operation.node, operation.queue),
+                         ('gpu-1', 'gpu-1'))
+        signature, = replace.call_args[0]
+        self.assertEqual(signature.task, tasks.bulk_deploy_placed_demo.name)
+        self.assertEqual(signature.options['queue'], 'gpu-1')
+        self.assertEqual(signature.args,
+                         (self.item.id, '/demos/demo-a', 'gpu-1',
+                          self.resources, operation.operation_id))
+
+        # The worker of the node runs the deploy and records its outcome.
+        with mock.patch('origamid.tasks.deploy_demo',
+                        return_value=None) as deploy_demo:
+            signature()
+        deploy_demo.assert_called_once_with(
+            'demo-a', '/demos/demo-a', 2, 'gpu-1', self.resources,
+            operation.operation_id)
+        self.assertEqual(self.get_item(), ('succeeded', None))
+
+    def test_local_backend_deploys_in_place(self):
+        deploy_demo, replace = self.run_item(TASK_BACKEND_LOCAL,
+                                             error='Build failed')
+        replace.assert_not_called()
+        self.assertEqual(deploy_demo.call_count, 1)
+        self.assertEqual(self.get_item(), ('failed', 'Build failed'))
+
+    def test_invalid_bundle_is_not_deployed(self):
+        self.validate_demo_bundle_zip.side_effect = \
+            InvalidDemoBundleException('No Dockerfile')
+        deploy_demo, replace = self.run_item(TASK_BACKEND_CELERY)
+        replace.assert_not_called()
+        deploy_demo.assert_not_called()
+        status, message = self.get_item()
+        self.assertEqual(status, 'failed')
+        self.assertIn('No Dockerfile', message)
+        self.assertEqual(Operations.select().count(), 0)
+
+
+class TestBulkRemove(DatabaseTestCase):
+    def test_removals_are_tracked(self):
+        # Neither demo has containers, the removals find nothing.
+        Demos.create(demo_id='demo-a', log_id='demo-a', status='empty',
+                     node='node-a')
+        job = create_bulk_job(BULK_REMOVE, [{'demo_id': 'demo-a'},
+                                            {'demo_id': 'demo-b'}])
+        for item in job.items:
+            tasks.bulk_remove_demo(item.id)
+
+        self.assertEqual(
+            [(o.kind, o.demo_id, o.node, o.queue, o.status)
+             for o in Operations.select().order_by(Operations.demo_id)],
+            [('remove', 'demo-a', 'node-a', 'celery', 'failed'),
+             ('remove', 'demo-b', None, 'celery', 'failed')])
+        self.assertEqual(get_bulk_job_status(job)['counts']['succeeded'], 2)
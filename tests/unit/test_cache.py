@@ -0,0 +1,46 @@
+import sqlite3
+import uuid
+
+from origamid.cache import DemoCache
+from origamid.database import Demos
+
+from .db_case import DatabaseTestCase
+
+
+class TestDemoCache(DatabaseTestCase):
+    def setUp(self):
+        super(TestDemoCache, self).setUp()
+
+        self.demos = [
+            Demos.create(
+                demo_id=uuid.uuid4().hex,
+                log_id=uuid.uuid4().hex,
+                status='ready') for _ in range(3)
+        ]
+        self.cache = DemoCache(max_size=2, ttl=60)
+
+    def test_read_through(self):
+        demo_id = self.demos[0].demo_id
+        self.assertEqual(self.cache.get(demo_id).status, 'ready')
+        self.assertIs(self.cache.get(demo_id), self.cache.get(demo_id))
+        self.assertEqual((self.cache.hits, self.cache.misses), (2, 1))
+        self.assertIsNone(self.cache.get('does-not-exist'))
+
+    def test_lru_eviction(self):
+        for demo in self.demos:
+            self.cache.get(demo.demo_id)
+        self.assertEqual(self.cache.stats()['size'], 2)
+        self.cache.get(self.demos[0].demo_id)
+        self.assertEqual(self.cache.misses, 4)
+
+    def test_write_from_another_process(self):
+        demo_id = self.demos[0].demo_id
+        self.cache.get(demo_id)
+
+        connection = sqlite3.connect(self.db_path)
+        connection.execute('UPDATE demos SET status = ? WHERE demo_id = ?',
+                           ('redeploying', demo_id))
+        connection.commit()
+        connection.close()
+
+        self.assertEqual(self.cache.get(demo_id).status, 'redeploying')
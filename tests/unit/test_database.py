@@ -1 +1,26 @@
-# TODO: write tests
+import datetime
+
+from origamid.database import PortReservations, get_free_ports, \
+    reserve_ports, release_ports
+
+from .db_case import DatabaseTestCase
+
+
+class TestPortReservations(DatabaseTestCase):
+    def test_concurrent_deploys_get_different_ports(self):
+        first = reserve_ports(2, 'demo-a')
+        second = reserve_ports(2, 'demo-b')
+        self.assertEqual(first, [20001, 20002])
+        self.assertEqual(second, [20003, 20004])
+        self.assertEqual(get_free_ports(1), [20005])
+
+        release_ports(first)
+        self.assertEqual(reserve_ports(1, 'demo-c'), [20001])
+
+    def test_expired_reservations_are_ignored(self):
+        reserve_ports(1, 'demo-a')
+        PortReservations.update(
+            timestamp=datetime.datetime(2018, 1, 1)).execute()
+        self.assertEqual(reserve_ports(1, 'demo-b'), [20001])
+        self.assertEqual(
+            [r.demo_id for r in PortReservations.select()], ['demo-b'])
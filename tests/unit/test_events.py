@@ -0,0 +1,81 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from origamid import events
+from origamid.streaming import EventBroker, LogSubscriber
+
+
+class TestEvents(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'events.sock')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_publish_and_read(self):
+        sock = events.bind_events_socket(self.path)
+        original_path = events.events_socket_path
+        events.events_socket_path = self.path
+        try:
+            self.assertTrue(
+                events.publish_event('status', demo_id='a', status='ready'))
+            time.sleep(0.05)
+            received = events.read_events(sock)
+            self.assertEqual(events.read_events(sock), [])
+        finally:
+            events.events_socket_path = original_path
+            sock.close()
+
+        self.assertEqual(len(received), 1)
+        self.assertEqual((received[0]['type'], received[0]['status']),
+                         ('status', 'ready'))
+
+    def test_publish_without_server(self):
+        original_path = events.events_socket_path
+        events.events_socket_path = self.path
+        try:
+            self.assertFalse(events.publish_event('status', demo_id='a'))
+        finally:
+            events.events_socket_path = original_path
+
+    def test_broker_transitions(self):
+        broker = EventBroker()
+        broker.statuses = {'a': 'ready', 'b': 'ready'}
+        subscriber = broker.subscribe(['a'])
+
+        broker.dispatch({'type': 'status', 'demo_id': 'a', 'status': 'ready'})
+        broker.dispatch({'type': 'status', 'demo_id': 'b', 'status': 'error'})
+        self.assertEqual(subscriber.queue.qsize(), 0)
+
+        broker.dispatch({'type': 'status', 'demo_id': 'a', 'status': 'error'})
+        event = subscriber.queue.get_nowait()
+        self.assertEqual((event['from'], event['to']), ('ready', 'error'))
+        self.assertEqual([e['to'] for e in broker.snapshot(['a', 'b'])],
+                         ['error', 'error'])
+
+    def test_log_subscriber_drops_old_lines(self):
+        broker = EventBroker()
+        subscriber = broker.subscribe(subscriber=LogSubscriber('a', 3))
+
+        broker.dispatch({'type': 'log', 'demo_id': 'b', 'seq': 0,
+                         'lines': ['x']})
+        self.assertFalse(subscriber.ready.is_set())
+
+        broker.dispatch({'type': 'log', 'demo_id': 'a', 'seq': 0,
+                         'lines': ['1', '2', '3', '4']})
+        # Lines 5 and 6 were lost on the way to the API server.
+        broker.dispatch({'type': 'log', 'demo_id': 'a', 'seq': 6,
+                         'lines': ['7']})
+        self.assertEqual(subscriber.take(), {
+            'lines': ['3', '4', '7'],
+            'dropped': 4
+        })
+
+        broker.dispatch({'type': 'log_end', 'demo_id': 'a', 'seq': 7,
+                         'status': 'succeeded'})
+        self.assertTrue(subscriber.ready.is_set())
+        self.assertEqual(subscriber.end['status'], 'succeeded')
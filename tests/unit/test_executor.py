@@ -0,0 +1,59 @@
+import json
+
+from origamid.celery import app
+from origamid.database import Jobs
+from origamid.executor import LocalExecutor, enqueue_job, run_job
+
+from .db_case import DatabaseTestCase
+
+
+class FakePool(object):
+    def __init__(self):
+        self.started = []
+
+    def apply_async(self, func, args, callback=None, error_callback=None):
+        self.started.append(args[0])
+
+
+class TestLocalExecutor(DatabaseTestCase):
+    def setUp(self):
+        super(TestLocalExecutor, self).setUp()
+
+        self.executor = LocalExecutor(processes=2)
+        self.executor.pool = FakePool()
+
+    def test_enqueue_job(self):
+        job = enqueue_job('origamid.tasks.ping', (1.5, '/tmp/reply'),
+                          queue='celery')
+        job = Jobs.get_by_id(job.id)
+        self.assertEqual(job.status, 'pending')
+        self.assertEqual(json.loads(job.args), [1.5, '/tmp/reply'])
+
+    def test_jobs_wait_for_previous_job(self):
+        first = enqueue_job('origamid.tasks.ping')
+        second = enqueue_job('origamid.tasks.ping', after=first)
+        third = enqueue_job('origamid.tasks.ping')
+
+        self.executor.poll()
+        self.assertEqual(self.executor.pool.started,
+                         [first.job_id, third.job_id])
+        self.assertEqual(Jobs.get_by_id(first.id).status, 'running')
+
+        self.executor._finish(first.job_id, 'Docker is down')
+        self.assertEqual(self.executor.pool.started[-1], second.job_id)
+        first = Jobs.get_by_id(first.id)
+        self.assertEqual((first.status, first.error),
+                         ('failed', 'Docker is down'))
+
+    def test_run_job(self):
+        job = enqueue_job('origamid.tasks.garbage_collect_images',
+                          ('not-registered', ))
+        self.assertEqual(run_job(job.job_id), {})
+
+    def test_schedule_periodic_task(self):
+        entry = app.conf.beat_schedule['reconcile-demos']
+        job = self.executor.schedule(entry)
+        self.assertEqual(job.task, 'origamid.tasks.reconcile_demos')
+        self.assertEqual(job.queue, 'celery')
+        # The previous run is still queued.
+        self.assertIsNone(self.executor.schedule(entry))
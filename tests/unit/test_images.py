@@ -0,0 +1,94 @@
+import datetime
+
+from origamid.constants import ORIGAMI_LABEL_DEMO_ID
+from origamid.database import Demos, DemoImages, Nodes
+from origamid.images import collect_images
+from origamid.resilience import call_counts
+
+from .db_case import DatabaseTestCase
+from .fake_docker import FakeDockerDaemon
+
+
+class TestCollectImages(DatabaseTestCase):
+    def setUp(self):
+        super(TestCollectImages, self).setUp()
+        self.daemon = FakeDockerDaemon().start()
+        self.node = Nodes.create(name='node-a', base_url=self.daemon.base_url)
+
+        # a4 is the current image of the demo, a0 the least recently used.
+        demo = Demos.create(demo_id='ffc806', log_id='ffc806',
+                            status='ready', image_id='sha256:a4',
+                            node='node-a')
+        start = datetime.datetime(2018, 1, 1)
+        for i in range(5):
+            image_id = 'sha256:a{}'.format(i)
+            DemoImages.create(demo=demo, image_id=image_id, node='node-a',
+                              last_used=start + datetime.timedelta(hours=i))
+            self.daemon.images.append(image_id)
+            self.daemon.image_sizes[image_id] = 100
+            self.daemon.image_labels[image_id] = {
+                ORIGAMI_LABEL_DEMO_ID: 'ffc806'
+            }
+        # Intermediate image of a build, unlabelled and dangling.
+        self.daemon.images.append('sha256:d0')
+        self.daemon.image_sizes['sha256:d0'] = 10
+        # Images on other nodes are collected with their node.
+        DemoImages.create(demo=demo, image_id='sha256:b0', node='node-b',
+                          last_used=start)
+        self.daemon.build_cache = 50
+
+    def tearDown(self):
+        self.daemon.stop()
+        super(TestCollectImages, self).tearDown()
+
+    def get_images(self):
+        return sorted(i.image_id for i in DemoImages.select())
+
+    def test_previous_images_are_retained(self):
+        # The expired image a0 is still used by a container. The retained
+        # images are dangling as well, only d0 is pruned.
+        self.daemon.containers.append({'Id': 'c1', 'Image': 'sha256:a0'})
+        refused = call_counts[('node-a', 'remove', 'error')]
+
+        collection = collect_images(self.node)
+        self.assertEqual(
+            self.get_images(),
+            ['sha256:a0', 'sha256:a2', 'sha256:a3', 'sha256:a4', 'sha256:b0'])
+        self.assertEqual(self.daemon.images,
+                         ['sha256:a0', 'sha256:a2', 'sha256:a3', 'sha256:a4'])
+        self.assertEqual(
+            (collection.images_removed, collection.bytes_reclaimed,
+             collection.disk_usage), (1, 110, 450))
+        self.assertIn(('POST', '/images/prune'), self.daemon.requests)
+        self.assertNotIn(('POST', '/build/prune'), self.daemon.requests)
+        # The calls go through the circuit breaker of the node.
+        self.assertEqual(call_counts[('node-a', 'remove', 'error')],
+                         refused + 1)
+
+    def test_images_of_moved_demos_are_removed(self):
+        Demos.update(node='node-b', image_id='sha256:b0').execute()
+        collection = collect_images(self.node)
+        # The demo keeps its images on its new node only.
+        self.assertEqual(self.get_images(), ['sha256:b0'])
+        self.assertEqual(self.daemon.images, [])
+        self.assertEqual(collection.images_removed, 5)
+
+    def test_retained_images_are_removed_above_budget(self):
+        collection = collect_images(self.node, budget=300)
+        # The least recently used retained image is enough.
+        self.assertEqual(self.get_images(),
+                         ['sha256:a3', 'sha256:a4', 'sha256:b0'])
+        self.assertEqual(
+            (collection.images_removed, collection.bytes_reclaimed,
+             collection.disk_usage), (3, 310, 250))
+        self.assertNotIn(('POST', '/build/prune'), self.daemon.requests)
+
+    def test_build_cache_is_pruned_above_budget(self):
+        collection = collect_images(self.node, budget=100)
+        # The current image is kept even above the budget.
+        self.assertEqual(self.get_images(), ['sha256:a4', 'sha256:b0'])
+        self.assertEqual(self.daemon.images, ['sha256:a4'])
+        self.assertIn(('POST', '/build/prune'), self.daemon.requests)
+        self.assertEqual(
+            (collection.images_removed, collection.bytes_reclaimed,
+             collection.disk_usage), (4, 460, 100))
@@ -0,0 +1,46 @@
+import json
+import logging
+import unittest
+
+from origamid.logger import CustomConsoleFormatter, JsonFormatter, \
+    RateLimitFilter
+
+
+def make_record(msg, level=logging.INFO, lineno=10, **extra):
+    record = logging.LogRecord('root', level, 'tasks.py', lineno, msg, None,
+                               None)
+    record.__dict__.update(extra)
+    return record
+
+
+class TestLogger(unittest.TestCase):
+    def test_console_formatter_keeps_record(self):
+        record = make_record('Demo started')
+        formatted = CustomConsoleFormatter().format(record)
+        self.assertIn('[+] Demo started', formatted)
+        self.assertEqual(record.msg, 'Demo started')
+
+    def test_json_formatter(self):
+        record = make_record('Demo started', demo_id='ffc806')
+        entry = json.loads(JsonFormatter().format(record))
+        self.assertEqual(entry['message'], 'Demo started')
+        self.assertEqual(entry['level'], 'INFO')
+        self.assertEqual(entry['demo_id'], 'ffc806')
+
+    def test_rate_limit(self):
+        rate_limit = RateLimitFilter(rate=2, interval=60)
+        allowed = [
+            rate_limit.filter(make_record('Found free port'))
+            for _ in range(5)
+        ]
+        self.assertEqual(allowed, [True, True, False, False, False])
+        self.assertEqual(rate_limit.suppressed, 3)
+        # Other call sites and errors are not limited.
+        self.assertTrue(rate_limit.filter(make_record('Other', lineno=20)))
+        self.assertTrue(
+            rate_limit.filter(make_record('Failed', logging.ERROR)))
+
+        rate_limit.interval = 0
+        record = make_record('Found free port')
+        self.assertTrue(rate_limit.filter(record))
+        self.assertIn('3 similar messages suppressed', record.msg)
@@ -1,3 +1,6 @@
+import os
+import shutil
+import tempfile
 import unittest
 
 from click.testing import CliRunner
@@ -11,3 +14,11 @@ class TestMain(unittest.TestCase):
         result = runner.invoke(main)
         self.assertEqual(result.exit_code, 0)
         self.assertEqual(result.output, WELCOME_TEXT + '\n')
+
+    def test_no_log_file_is_written(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(directory)
+        CliRunner().invoke(main)
+        self.assertEqual(os.listdir(directory), [])
@@ -0,0 +1,67 @@
+import datetime
+import json
+
+from origamid.api import app
+from origamid.database import Operations
+from origamid.operations import OPERATION_DEPLOY, OPERATION_REMOVE, \
+    create_operation, get_operation_stats, track_operation
+
+from .db_case import DatabaseTestCase
+
+
+class TestOperations(DatabaseTestCase):
+    def test_track_operation(self):
+        operation = create_operation(OPERATION_DEPLOY, 'demo-a', 'local')
+        with track_operation(operation.operation_id) as tracker:
+            tracker.stage('building')
+            self.assertEqual(
+                Operations.get_by_id(operation.id).status, 'running')
+        operation = Operations.get_by_id(operation.id)
+        self.assertEqual((operation.status, operation.stage),
+                         ('succeeded', 'done'))
+        self.assertIsNotNone(operation.finished_at)
+
+        operation = create_operation(OPERATION_REMOVE, 'demo-a')
+        with self.assertRaises(ValueError):
+            with track_operation(operation.operation_id):
+                raise ValueError('Docker is down')
+        operation = Operations.get_by_id(operation.id)
+        self.assertEqual((operation.status, operation.message),
+                         ('failed', 'Docker is down'))
+
+    def test_stats(self):
+        now = datetime.datetime.now()
+        for latency in (1, 2, 3, 10):
+            operation = create_operation(
+                OPERATION_DEPLOY, 'demo-b',
+                enqueued_at=now - datetime.timedelta(seconds=60))
+            operation.status = 'succeeded'
+            operation.started_at = operation.enqueued_at + datetime.timedelta(
+                seconds=latency)
+            operation.finished_at = operation.started_at + \
+                datetime.timedelta(seconds=30)
+            operation.save()
+        create_operation(OPERATION_DEPLOY, 'demo-c')
+
+        stats = get_operation_stats(OPERATION_DEPLOY, window=600)
+        self.assertEqual(stats['counts']['succeeded'], 4)
+        self.assertEqual(stats['counts']['pending'], 1)
+        self.assertEqual(stats['queue_latency']['mean'], 4)
+        self.assertEqual(stats['queue_latency']['p50'], 2)
+        self.assertEqual(stats['queue_latency']['max'], 10)
+        self.assertEqual(stats['duration']['p95'], 30)
+        self.assertAlmostEqual(stats['throughput'], 0.4)
+        self.assertEqual(
+            get_operation_stats(OPERATION_REMOVE)['counts']['succeeded'], 0)
+        self.assertEqual(get_operation_stats(window=0)['throughput'], 0)
+
+    def test_stats_route_rejects_invalid_window(self):
+        client = app.test_client()
+        for window in (0, -60):
+            response = client.get(
+                '/operations/stats?window={}'.format(window))
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(json.loads(response.data.decode())['response'],
+                             'InvalidRequestParameters')
+        response = client.get('/operations/stats?window=60')
+        self.assertEqual(json.loads(response.data.decode())['window'], 60)
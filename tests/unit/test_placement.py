@@ -0,0 +1,89 @@
+from origamid.database import Nodes
+from origamid.exceptions import OrigamiDockerConnectionError, \
+    OrigamiCapacityException
+from origamid.operations import OPERATION_DEPLOY, create_operation
+from origamid.placement import choose_node, place_demo
+
+from .db_case import DatabaseTestCase
+from .fake_docker import FakeDockerDaemon
+
+GiB = 1024**3
+
+
+class TestPlacement(DatabaseTestCase):
+    def setUp(self):
+        super(TestPlacement, self).setUp()
+
+        self.daemons = [
+            FakeDockerDaemon(info={
+                'ContainersRunning': 4,
+                'NCPU': 16,
+                'MemTotal': 64 * GiB
+            }).start(),
+            FakeDockerDaemon(info={
+                'ContainersRunning': 1,
+                'NCPU': 4,
+                'MemTotal': 8 * GiB
+            }).start(),
+        ]
+        self.nodes = [
+            Nodes(name='node-{}'.format(i), base_url=d.base_url)
+            for i, d in enumerate(self.daemons)
+        ]
+
+    def tearDown(self):
+        for daemon in self.daemons:
+            daemon.stop()
+        super(TestPlacement, self).tearDown()
+
+    def test_least_loaded(self):
+        node = choose_node('least_loaded', nodes=self.nodes)
+        self.assertEqual(node.name, 'node-1')
+        for daemon in self.daemons:
+            self.assertIn(('GET', '/info'), daemon.requests)
+
+    def test_bin_pack(self):
+        small = {'cpu_request': 1, 'memory_request': 2 * GiB}
+        self.assertEqual(
+            choose_node('bin_pack', self.nodes, small, 2).name, 'node-1')
+
+        large = {'cpu_request': 2, 'memory_request': 6 * GiB}
+        self.assertEqual(
+            choose_node('bin_pack', self.nodes, large, 2).name, 'node-0')
+
+        with self.assertRaises(OrigamiCapacityException):
+            choose_node('bin_pack', self.nodes, large, 12)
+
+    def test_unreachable_nodes_are_skipped(self):
+        nodes = self.nodes[:1] + [
+            Nodes(name='down', base_url='unix:///nonexistent/docker.sock')
+        ]
+        self.assertEqual(choose_node(nodes=nodes).name, 'node-0')
+
+        with self.assertRaises(OrigamiDockerConnectionError):
+            choose_node(nodes=nodes[1:])
+
+    def test_placed_deploys_reserve_resources(self):
+        for node in self.nodes:
+            node.save()
+        resources = {'cpu_request': 2, 'memory_request': 6 * GiB}
+
+        # Two deploys placed before either of them is built.
+        first = place_demo('demo-a', policy='bin_pack', resources=resources)
+        operation = create_operation(OPERATION_DEPLOY, 'demo-a', first.name,
+                                     resources=resources, replicas=1)
+        second = place_demo('demo-b', policy='bin_pack', resources=resources)
+        self.assertEqual((first.name, second.name), ('node-1', 'node-0'))
+
+        with self.assertRaises(OrigamiCapacityException):
+            place_demo('demo-b', 'node-1', resources=resources)
+        # A redeploy of the demo does not count its own deploy.
+        self.assertEqual(
+            place_demo('demo-a', 'node-1', resources=resources).name,
+            'node-1')
+
+        operation.status = 'failed'
+        operation.save()
+        self.assertEqual(
+            place_demo('demo-b', 'node-1', resources=resources).name,
+            'node-1')
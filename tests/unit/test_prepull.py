@@ -0,0 +1,46 @@
+import threading
+
+from docker.errors import NotFound
+from unittest import mock
+
+from origamid.nodes import LOCAL_NODE
+from origamid.prepull import ImagePuller, get_prepull_stats, \
+    normalize_image, wait_for_base_images
+
+from .db_case import DatabaseTestCase
+
+
+class TestPrepull(DatabaseTestCase):
+    def test_normalize_image(self):
+        self.assertEqual(normalize_image('python'), 'python:latest')
+        self.assertEqual(normalize_image('localhost:5000/demo'),
+                         'localhost:5000/demo:latest')
+        self.assertEqual(normalize_image('python:3.6-slim'), 'python:3.6-slim')
+
+    def test_concurrent_pulls_are_deduplicated(self):
+        release = threading.Event()
+        pulls = []
+
+        def call_docker(node, endpoint, call):
+            if endpoint == 'inspect':
+                raise NotFound('No such image')
+            pulls.append(node.name)
+            release.wait(5)
+            return iter([{'status': 'Downloaded newer image'}])
+
+        puller = ImagePuller(workers=2)
+        with mock.patch('origamid.prepull.call_docker', call_docker):
+            first = puller.prefetch(LOCAL_NODE, ['python:3.6'])
+            second = puller.prefetch(LOCAL_NODE, ['python:3.6'])
+            release.set()
+            pull = first[0].result(5)
+
+        self.assertEqual(second, [])
+        self.assertEqual(pulls, ['local'])
+        self.assertEqual(pull.status, 'pulled')
+
+        outcomes = wait_for_base_images(LOCAL_NODE,
+                                        ['python:3.6', 'nginx:latest'])
+        self.assertEqual(outcomes, {'python:3.6': True, 'nginx:latest': False})
+        stats = get_prepull_stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
@@ -0,0 +1,52 @@
+import unittest
+
+from unittest import mock
+
+from origamid.ratelimit import RateLimiter, get_retry_after
+
+
+class TestRateLimiter(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch('origamid.ratelimit.time.monotonic',
+                             lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.limiter = RateLimiter(rate=2, burst=3, expensive_rate=0.1,
+                                   expensive_burst=1, max_buckets=2,
+                                   max_uploads=1)
+
+    def test_token_buckets(self):
+        route = '/demo/port/<demo_id>'
+        self.assertEqual(
+            [self.limiter.acquire('10.0.0.1', route) for _ in range(4)],
+            [0, 0, 0, 0.5])
+        # Other clients and routes have their own buckets.
+        self.assertEqual(self.limiter.acquire('10.0.0.2', route), 0)
+        self.assertEqual(self.limiter.acquire('10.0.0.1', '/health'), 0)
+
+        self.now += 0.5
+        self.assertEqual(self.limiter.acquire('10.0.0.1', route), 0)
+        self.assertEqual(self.limiter.acquire('10.0.0.1', route), 0.5)
+        self.assertEqual(self.limiter.limited, {route: 2})
+
+        self.limiter.enabled = False
+        self.assertEqual(self.limiter.acquire('10.0.0.1', route), 0)
+
+    def test_expensive_routes(self):
+        route = '/deploy_trigger/<demo_id>'
+        self.assertEqual(self.limiter.acquire('10.0.0.1', route), 0)
+        self.assertEqual(get_retry_after(
+            self.limiter.acquire('10.0.0.1', route)), 10)
+        # Least recently used buckets are dropped, they are full again.
+        self.limiter.acquire('10.0.0.2', route)
+        self.limiter.acquire('10.0.0.3', route)
+        self.assertEqual(self.limiter.acquire('10.0.0.1', route), 0)
+
+    def test_upload_concurrency(self):
+        self.assertTrue(self.limiter.enter_upload('10.0.0.1'))
+        self.assertFalse(self.limiter.enter_upload('10.0.0.1'))
+        self.assertTrue(self.limiter.enter_upload('10.0.0.2'))
+        self.limiter.exit_upload('10.0.0.1')
+        self.assertTrue(self.limiter.enter_upload('10.0.0.1'))
+        self.assertEqual(self.limiter.limited, {'/uploads': 1})
@@ -0,0 +1,86 @@
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+
+from origamid.exceptions import InvalidDemoBundleException
+from origamid.readiness import ReadinessProbe, get_readiness_probe, \
+    wait_for_port
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+
+class HealthHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.send_response(200 if self.path == '/health' else 503)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def get_free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+class TestReadiness(unittest.TestCase):
+    def setUp(self):
+        self.demo_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.demo_dir)
+
+    def write_env(self, content):
+        with open(os.path.join(self.demo_dir, 'origami.env'), 'w') as file:
+            file.write(content)
+
+    def test_get_readiness_probe(self):
+        probe = get_readiness_probe(self.demo_dir)
+        self.assertEqual((probe.kind, probe.path), ('tcp', '/'))
+
+        self.write_env('ORIGAMI_READINESS_PROBE=http\n'
+                       'ORIGAMI_READINESS_PATH=/health\n'
+                       'ORIGAMI_READINESS_TIMEOUT=30\n')
+        probe = get_readiness_probe(self.demo_dir)
+        self.assertEqual((probe.kind, probe.path, probe.timeout),
+                         ('http', '/health', 30))
+
+        self.write_env('ORIGAMI_READINESS_PROBE=grpc\n')
+        with self.assertRaises(InvalidDemoBundleException):
+            get_readiness_probe(self.demo_dir)
+
+    def test_http_probe_waits_for_the_demo(self):
+        port = get_free_port()
+        server = HTTPServer(('127.0.0.1', port), HealthHandler)
+        thread = threading.Timer(0.5, server.serve_forever)
+        thread.start()
+        try:
+            start = time.time()
+            self.assertTrue(
+                wait_for_port('127.0.0.1', port,
+                              ReadinessProbe('http', '/health', 10)))
+            self.assertGreater(time.time() - start, 0.4)
+            self.assertFalse(
+                wait_for_port('127.0.0.1', port,
+                              ReadinessProbe('http', '/', 0.5)))
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+
+    def test_tcp_probe_times_out(self):
+        start = time.time()
+        self.assertFalse(
+            wait_for_port('127.0.0.1', get_free_port(),
+                          ReadinessProbe('tcp', '/', 0.5)))
+        self.assertLess(time.time() - start, 2)
@@ -0,0 +1,158 @@
+import datetime
+
+from unittest import mock
+
+from origamid import tasks
+from origamid.cache import demo_cache
+from origamid.constants import ORIGAMI_LABEL_DEMO_ID
+from origamid.database import Demos, DemoInstances, Nodes, Operations
+from origamid.reconcile import get_container_labels, rebuild_node_state
+
+from .db_case import DatabaseTestCase
+from .fake_docker import FakeDockerDaemon
+
+
+def container(container_id, demo_id=None, state='running'):
+    labels = {ORIGAMI_LABEL_DEMO_ID: demo_id} if demo_id else {}
+    return {'Id': container_id, 'State': state, 'Labels': labels}
+
+
+class TestReconcile(DatabaseTestCase):
+    def setUp(self):
+        super(TestReconcile, self).setUp()
+
+        self.daemon = FakeDockerDaemon(containers=[
+            container('c1', 'ok'),
+            container('c3', 'stale'),
+            container('c4', 'deleted'),
+            container('c5', 'busy'),
+            # Run before the containers were labelled.
+            container('c6'),
+        ]).start()
+        self.node = Nodes.create(name='reconciled',
+                                 base_url=self.daemon.base_url)
+
+        def demo(demo_id, status, container_id=None):
+            demo = Demos.create(demo_id=demo_id, log_id=demo_id,
+                                status=status, container_id=container_id,
+                                node=self.node.name)
+            if container_id:
+                DemoInstances.create(demo=demo, container_id=container_id,
+                                     status=status)
+
+        demo('ok', 'ready', 'c1')
+        demo('gone', 'ready', 'c2')
+        demo('stale', 'redeploying', 'c3')
+        demo('busy', 'deploying')
+        demo('legacy', 'running', 'c6')
+
+        hours_ago = datetime.datetime.now() - datetime.timedelta(hours=3)
+        Operations.create(operation_id='interrupted', kind='deploy',
+                          demo_id='stale', status='running',
+                          enqueued_at=hours_ago, started_at=hours_ago)
+        Operations.create(operation_id='pending', kind='deploy',
+                          demo_id='busy')
+
+    def tearDown(self):
+        self.daemon.stop()
+        super(TestReconcile, self).tearDown()
+
+    def test_reconcile_demos(self):
+        report = tasks.reconcile_demos(self.node.name)[self.node.name]
+        self.assertEqual(sorted(report['demos']), ['gone', 'stale'])
+        self.assertEqual(report['instances'], 1)
+        self.assertEqual(report['operations'], 1)
+        self.assertEqual(report['orphans'], ['c4'])
+
+        statuses = dict(Demos.select(Demos.demo_id, Demos.status).tuples())
+        self.assertEqual(statuses, {
+            'ok': 'ready',
+            'gone': 'empty',
+            'stale': 'ready',
+            'busy': 'deploying',
+            'legacy': 'running'
+        })
+        self.assertIsNone(Demos.get(Demos.demo_id == 'gone').container_id)
+        self.assertEqual(
+            Operations.get(Operations.operation_id == 'interrupted').status,
+            'failed')
+
+        # The orphan is removed, the container of the busy demo is kept.
+        self.assertIn(('DELETE', '/containers/c4'), self.daemon.requests)
+        self.assertEqual([c['Id'] for c in self.daemon.containers],
+                         ['c1', 'c3', 'c5', 'c6'])
+
+    def test_update_demo_status(self):
+        self.daemon.containers[0]['State'] = 'exited'
+        demo = Demos.get(Demos.demo_id == 'ok')
+        tasks.update_demo_status(demo)
+        self.assertEqual(demo.status, 'exited')
+        # One call finds the labelled containers of the demo.
+        self.assertEqual(
+            [r for r in self.daemon.requests if r[1] == '/containers/json'],
+            [('GET', '/containers/json')])
+
+    def test_update_demo_status_notifies(self):
+        # The containers of the demo are cached with its instances.
+        demo_cache.invalidate()
+        self.assertEqual(
+            [i.container_id for i in demo_cache.get_instances('gone')],
+            ['c2'])
+        demo = Demos.get(Demos.demo_id == 'gone')
+        with mock.patch('origamid.database.publish_demo_status') as publish:
+            tasks.update_demo_status(demo)
+        publish.assert_called_once_with(demo)
+        self.assertEqual(publish.call_args[0][0].status, 'empty')
+        self.assertEqual(demo_cache.get_instances('gone'), [])
+        self.assertEqual(demo_cache.get('gone').status, 'empty')
+
+    def test_update_demo_status_after_redeploy(self):
+        demo = Demos.get(Demos.demo_id == 'gone')
+        find_demo_containers = tasks.find_demo_containers
+
+        def switch_while_looking_up(*args):
+            # The deploy task switches the demo to new containers while
+            # the containers read before are looked up.
+            Demos.update(container_id='c7', port=20007).where(
+                Demos.id == demo.id).execute()
+            DemoInstances.update(container_id='c7', port=20007).where(
+                DemoInstances.demo == demo).execute()
+            return find_demo_containers(*args)
+
+        with mock.patch('origamid.tasks.find_demo_containers',
+                        switch_while_looking_up):
+            tasks.update_demo_status(demo)
+        demo = Demos.get(Demos.demo_id == 'gone')
+        self.assertEqual((demo.container_id, demo.port, demo.status),
+                         ('c7', 20007, 'ready'))
+        self.assertEqual(
+            [(i.container_id, i.port) for i in demo.instances],
+            [('c7', 20007)])
+
+    def test_rebuild_node_state(self):
+        demo = Demos(demo_id='lost', log_id='5d41402a', replicas=2,
+                     memory_limit=1024**3)
+        self.daemon.containers = [
+            dict(container(cid, state=state), Created=created,
+                 ImageID='sha256:' + generation,
+                 Labels=get_container_labels(demo, generation, replica,
+                                             20001 + port, 'abc123'))
+            for cid, generation, replica, port, created, state in [
+                ('old-0', 'aaaa', 0, 0, 100, 'running'),
+                ('new-1', 'bbbb', 1, 3, 200, 'exited'),
+                ('new-0', 'bbbb', 0, 2, 200, 'running'),
+            ]
+        ] + [container('c1', 'ok')]
+
+        self.assertEqual(rebuild_node_state(self.node), ['lost'])
+        demo = Demos.get(Demos.demo_id == 'lost')
+        self.assertEqual(
+            (demo.log_id, demo.container_id, demo.port, demo.status,
+             demo.image_id, demo.replicas, demo.memory_limit, demo.node),
+            ('5d41402a', 'new-0', 20003, 'running', 'sha256:bbbb', 2,
+             1024**3, 'reconciled'))
+        self.assertEqual(
+            [(i.replica, i.container_id, i.port, i.status)
+             for i in demo.instances.order_by(DemoInstances.replica)],
+            [(0, 'new-0', 20003, 'running'), (1, 'new-1', 20004, 'exited')])
+        self.assertEqual(rebuild_node_state(self.node), [])
@@ -0,0 +1,138 @@
+import time
+import unittest
+
+from collections import namedtuple
+from docker.errors import APIError, NotFound
+from requests import Response
+from requests.exceptions import ConnectionError
+
+from origamid import resilience
+from origamid.constants import DOCKER_BREAKER_REPORT_GRACE
+from origamid.exceptions import OrigamiDockerConnectionError, \
+    OrigamiDockerUnavailableError
+from origamid.resilience import BREAKER_CLOSED, BREAKER_HALF_OPEN, \
+    BREAKER_OPEN, CircuitBreaker, call_docker, get_breaker, \
+    get_breaker_states, is_transient_error
+
+Node = namedtuple('Node', ['name', 'base_url'])
+
+
+class FlakyCall(object):
+    """
+    Docker call failing with the provided errors before it succeeds.
+    """
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self, client):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return 'ok'
+
+
+def api_error(status_code, explanation=''):
+    response = Response()
+    response.status_code = status_code
+    return APIError('', response=response, explanation=explanation)
+
+
+class TestResilience(unittest.TestCase):
+    def setUp(self):
+        self.node = Node('flaky-{}'.format(id(self)), None)
+        self.base_delay = resilience.DOCKER_RETRY_BASE_DELAY
+        resilience.DOCKER_RETRY_BASE_DELAY = 0
+
+    def tearDown(self):
+        resilience.DOCKER_RETRY_BASE_DELAY = self.base_delay
+
+    def test_is_transient_error(self):
+        self.assertTrue(is_transient_error(ConnectionError()))
+        self.assertTrue(is_transient_error(api_error(503)))
+        self.assertTrue(is_transient_error(api_error(500, 'i/o timeout')))
+        self.assertFalse(is_transient_error(api_error(500, 'bad image')))
+        self.assertFalse(is_transient_error(api_error(409, 'conflict')))
+        self.assertFalse(is_transient_error(NotFound('No such container')))
+        self.assertFalse(is_transient_error(ValueError()))
+
+    def test_retry_transient_errors(self):
+        call = FlakyCall(ConnectionError(), ConnectionError())
+        self.assertEqual(call_docker(self.node, 'inspect', call), 'ok')
+        self.assertEqual(call.calls, 3)
+        self.assertEqual(get_breaker(self.node).failures, 0)
+
+    def test_no_retry(self):
+        call = FlakyCall(ConnectionError())
+        with self.assertRaises(OrigamiDockerConnectionError):
+            call_docker(self.node, 'run', call, retry=False)
+        self.assertEqual(call.calls, 1)
+
+        call = FlakyCall(NotFound('No such container'))
+        with self.assertRaises(NotFound):
+            call_docker(self.node, 'inspect', call)
+        self.assertEqual(call.calls, 1)
+
+    def test_breaker_opens(self):
+        breaker = get_breaker(self.node)
+        breaker.reset_timeout = 60
+        for _ in range(breaker.failure_threshold):
+            breaker.record_failure()
+        self.assertEqual(breaker.state, BREAKER_OPEN)
+
+        call = FlakyCall()
+        with self.assertRaises(OrigamiDockerUnavailableError):
+            call_docker(self.node, 'inspect', call)
+        self.assertEqual(call.calls, 0)
+
+        states = get_breaker_states()
+        self.assertIn({
+            'node': self.node.name,
+            'state': BREAKER_OPEN,
+            'failures': breaker.failure_threshold,
+            'retry_at': breaker.opened_at + 60
+        }, states)
+
+    def test_breaker_half_open(self):
+        breaker = CircuitBreaker('half-open', failure_threshold=1,
+                                 reset_timeout=0.05)
+        breaker.record_failure()
+        self.assertFalse(breaker.allow())
+
+        time.sleep(0.05)
+        self.assertEqual(breaker.state, BREAKER_HALF_OPEN)
+        self.assertTrue(breaker.allow())
+        # A single probe call is let through.
+        self.assertFalse(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.state, BREAKER_CLOSED)
+
+    def test_reported_breaker_expires(self):
+        states = get_breaker_states([{
+            'node': 'worker-node',
+            'state': BREAKER_OPEN,
+            'failures': 5,
+            'retry_at': time.time() - 1,
+        }])
+        self.assertIn({
+            'node': 'worker-node',
+            'state': BREAKER_HALF_OPEN,
+            'failures': 5,
+            'retry_at': None
+        }, states)
+
+    def test_stale_reported_breaker_is_closed(self):
+        # The worker which reported the open breaker exited.
+        states = get_breaker_states([{
+            'node': 'gone-node',
+            'state': BREAKER_OPEN,
+            'failures': 5,
+            'retry_at': time.time() - DOCKER_BREAKER_REPORT_GRACE - 1,
+        }])
+        self.assertIn({
+            'node': 'gone-node',
+            'state': BREAKER_CLOSED,
+            'failures': 0,
+            'retry_at': None
+        }, states)
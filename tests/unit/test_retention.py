@@ -0,0 +1,73 @@
+import gzip
+import logging
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from origamid.retention import RotatingFileHandler, compressor, \
+    get_rotated_logs, rotate_deploy_log, sweep_deploy_logs
+
+
+class TestRetention(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_log(self, name, size):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as fp:
+            fp.write('x' * size)
+        return path
+
+    def test_deploy_log_retention(self):
+        logfile = os.path.join(self.directory, 'ffc806')
+        for _ in range(4):
+            self.write_log('ffc806', 1000)
+            rotate_deploy_log(logfile)
+            # Rotated logs are named after the millisecond of the rotation.
+            time.sleep(0.002)
+        self.write_log('ffc806', 1000)
+
+        stats = sweep_deploy_logs(self.directory, attempts=2, batch=1)
+        self.assertEqual((stats['compressed'], stats['removed']), (1, 2))
+        rotated = get_rotated_logs(self.directory)['ffc806']
+        self.assertEqual([r[2] for r in rotated], [True, False])
+        with gzip.open(rotated[0][1]) as fp:
+            self.assertEqual(len(fp.read()), 1000)
+
+        # Over the disk cap the previous attempts go, the current log stays.
+        sweep_deploy_logs(self.directory, attempts=2, disk_cap=1000)
+        self.assertEqual(os.listdir(self.directory), ['ffc806'])
+
+    def test_rotating_file_handler(self):
+        path = os.path.join(self.directory, 'origami.log')
+        handler = RotatingFileHandler(path, max_bytes=100, backup_count=1)
+        logger = logging.getLogger('test_retention')
+        logger.propagate = False
+        logger.addHandler(handler)
+        try:
+            for _ in range(3):
+                logger.error('x' * 80)
+                time.sleep(0.002)
+        finally:
+            logger.removeHandler(handler)
+            handler.close()
+
+        # Wait for the background compression of the rotated logs.
+        done = []
+        compressor.submit(self.write_log('marker', 1),
+                          lambda: done.append(True))
+        for _ in range(100):
+            if done:
+                break
+            time.sleep(0.01)
+
+        rotated = get_rotated_logs(self.directory)['origami.log']
+        self.assertEqual(len(rotated), 1)
+        self.assertTrue(rotated[0][2])
+        with open(path) as fp:
+            self.assertEqual(fp.read(), 'x' * 80 + '\n')
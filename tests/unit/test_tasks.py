@@ -1 +1,164 @@
-# TODO: write tests
+import os
+import shutil
+import tempfile
+import zipfile
+
+from unittest import mock
+
+from origamid import tasks
+from origamid.constants import ORIGAMI_CONFIG_DIR, ORIGAMI_DEMOS_DIRNAME, \
+    TASK_BACKEND_ENV, TASK_BACKEND_LOCAL, ORIGAMI_LABEL_REPLICA, \
+    ORIGAMI_LABEL_PORT, ORIGAMI_BUNDLE_ZIP
+from origamid.database import Demos, DemoInstances, Nodes, \
+    PortReservations
+
+from .db_case import DatabaseTestCase
+from .fake_docker import FakeDockerDaemon
+
+
+class TestDeployDemo(DatabaseTestCase):
+    def setUp(self):
+        super(TestDeployDemo, self).setUp()
+        self.home = tempfile.mkdtemp()
+        environ = mock.patch.dict(os.environ, {
+            'HOME': self.home,
+            TASK_BACKEND_ENV: TASK_BACKEND_LOCAL
+        })
+        environ.start()
+        self.addCleanup(environ.stop)
+
+        self.demo_dir = os.path.join(self.home, ORIGAMI_CONFIG_DIR,
+                                     ORIGAMI_DEMOS_DIRNAME, 'ffc806')
+        os.makedirs(self.demo_dir)
+        with open(os.path.join(self.demo_dir, 'Dockerfile'), 'w') as file:
+            file.write('FROM python:3.6\nCMD ["python", "main.py"]\n')
+
+        self.daemon = FakeDockerDaemon().start()
+        Nodes.create(name='node-a', base_url=self.daemon.base_url)
+
+    def tearDown(self):
+        self.daemon.stop()
+        shutil.rmtree(self.home)
+        super(TestDeployDemo, self).tearDown()
+
+    def deploy(self, replicas=2, ready=True, while_probing=None):
+        """
+        Deploy the demo, the readiness probe succeeds if `ready` is set.
+        `while_probing` is called with the ports and the new containers
+        while they are probed.
+        """
+
+        def wait_until_ready(host, ports, probe=None, containers=None):
+            if while_probing:
+                while_probing(ports, containers)
+            return ready
+
+        with mock.patch('origamid.tasks.wait_until_ready', wait_until_ready):
+            return tasks.deploy_demo('ffc806', self.demo_dir, replicas,
+                                     'node-a')
+
+    def get_state(self):
+        demo = Demos.get(Demos.demo_id == 'ffc806')
+        return (demo.status, demo.container_id, demo.port, [
+            (i.container_id, i.port)
+            for i in demo.instances.order_by(DemoInstances.replica)
+        ])
+
+    def running(self):
+        # The replicas are started in parallel, in any order.
+        return sorted(c['Id'] for c in self.daemon.containers
+                      if c['State'] == 'running')
+
+    def test_demo_runs_replicas(self):
+        self.assertIsNone(self.deploy(replicas=3))
+        status, container_id, port, instances = self.get_state()
+        self.assertEqual(status, 'ready')
+        self.assertEqual(len(instances), 3)
+        self.assertEqual(self.running(), sorted(cid for cid, _ in instances))
+        self.assertEqual(len(set(p for _, p in instances)), 3)
+        self.assertEqual((container_id, port), instances[0])
+
+        # Each container runs one replica on the port of its instance.
+        labels = {c['Id']: c['Labels'] for c in self.daemon.containers}
+        self.assertEqual(
+            [(labels[cid][ORIGAMI_LABEL_REPLICA],
+              labels[cid][ORIGAMI_LABEL_PORT]) for cid, _ in instances],
+            [('{}'.format(r), '{}'.format(p))
+             for r, (_, p) in enumerate(instances)])
+
+    def test_old_containers_serve_until_switch(self):
+        self.assertIsNone(self.deploy())
+        old = self.get_state()
+        old_ids = sorted(cid for cid, _ in old[3])
+        self.assertEqual(old[0], 'ready')
+        self.assertEqual(self.running(), old_ids)
+
+        def while_probing(ports, containers):
+            # Nothing is switched before the new containers are ready.
+            self.assertEqual(self.get_state()[1:], old[1:])
+            self.assertEqual(self.get_state()[0], 'redeploying')
+            self.assertEqual(self.running(),
+                             sorted(old_ids + [c.id for c in containers]))
+            self.assertFalse(set(ports) & set(port for _, port in old[3]))
+            self.assertEqual(
+                sorted(r.port for r in PortReservations.select()), ports)
+
+        self.assertIsNone(self.deploy(while_probing=while_probing))
+        status, container_id, port, instances = self.get_state()
+        self.assertEqual(status, 'ready')
+        self.assertNotEqual((container_id, port), old[1:3])
+        self.assertEqual(self.running(),
+                         sorted(cid for cid, _ in instances))
+        self.assertEqual(PortReservations.select().count(), 0)
+
+    def test_failed_readiness_rolls_back(self):
+        self.assertIsNone(self.deploy())
+        old = self.get_state()
+        new_ids = []
+
+        def while_probing(ports, containers):
+            new_ids.extend(c.id for c in containers)
+
+        error = self.deploy(ready=False, while_probing=while_probing)
+        self.assertIn('did not become ready', error)
+        self.assertEqual(self.get_state(), old)
+        self.assertEqual(self.running(), sorted(cid for cid, _ in old[3]))
+        removed = [path.split('/')[-1] for method, path in
+                   self.daemon.requests if method == 'DELETE']
+        self.assertEqual(sorted(removed), sorted(new_ids))
+        self.assertEqual(PortReservations.select().count(), 0)
+
+    def test_missing_bundle_is_reported(self):
+        shutil.rmtree(self.demo_dir)
+        error = self.deploy()
+        self.assertIn('Bundle of demo ffc806 not found in {}'.format(
+            self.demo_dir), error)
+        self.assertEqual(self.get_state()[0], 'error')
+        self.assertNotIn(('POST', '/build'), self.daemon.requests)
+
+    def test_invalid_bundle_is_reported(self):
+        bundle = os.path.join(self.demo_dir, ORIGAMI_BUNDLE_ZIP)
+        with zipfile.ZipFile(bundle, 'w') as zip_file:
+            zip_file.writestr('Dockerfile', 'FROM python:3.6\n')
+            zip_file.writestr('../main.py', 'print("escaped")\n')
+        error = self.deploy()
+        self.assertIn('Invalid bundle for ffc806', error)
+        self.assertIn('Invalid path in bundle : ../main.py', error)
+        self.assertEqual(self.get_state()[0], 'error')
+        self.assertEqual(self.daemon.containers, [])
+
+    def test_failed_build_rolls_back(self):
+        self.assertIsNone(self.deploy())
+        old = self.get_state()
+
+        self.daemon.build_error = 'The command returned a non-zero code: 1'
+        error = self.deploy()
+        self.assertIn('Error while building image for ffc806', error)
+        self.assertIn('non-zero code: 1', error)
+        self.assertEqual(self.get_state(), old)
+        self.assertEqual(self.running(), sorted(cid for cid, _ in old[3]))
+
+    def test_failed_build_of_new_demo(self):
+        self.daemon.build_error = 'pull access denied'
+        self.assertIn('pull access denied', self.deploy())
+        self.assertEqual(self.get_state(), ('error', None, None, []))
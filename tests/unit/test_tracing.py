@@ -0,0 +1,61 @@
+import time
+
+from origamid.constants import TRACE_HEADER
+from origamid.database import Spans
+from origamid.tracing import span, get_current_span, get_trace, \
+    get_trace_headers, get_slowest_traces, set_remote_context, \
+    clear_remote_context
+
+from .db_case import DatabaseTestCase
+
+
+class TestTracing(DatabaseTestCase):
+    def test_nested_spans(self):
+        self.assertIsNone(get_current_span())
+        with span('deploy_trigger', demo_id='ffc806') as root:
+            with span('validate'):
+                pass
+            with span('build') as build:
+                time.sleep(0.02)
+                build.set(image_id='sha256:abc')
+            # Spans are only written once the root span ends.
+            self.assertEqual(Spans.select().count(), 0)
+
+        trace = get_trace(root.trace_id)
+        self.assertEqual([s['name'] for s in trace['spans']],
+                         ['deploy_trigger', 'validate', 'build'])
+        self.assertEqual(trace['slowest'], 'build')
+        self.assertEqual(trace['spans'][2]['parent_id'], root.span_id)
+        self.assertEqual(trace['spans'][2]['attributes'],
+                         {'image_id': 'sha256:abc'})
+        self.assertIsNone(get_trace('missing'))
+
+    def test_errors_are_recorded(self):
+        with self.assertRaises(ValueError):
+            with span('deploy_trigger') as root:
+                raise ValueError('Invalid bundle')
+        self.assertEqual(get_trace(root.trace_id)['spans'][0]['error'],
+                         'Invalid bundle')
+
+    def test_remote_context(self):
+        with span('deploy_trigger') as root:
+            headers = get_trace_headers()
+        self.assertEqual(get_trace_headers(), {})
+
+        # The worker side of the task.
+        set_remote_context(headers)
+        with span('deploy_demo') as deploy:
+            pass
+        clear_remote_context()
+
+        self.assertEqual(deploy.trace_id, root.trace_id)
+        self.assertEqual(deploy.parent_id, headers[TRACE_HEADER]['parent_id'])
+        trace = get_trace(root.trace_id)
+        self.assertEqual(
+            sorted(s['name'] for s in trace['spans']),
+            ['deploy_demo', 'deploy_trigger', 'queue'])
+
+        traces = get_slowest_traces('deploy_trigger')
+        self.assertEqual([t['trace_id'] for t in traces], [root.trace_id])
+        self.assertEqual(traces[0]['spans'], 3)
+        self.assertEqual(get_slowest_traces('remove'), [])
@@ -0,0 +1,91 @@
+import hashlib
+import io
+import json
+import os
+import zipfile
+
+from tornado.testing import AsyncHTTPTestCase
+from tornado.web import Application
+
+from origamid.database import Uploads
+from origamid.uploads import BundleUploadHandler, get_uploaded_bundle
+
+from .db_case import DatabaseTestCase
+
+
+def make_bundle():
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w') as bundle:
+        bundle.writestr('main.py', os.urandom(5000))
+    return buf.getvalue()
+
+
+class TestUploads(DatabaseTestCase, AsyncHTTPTestCase):
+    def get_app(self):
+        return Application([
+            (r'/uploads', BundleUploadHandler),
+            (r'/uploads/([^/]+)', BundleUploadHandler),
+        ])
+
+    def create(self, bundle, sha256=None):
+        url = '/uploads?size={}'.format(len(bundle))
+        if sha256:
+            url += '&sha256={}'.format(sha256)
+        response = self.fetch(url, method='POST', body='')
+        self.assertEqual(response.code, 201)
+        return self.json(response)['upload_id']
+
+    def put(self, upload_id, bundle, start, end):
+        return self.fetch(
+            '/uploads/{}'.format(upload_id),
+            method='PUT',
+            body=bundle[start:end + 1],
+            headers={
+                'Content-Range': 'bytes {}-{}/{}'.format(
+                    start, end, len(bundle))
+            })
+
+    def json(self, response):
+        return json.loads(response.body.decode())
+
+    def test_resumable_upload(self):
+        bundle = make_bundle()
+        upload_id = self.create(bundle, hashlib.sha256(bundle).hexdigest())
+
+        response = self.put(upload_id, bundle, 0, 999)
+        self.assertEqual(response.code, 202)
+        self.assertEqual(self.json(response)['offset'], 1000)
+
+        # A chunk which does not start at the offset is refused.
+        response = self.put(upload_id, bundle, 2000, 2999)
+        self.assertEqual(response.code, 409)
+        self.assertEqual(self.json(response)['offset'], 1000)
+
+        response = self.put(upload_id, bundle, 1000, len(bundle) - 1)
+        self.assertEqual(response.code, 200)
+        self.assertEqual(self.json(response)['status'], 'complete')
+        with open(get_uploaded_bundle(upload_id), 'rb') as fp:
+            self.assertEqual(fp.read(), bundle)
+
+    def test_checksum_mismatch(self):
+        bundle = make_bundle()
+        upload_id = self.create(bundle, hashlib.sha256(b'other').hexdigest())
+        response = self.put(upload_id, bundle, 0, len(bundle) - 1)
+        self.assertEqual(response.code, 400)
+        self.assertIn('Checksum mismatch', self.json(response)['error'])
+
+    def test_rejects_body_larger_than_range(self):
+        bundle = make_bundle()
+        upload_id = self.create(bundle)
+        response = self.fetch(
+            '/uploads/{}'.format(upload_id),
+            method='PUT',
+            body=bundle,
+            headers={'Content-Range': 'bytes 0-99/{}'.format(len(bundle))})
+        self.assertNotEqual(response.code, 200)
+        self.assertEqual(Uploads.get().status, 'pending')
+
+    def test_rejects_too_large(self):
+        response = self.fetch('/uploads?size={}'.format(10**12),
+                              method='POST', body='')
+        self.assertEqual(response.code, 413)
@@ -0,0 +1,60 @@
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+import zipfile
+
+from origamid.exceptions import InvalidDemoBundleException
+from origamid.utils.context import is_excluded, stream_build_context
+
+
+class TestContext(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.bundle = os.path.join(self.dir, 'bundle.zip')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def make_bundle(self, files):
+        with zipfile.ZipFile(self.bundle, 'w') as bundle:
+            for name, contents in files.items():
+                bundle.writestr(name, contents)
+
+    def read_context(self, chunk_size=7):
+        stream = b''.join(stream_build_context(self.bundle, chunk_size))
+        self.assertEqual(len(stream) % tarfile.BLOCKSIZE, 0)
+        with tarfile.open(fileobj=io.BytesIO(stream)) as tar:
+            return {
+                m.name: tar.extractfile(m).read()
+                for m in tar.getmembers() if m.isfile()
+            }
+
+    def test_stream_build_context(self):
+        files = {
+            'Dockerfile': b'FROM python:3.6\n',
+            'main.py': b'print("demo")\n' * 100,
+            'model/weights.bin': os.urandom(3000),
+            'model/cache/tmp.bin': b'cache',
+            'data/keep.txt': b'keep',
+            'data/skip.txt': b'skip',
+            '.dockerignore': b'# Comment\nmodel/cache\ndata/*\n!data/keep*\n'
+        }
+        self.make_bundle(files)
+        for name in ('model/cache/tmp.bin', 'data/skip.txt'):
+            del files[name]
+        self.assertEqual(self.read_context(), files)
+
+    def test_invalid_path(self):
+        self.make_bundle({'../Dockerfile': b'FROM python:3.6\n'})
+        with self.assertRaises(InvalidDemoBundleException):
+            self.read_context()
+
+    def test_is_excluded(self):
+        patterns = ['*.pyc', '!keep.pyc', 'build']
+        self.assertTrue(is_excluded('main.pyc', patterns))
+        self.assertFalse(is_excluded('keep.pyc', patterns))
+        self.assertTrue(is_excluded('build/lib/main.py', patterns))
+        self.assertFalse(is_excluded('src/main.py', patterns))
@@ -0,0 +1,77 @@
+import unittest
+
+from origamid.exceptions import InvalidDemoBundleException
+from origamid.utils.dockerfile import parse_dockerfile, \
+    validate_dockerfile_contents
+
+DOCKERFILE = """\
+# escape=\\
+ARG BASE=python:3.6-slim
+FROM $BASE AS base
+WORKDIR /demo
+COPY requirements.txt .
+# Comments inside a continuation are skipped.
+RUN pip install -r requirements.txt \\
+    # cached
+    && rm -rf /root/.cache
+COPY . .
+EXPOSE 9001
+CMD ["gunicorn", "--bind", "0.0.0.0:9001", "main:app"]
+"""
+
+
+class TestDockerfile(unittest.TestCase):
+    def assertInvalid(self, contents, reason):
+        with self.assertRaises(InvalidDemoBundleException) as context:
+            validate_dockerfile_contents(contents)
+        self.assertIn(reason, '{}'.format(context.exception))
+
+    def test_parse_dockerfile(self):
+        instructions = parse_dockerfile(DOCKERFILE)
+        self.assertEqual([i[1] for i in instructions], [
+            'ARG', 'FROM', 'WORKDIR', 'COPY', 'RUN', 'COPY', 'EXPOSE', 'CMD'
+        ])
+        self.assertEqual(
+            instructions[4],
+            (7, 'RUN', 'pip install -r requirements.txt  && rm -rf '
+             '/root/.cache'))
+
+    def test_valid_dockerfile(self):
+        self.assertEqual(validate_dockerfile_contents(DOCKERFILE), [])
+
+    def test_invalid_dockerfiles(self):
+        self.assertInvalid('RUN pip install flask\n', 'must start with a FROM')
+        self.assertInvalid('FROM python:3.6\nRUNN ls\n', 'line 2: unknown')
+        self.assertInvalid('FROM Python:3.6\n', 'invalid image')
+        self.assertInvalid('FROM python:3.6\nWORKDIR\n', 'requires arguments')
+        self.assertInvalid('FROM python:3.6\nCMD ["python", 3]\n',
+                           'JSON array of strings')
+        self.assertInvalid('FROM python:3.6\nEXPOSE http\n', 'invalid port')
+        self.assertInvalid(
+            'FROM python:3.6\nCMD python main.py --port 8000\n',
+            'serves on port 8000 but must serve on port 9001')
+
+    def test_warnings(self):
+        warnings = validate_dockerfile_contents(
+            'FROM python:3.6\nCOPY . /demo\n'
+            'RUN pip install -r /demo/requirements.txt\n'
+            'EXPOSE 8000\nCMD python main.py\nCMD python demo.py\n')
+        self.assertEqual(len(warnings), 3)
+        self.assertIn('copied on line 2 before pip install', warnings[0])
+        self.assertIn('exposes 8000', warnings[1])
+        self.assertIn('2 CMD instructions', warnings[2])
+
+    def test_ports_of_other_services(self):
+        for command in ('["python", "main.py", "--redis-port=6379"]',
+                        'python main.py --db_port=5432',
+                        'python main.py --port=9001 --redis-port 6379'):
+            self.assertEqual(validate_dockerfile_contents(
+                'FROM python:3.6\nCMD {}\n'.format(command)), [])
+        self.assertInvalid(
+            'FROM python:3.6\nCMD ["python", "main.py", "port=8000"]\n',
+            'serves on port 8000')
+
+    def test_only_final_stage_command(self):
+        validate_dockerfile_contents(
+            'FROM node:10 AS assets\nCMD npm start --port 3000\n'
+            'FROM python:3.6\nCMD python main.py --port 9001\n')
@@ -0,0 +1,104 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+
+from unittest import mock
+
+from origamid.exceptions import InvalidDemoBundleException
+from origamid.utils.manifest import get_manifest_digest, hash_bundle, \
+    load_manifest, merge_delta_bundle
+from origamid.utils.context import stage_bundle
+
+
+def make_zip(path, files):
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as bundle:
+        for name, contents in files.items():
+            bundle.writestr(name, contents)
+
+
+class TestManifest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.demo_dir = os.path.join(self.dir, 'demo')
+        os.makedirs(self.demo_dir)
+        self.bundle = os.path.join(self.dir, 'bundle.zip')
+        self.delta = os.path.join(self.dir, 'delta.zip')
+        make_zip(self.bundle, {
+            'Dockerfile': b'FROM python:3.6\n',
+            'main.py': b'print("v1")\n',
+            'old.py': b'pass\n',
+            'model/weights.bin': b'\x00' * 4096
+        })
+        stage_bundle(self.bundle, self.demo_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_manifest(self):
+        files = load_manifest(self.demo_dir)
+        self.assertEqual(files['main.py'], {
+            'size': 12,
+            'sha256': hashlib.sha256(b'print("v1")\n').hexdigest()
+        })
+        self.assertEqual(load_manifest(self.demo_dir), files)
+        self.assertIsNone(load_manifest(os.path.join(self.dir, 'missing')))
+
+    def test_merge_delta_bundle(self):
+        digest = get_manifest_digest(load_manifest(self.demo_dir))
+        make_zip(self.delta, {'main.py': b'print("v2")\n', 'new.py': b'x\n'})
+        files = merge_delta_bundle(self.demo_dir, self.delta, ['old.py'])
+
+        staged = os.path.join(self.demo_dir, 'bundle.zip')
+        with zipfile.ZipFile(staged) as bundle:
+            self.assertEqual(
+                sorted(bundle.namelist()),
+                ['Dockerfile', 'main.py', 'model/weights.bin', 'new.py'])
+            self.assertEqual(bundle.read('main.py'), b'print("v2")\n')
+        self.assertEqual(files, hash_bundle(staged))
+        self.assertNotEqual(get_manifest_digest(files), digest)
+        # The bundle of the client is hard linked, it is never modified.
+        with zipfile.ZipFile(self.bundle) as bundle:
+            self.assertEqual(bundle.read('main.py'), b'print("v1")\n')
+
+    def test_merge_copies_compressed_files(self):
+        make_zip(self.delta, {'main.py': b'print("v2")\n'})
+        staged = os.path.join(self.demo_dir, 'bundle.zip')
+        with zipfile.ZipFile(staged) as bundle:
+            weights = bundle.getinfo('model/weights.bin')
+        load_manifest(self.demo_dir)
+
+        opened = []
+        open_member = zipfile.ZipFile.open
+
+        def record_open(bundle, name, *args, **kwargs):
+            opened.append(os.path.basename(bundle.filename))
+            return open_member(bundle, name, *args, **kwargs)
+
+        with mock.patch.object(zipfile.ZipFile, 'open', record_open):
+            merge_delta_bundle(self.demo_dir, self.delta)
+        # Only the delta is read to hash its files.
+        self.assertEqual(opened, ['delta.zip'])
+
+        with zipfile.ZipFile(staged) as bundle:
+            self.assertIsNone(bundle.testzip())
+            copied = bundle.getinfo('model/weights.bin')
+            self.assertEqual(bundle.read('main.py'), b'print("v2")\n')
+        self.assertEqual(
+            (copied.compress_type, copied.compress_size, copied.CRC),
+            (weights.compress_type, weights.compress_size, weights.CRC))
+
+    def test_failed_merge_keeps_bundle(self):
+        make_zip(self.delta, {'main.py': b'print("v2")\n'})
+
+        def validate(path):
+            raise InvalidDemoBundleException('Dockerfile is missing')
+
+        with self.assertRaises(InvalidDemoBundleException):
+            merge_delta_bundle(self.demo_dir, self.delta, ['Dockerfile'],
+                               validate)
+        self.assertEqual(sorted(os.listdir(self.demo_dir)),
+                         ['bundle.zip', 'manifest.json'])
+        self.assertIn('Dockerfile', load_manifest(self.demo_dir))